@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2014-2015 Davide Andreoli <dave@gurumeditation.it>
+#
+# This file is part of Egitu.
+#
+# Egitu is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# Egitu is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Egitu.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Headless benchmarks for the egitu backend and layout hot paths.
+
+Synthetic repos are created (in a temporary folder) and the following
+operations are timed, without creating any window:
+ - refresh: GitBackend.refresh() (all the git commands + parsing)
+ - request_commits: GitBackend.request_commits() (git log + parsing)
+ - parse_commits: parsing of a pre-fetched git log output
+ - dag_lanes: DAG columns assignment for all the commits
+ - diff_markup: markup generation for the diff of a big commit
+ - status_parse: parsing of a pre-fetched 'git status' output
+
+Results are printed (or saved with -o) as JSON, to be compared across
+versions. All the egitu debug output is redirected to stderr.
+
+Usage:
+    python benchmarks/bench.py [-o results.json] [--repeat N] [--scale N]
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import argparse
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from efl import ecore
+
+from egitu import __version__
+from egitu.vcs import GitBackend, Status
+from egitu.utils import diff_to_markup
+from egitu.dagview import DagLanes
+from synthrepo import make_repo
+
+
+# name: make_repo() arguments (commits are multiplied by --scale)
+REPOS = {
+    'linear': dict(commits=5000),
+    'wide_merges': dict(commits=1000, branches=500, width=8),
+    'many_refs': dict(commits=2000, refs=2000),
+    'large_diff': dict(commits=100, diff_lines=50000),
+    'many_untracked': dict(commits=100, untracked=20000),
+}
+
+
+def git_output(repo, *args):
+    out = subprocess.check_output(('git',) + args, cwd=repo)
+    return out.decode('utf-8', 'replace')
+
+
+def timed(func, repeat):
+    times = []
+    for i in range(repeat):
+        t0 = time.time()
+        func()
+        times.append(time.time() - t0)
+    return {'min': min(times), 'max': max(times),
+            'mean': sum(times) / len(times), 'runs': len(times)}
+
+
+def run_in_mainloop(start_func):
+    """ Call start_func(done_cb) and wait (in the ecore loop) for done_cb """
+    def _done_cb(*args):
+        ecore.main_loop_quit()
+    start_func(_done_cb)
+    ecore.main_loop_begin()
+
+
+def bench_repo(path, repeat):
+    results = {}
+    backend = GitBackend()
+    run_in_mainloop(lambda cb: backend.load_from_url(path, cb))
+
+    # refresh
+    results['refresh'] = timed(
+        lambda: run_in_mainloop(lambda cb: backend.refresh(cb)), repeat)
+
+    # request_commits (the full history, as the DAG view does)
+    results['request_commits'] = timed(
+        lambda: run_in_mainloop(
+            lambda cb: backend.request_commits(cb, lambda c: None)), repeat)
+
+    # parse_commits (no git involved)
+    out = git_output(path, 'log', '--all',
+                     '--pretty=tformat:' + GitBackend.LOG_FORMAT)
+    records = [r.lstrip('\n') for r in out.split(chr(0x03)) if r.strip()]
+    commits = []
+    def _parse():
+        del commits[:]
+        for r in records:
+            commits.append(backend._parse_commit(r))
+    results['parse_commits'] = timed(_parse, repeat)
+    results['parse_commits']['commits'] = len(records)
+
+    # dag_lanes
+    def _lanes():
+        lanes = DagLanes()
+        for c in commits:
+            lanes.assign(c)
+    results['dag_lanes'] = timed(_lanes, repeat)
+
+    # diff_markup (the diff of the last commit)
+    lines = git_output(path, 'diff', '--no-prefix', 'HEAD^..HEAD').splitlines()
+    results['diff_markup'] = timed(lambda: diff_to_markup(lines), repeat)
+    results['diff_markup']['lines'] = len(lines)
+
+    # status_parse
+    lines = git_output(path, 'status', '--porcelain', '-b', '-u').splitlines()
+    def _status():
+        backend._status = Status()
+        backend._parse_status(lines)
+    results['status_parse'] = timed(_status, repeat)
+    results['status_parse']['lines'] = len(lines)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Egitu headless benchmarks')
+    parser.add_argument('-o', '--output', help='save the JSON results here')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='multiply the size of all the repos')
+    parser.add_argument('--only', action='append', choices=sorted(REPOS),
+                        help='only run the given repo (can be repeated)')
+    parser.add_argument('--keep', action='store_true',
+                        help='do not delete the generated repos')
+    args = parser.parse_args()
+
+    report = {
+        'egitu_version': __version__,
+        'python': platform.python_version(),
+        'git': subprocess.check_output(['git', '--version']).decode().strip(),
+        'timestamp': int(time.time()),
+        'repeat': args.repeat,
+        'scale': args.scale,
+        'repos': {},
+    }
+
+    tmp = tempfile.mkdtemp(prefix='egitu-bench-')
+    real_stdout = sys.stdout
+    sys.stdout = sys.stderr # egitu debug prints must not mess the JSON
+    try:
+        for name in args.only or sorted(REPOS):
+            params = dict(REPOS[name])
+            for key in ('commits', 'branches', 'refs', 'diff_lines', 'untracked'):
+                if key in params:
+                    params[key] = int(params[key] * args.scale)
+            path = make_repo(os.path.join(tmp, name), **params)
+            print('Benchmarking repo: %s %s' % (name, params))
+            report['repos'][name] = {'params': params,
+                                     'results': bench_repo(path, args.repeat)}
+    finally:
+        sys.stdout = real_stdout
+        if args.keep:
+            print('Repos kept in: %s' % tmp, file=sys.stderr)
+        else:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2014-2015 Davide Andreoli <dave@gurumeditation.it>
+#
+# This file is part of Egitu.
+#
+# Egitu is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# Egitu is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Egitu.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Check the avatar downloader against a local HTTP stand-in of gravatar.
+
+A small HTTP server (in a thread) serve fake avatars, slowly, and answer
+404 for the hashes that start with "0". GravatarService.url_template and
+cache_folder are pointed to the server and to a temporary folder, then:
+ - fanout: many requests of the same image make a single download, and
+   the image is not visible in cache until fully downloaded
+ - negative: a 404 leaves no file and is not requested again (TTL)
+ - concurrency: no more than max_jobs downloads run at the same time
+ - evict: the cache folder is shrunk below max_cache_size
+
+Exit with status 1 if any check fail.
+
+Usage:
+    python benchmarks/gravatar_standin.py
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError: # python 2
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from efl import ecore
+
+from egitu.utils import GravatarService
+
+
+IMAGE_SIZE = 20000 # bytes of each fake avatar
+SERVE_DELAY = 0.3  # seconds to serve each avatar
+TIMEOUT = 20       # seconds to wait for the downloads of each check
+
+
+class StandinServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StandinHandler)
+        self.lock = threading.Lock()
+        self.requests = dict() # 'hash_key': number of requests
+        self.running = 0
+        self.max_running = 0
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        hash_key = self.path.split('?')[0].rsplit('/', 1)[-1]
+        with server.lock:
+            server.requests[hash_key] = server.requests.get(hash_key, 0) + 1
+            server.running += 1
+            server.max_running = max(server.max_running, server.running)
+        try:
+            if hash_key.startswith('0'):
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Content-Length', str(IMAGE_SIZE))
+            self.end_headers()
+            # half now and half later, to catch partial files
+            self.wfile.write(b'x' * (IMAGE_SIZE // 2))
+            self.wfile.flush()
+            time.sleep(SERVE_DELAY)
+            self.wfile.write(b'x' * (IMAGE_SIZE - IMAGE_SIZE // 2))
+        finally:
+            with server.lock:
+                server.running -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+def wait_for(func):
+    """ Run the ecore main loop until func() is True (or the timeout) """
+    t0 = time.time()
+    def _timer_cb():
+        if func() or time.time() - t0 > TIMEOUT:
+            ecore.main_loop_quit()
+            return False
+        return True
+    ecore.Timer(0.05, _timer_cb)
+    ecore.main_loop_begin()
+    return func()
+
+
+def check_fanout(service, server):
+    hash_key = 'a' * 32
+    paths = []
+    for i in range(5):
+        service.request(hash_key, 60, lambda key, path: paths.append(path))
+    # half of the image is written, the other half arrive after SERVE_DELAY
+    wait_for(lambda: server.running > 0)
+    partial = service.cached_image(hash_key, 60)
+    done = wait_for(lambda: len(paths) == 5)
+    errors = []
+    if not done:
+        errors.append('only %d of 5 callbacks called' % len(paths))
+    if server.requests.get(hash_key) != 1:
+        errors.append('%s downloads instead of 1' % server.requests.get(hash_key))
+    if partial is not None:
+        errors.append('image in cache while downloading')
+    if done and os.path.getsize(paths[0]) != IMAGE_SIZE:
+        errors.append('incomplete image: %d bytes' % os.path.getsize(paths[0]))
+    if done and service.cached_image(hash_key, 60) != paths[0]:
+        errors.append('image not in cache after the download')
+    return errors
+
+
+def check_negative(service, server):
+    hash_key = '0' * 32
+    called = []
+    service.request(hash_key, 60, lambda key, path: called.append(path))
+    wait_for(lambda: hash_key not in service._waiting)
+    errors = []
+    if called:
+        errors.append('callback called for a 404')
+    if service.cached_image(hash_key, 60) is not None or \
+       any(f.startswith(hash_key) for f in os.listdir(service.cache_folder)):
+        errors.append('file left in cache for a 404')
+    if service.request(hash_key, 60, lambda key, path: None) is not False:
+        errors.append('404 requested again before the TTL')
+    if server.requests.get(hash_key) != 1:
+        errors.append('%s downloads instead of 1' % server.requests.get(hash_key))
+    return errors
+
+
+def check_concurrency(service, server):
+    keys = ['b%031x' % i for i in range(10)]
+    paths = []
+    for hash_key in keys:
+        service.request(hash_key, 60, lambda key, path: paths.append(path))
+    wait_for(lambda: len(paths) == len(keys))
+    errors = []
+    if len(paths) != len(keys):
+        errors.append('only %d of %d downloads done' % (len(paths), len(keys)))
+    if server.max_running > service.max_jobs:
+        errors.append('%d concurrent downloads (max_jobs: %d)' % (
+                      server.max_running, service.max_jobs))
+    return errors
+
+
+def check_evict(service, server):
+    service.max_cache_size = IMAGE_SIZE * 3
+    service.evict()
+    total = sum(os.path.getsize(os.path.join(service.cache_folder, f))
+                for f in os.listdir(service.cache_folder))
+    if total > service.max_cache_size:
+        return ['cache is %d bytes (max: %d)' % (total, service.max_cache_size)]
+    return []
+
+
+CHECKS = [('fanout', check_fanout), ('negative', check_negative),
+          ('concurrency', check_concurrency), ('evict', check_evict)]
+
+
+def main():
+    server = StandinServer()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    tmp = tempfile.mkdtemp(prefix='egitu-gravatar-')
+    service = GravatarService()
+    service.url_template = 'http://127.0.0.1:%d/avatar/%%s?size=%%d&d=%%s' % \
+                           server.server_address[1]
+    service.cache_folder = tmp
+    service.max_jobs = 2
+
+    failed = 0
+    try:
+        for name, check in CHECKS:
+            errors = check(service, server)
+            print('%-18s %s' % (name, 'ok' if not errors else 'FAILED'))
+            for error in errors:
+                print('    ' + error)
+            failed += len(errors) > 0
+    finally:
+        server.shutdown()
+        shutil.rmtree(tmp, ignore_errors=True)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
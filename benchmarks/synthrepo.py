@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2014-2015 Davide Andreoli <dave@gurumeditation.it>
+#
+# This file is part of Egitu.
+#
+# Egitu is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# Egitu is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Egitu.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Generate synthetic git repositories of configurable size.
+
+The history is written with 'git fast-import', so even repos with
+hundreds of thousands of commits are created in a few seconds.
+
+Usage:
+    python synthrepo.py <folder> [--commits N] [--branches N] [--width N]
+                                 [--refs N] [--diff-lines N] [--untracked N]
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import os
+import sys
+import random
+import argparse
+import subprocess
+
+
+AUTHORS = [('Alice Dev', 'alice@example.com'),
+           ('Bob Hacker', 'bob@example.com'),
+           ('Carol Coder', 'carol@example.com'),
+           ('Dave Tester', 'dave@example.com')]
+
+WORDS = ('fix', 'add', 'remove', 'refactor', 'improve', 'speed', 'up',
+         'parser', 'dag', 'diff', 'status', 'branch', 'tag', 'remote',
+         'widget', 'theme', 'cache', 'the', 'a', 'of', 'for', 'in')
+
+
+class FastImportStream(object):
+    """ Accumulate a git fast-import stream """
+    def __init__(self, seed=0):
+        self.chunks = []
+        self.mark = 0
+        self.ts = 1400000000
+        self.rnd = random.Random(seed)
+
+    def _data(self, text):
+        raw = text.encode('utf-8')
+        self.chunks.append(b'data ' + str(len(raw)).encode('ascii') + b'\n')
+        self.chunks.append(raw + b'\n')
+
+    def _line(self, text):
+        self.chunks.append(text.encode('utf-8') + b'\n')
+
+    def message(self):
+        words = [self.rnd.choice(WORDS) for _ in range(self.rnd.randint(3, 8))]
+        title = ' '.join(words).capitalize()
+        body = ' '.join(self.rnd.choice(WORDS) for _ in range(20))
+        return title + '\n\n' + body + '\n'
+
+    def commit(self, ref, parents, files):
+        """ files: dict of {path: content}, return the mark of the commit """
+        self.mark += 1
+        self.ts += self.rnd.randint(60, 7200)
+        name, email = self.rnd.choice(AUTHORS)
+        self._line('commit %s' % ref)
+        self._line('mark :%d' % self.mark)
+        self._line('author %s <%s> %d +0000' % (name, email, self.ts))
+        self._line('committer %s <%s> %d +0000' % (name, email, self.ts))
+        self._data(self.message())
+        if parents:
+            self._line('from :%d' % parents[0])
+            for p in parents[1:]:
+                self._line('merge :%d' % p)
+        for path, content in files.items():
+            self._line('M 100644 inline %s' % path)
+            self._data(content)
+        self._line('')
+        return self.mark
+
+    def reset(self, ref, mark):
+        self._line('reset %s' % ref)
+        self._line('from :%d' % mark)
+        self._line('')
+
+    def bytes(self):
+        return b''.join(self.chunks)
+
+
+def make_repo(path, commits=1000, branches=0, width=2, refs=0,
+              diff_lines=0, untracked=0, seed=0):
+    """
+    Create a new repository in path.
+
+    Args:
+        commits: number of commits in the linear (master) history
+        branches: number of topic branches merged back into master
+        width: number of branches merged by each (octopus) merge commit
+        refs: number of extra branches and tags pointing to random commits
+        diff_lines: if > 0 the last commit change that many lines
+        untracked: number of untracked files to create in the work tree
+    """
+    if os.path.exists(path):
+        raise RuntimeError('The folder %s already exists' % path)
+    os.makedirs(path)
+    subprocess.check_call(['git', 'init', '-q', path])
+    with open(os.path.join(path, '.git', 'description'), 'w') as f:
+        f.write('Synthetic repository for benchmarks')
+
+    s = FastImportStream(seed)
+    files = ['src/file%02d.txt' % i for i in range(20)]
+    master = 'refs/heads/master'
+    all_marks = []
+
+    # linear history
+    head = None
+    for i in range(commits):
+        path_ = s.rnd.choice(files)
+        content = 'line %d of %s\n' % (i, path_) * s.rnd.randint(1, 20)
+        head = s.commit(master, [head] if head else [], {path_: content})
+        all_marks.append(head)
+
+    # topic branches, merged back "width" at a time
+    pending = []
+    for b in range(branches):
+        ref = 'refs/heads/topic/%d' % b
+        tip = head
+        for i in range(s.rnd.randint(1, 5)):
+            fname = 'topic/%d/file%d.txt' % (b, i)
+            tip = s.commit(ref, [tip], {fname: 'topic %d change %d\n' % (b, i)})
+            all_marks.append(tip)
+        pending.append(tip)
+        if len(pending) >= max(width - 1, 1):
+            head = s.commit(master, [head] + pending, {})
+            all_marks.append(head)
+            pending = []
+    if pending:
+        head = s.commit(master, [head] + pending, {})
+        all_marks.append(head)
+
+    # many refs
+    for i in range(refs):
+        s.reset('refs/heads/extra/branch%d' % i, s.rnd.choice(all_marks))
+        s.reset('refs/tags/v0.%d' % i, s.rnd.choice(all_marks))
+
+    # a commit with a large diff
+    if diff_lines > 0:
+        per_file = max(diff_lines // len(files), 1)
+        big = dict((f, ''.join('big change %d in %s\n' % (n, f)
+                               for n in range(per_file))) for f in files)
+        head = s.commit(master, [head] if head else [], big)
+
+    p = subprocess.Popen(['git', 'fast-import', '--quiet'], cwd=path,
+                         stdin=subprocess.PIPE)
+    p.communicate(s.bytes())
+    if p.returncode != 0:
+        raise RuntimeError('git fast-import failed')
+    subprocess.check_call(['git', 'checkout', '-q', '-f', 'master'], cwd=path)
+
+    # untracked files
+    if untracked > 0:
+        folder = os.path.join(path, 'untracked')
+        os.makedirs(folder)
+        for i in range(untracked):
+            with open(os.path.join(folder, 'file%d.txt' % i), 'w') as f:
+                f.write('untracked %d\n' % i)
+
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Create a synthetic git repo')
+    parser.add_argument('folder')
+    parser.add_argument('--commits', type=int, default=1000)
+    parser.add_argument('--branches', type=int, default=0)
+    parser.add_argument('--width', type=int, default=2)
+    parser.add_argument('--refs', type=int, default=0)
+    parser.add_argument('--diff-lines', type=int, default=0)
+    parser.add_argument('--untracked', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    make_repo(args.folder, args.commits, args.branches, args.width,
+              args.refs, args.diff_lines, args.untracked, args.seed)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
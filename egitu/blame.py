@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2014-2015 Davide Andreoli <dave@gurumeditation.it>
+#
+# This file is part of Egitu.
+#
+# Egitu is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# Egitu is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Egitu.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+from efl.ecore import Job
+from efl.elementary.window import DialogWindow
+from efl.elementary.box import Box
+from efl.elementary.button import Button
+from efl.elementary.separator import Separator
+from efl.elementary.frame import Frame
+from efl.elementary.label import Label
+from efl.elementary.entry import utf8_to_markup
+from efl.elementary.genlist import Genlist, GenlistItemClass, \
+    ELM_LIST_COMPRESS
+
+from egitu.utils import ErrorPopup, format_date, options, \
+    EXPAND_BOTH, FILL_BOTH, EXPAND_HORIZ, FILL_HORIZ
+
+
+class BlameList(Genlist):
+    """ One item per line of the file, the attribution is shown as soon as
+    git blame report it (the item data is the line number) """
+    def __init__(self, parent, **kargs):
+        Genlist.__init__(self, parent, homogeneous=True, mode=ELM_LIST_COMPRESS,
+                         size_hint_expand=EXPAND_BOTH, size_hint_fill=FILL_BOTH,
+                         **kargs)
+        self._itc = GenlistItemClass(item_style='no_icon',
+                                     text_get_func=self._gl_text_get)
+        self.lines = []      # content of the file
+        self.attribs = {}    # line number: BlameCommit
+        self._update_job = None
+
+    def populate(self, lines):
+        self.clear()
+        self.lines = lines
+        for num in range(1, len(lines) + 1):
+            self.item_append(self._itc, num)
+
+    def attribute(self, commit, first_line, num_lines):
+        for num in range(first_line, first_line + num_lines):
+            self.attribs[num] = commit
+        # many groups arrive together, refresh the items only once
+        if self._update_job is None:
+            self._update_job = Job(self._update_job_cb)
+
+    def _update_job_cb(self):
+        self._update_job = None
+        self.realized_items_update()
+
+    def _gl_text_get(self, gl, part, num):
+        commit = self.attribs.get(num)
+        if commit is None:
+            attrib = '{:7}  {:14}  {:10}'.format('', '', '')
+        else:
+            attrib = '{:7}  {:14.14}  {:10.10}'.format(commit.sha[:7],
+                                                   commit.author,
+                                                   format_date(commit.author_time))
+        line = self.lines[num - 1] if num <= len(self.lines) else ''
+        return '<code><font={} font_size={}><name>{}</name> {:>5}  {}</font>' \
+               '</code>'.format(options.diff_font_face, options.diff_font_size,
+                                utf8_to_markup(attrib), num,
+                                utf8_to_markup(line.expandtabs(4)))
+
+
+class BlameDialog(DialogWindow):
+    def __init__(self, parent, app, path, sha=None):
+        self.app = app
+        self.blame = None     # the Blame instance currently shown
+        self._lines_key = None # (sha, path) of the lines in the list
+        self._request = 0     # to ignore the callbacks of old requests
+
+        DialogWindow.__init__(self, parent, 'Egitu-blame', 'Blame',
+                              size=(800,600), autodel=True)
+
+        # main vertical box (inside a padding frame)
+        vbox = Box(self, padding=(0, 6), size_hint_expand=EXPAND_BOTH,
+                   size_hint_fill=FILL_BOTH)
+        fr = Frame(self, style='pad_medium', size_hint_expand=EXPAND_BOTH)
+        self.resize_object_add(fr)
+        fr.content = vbox
+        fr.show()
+        vbox.show()
+
+        # header
+        lb = Label(self, size_hint_expand=EXPAND_HORIZ,
+                   size_hint_align=(0.0, 0.5))
+        vbox.pack_end(lb)
+        lb.show()
+        self.header_label = lb
+
+        # lines list
+        li = BlameList(self)
+        li.callback_clicked_double_add(self._line_double_clicked_cb)
+        vbox.pack_end(li)
+        li.show()
+        self.blame_list = li
+
+        # buttons
+        hbox = Box(self, horizontal=True,
+                   size_hint_expand=EXPAND_HORIZ, size_hint_fill=FILL_HORIZ)
+        vbox.pack_end(hbox)
+        hbox.show()
+
+        bt = Button(self, text='Blame parent commit')
+        bt.callback_clicked_add(lambda b: self.blame_parent())
+        hbox.pack_end(bt)
+        bt.show()
+        self.parent_btn = bt
+
+        lb = Label(self, text='Double click a line to blame the commit '
+                              'before its last change')
+        hbox.pack_end(lb)
+        lb.show()
+
+        sep = Separator(self, size_hint_expand=EXPAND_HORIZ)
+        hbox.pack_end(sep)
+
+        bt = Button(self, text='Close')
+        bt.callback_clicked_add(lambda b: self.delete())
+        hbox.pack_end(bt)
+        bt.show()
+
+        #
+        self.blame_at(path, sha)
+        self.show()
+
+    def _new_request(self):
+        self._request += 1
+        req = self._request
+        self.blame = None
+        self.blame_list.attribs = {}
+        self.blame_list.realized_items_update()
+        self.parent_btn.disabled = True
+        prog_cb = lambda blame, entry: \
+            req == self._request and self._blame_progress_cb(blame, entry)
+        done_cb = lambda success, blame, err_msg=None: \
+            req == self._request and self._blame_done_cb(success, blame, err_msg)
+        return done_cb, prog_cb
+
+    def blame_at(self, path, sha=None):
+        """ Blame path at commit sha (or in the working tree if sha is None) """
+        done_cb, prog_cb = self._new_request()
+        self._header_update(path, sha)
+        self.app.repo.request_blame(done_cb, prog_cb, path, sha)
+
+    def blame_parent(self):
+        """ Blame the same file at the parent of the current commit """
+        if self.blame is None or not self.blame.complete:
+            return
+        blame = self.blame
+        done_cb, prog_cb = self._new_request()
+        self.header_label.text = '<b>Blaming the parent commit...</b>'
+        self.app.repo.request_blame_parent(done_cb, prog_cb, blame)
+
+    def _header_update(self, path, sha, complete=False):
+        rev = sha[:7] if sha else 'working tree'
+        text = '<b>{}</b> at <name>{}</name>'.format(utf8_to_markup(path), rev)
+        if not complete:
+            text += ' (blaming...)'
+        self.header_label.text = text
+
+    def _lines_update(self, blame):
+        if self._lines_key != (blame.sha, blame.path):
+            self._lines_key = (blame.sha, blame.path)
+            self.app.repo.request_file_lines(self._lines_done_cb,
+                                             blame.path, blame.sha)
+
+    def _lines_done_cb(self, success, lines, err_msg=None):
+        if self.blame is None or \
+           self._lines_key != (self.blame.sha, self.blame.path):
+            return # lines of an old request
+        if success:
+            self.blame_list.populate(lines)
+        else:
+            ErrorPopup(self, msg=utf8_to_markup(err_msg))
+
+    def _blame_progress_cb(self, blame, entry):
+        if self.blame is not blame:
+            self.blame = blame
+            self._header_update(blame.path, blame.sha)
+            self._lines_update(blame)
+        sha, orig_line, final_line, num_lines = entry
+        self.blame_list.attribute(blame.commits[sha], final_line, num_lines)
+
+    def _blame_done_cb(self, success, blame, err_msg=None):
+        if not success:
+            if self.blame is not None:
+                self._header_update(self.blame.path, self.blame.sha, True)
+            ErrorPopup(self, msg=utf8_to_markup(err_msg or 'Blame failed'))
+            return
+        self.blame = blame
+        self._header_update(blame.path, blame.sha, True)
+        self._lines_update(blame) # an empty file has no progress
+        self.parent_btn.disabled = False
+
+    def _line_double_clicked_cb(self, li, item):
+        commit = self.blame_list.attribs.get(item.data)
+        if commit is None:
+            return
+        if commit.previous is None:
+            ErrorPopup(self, 'Nothing to blame',
+                       'The line was added by the first commit of the file')
+            return
+        sha, path = commit.previous
+        self.blame_at(path, sha)
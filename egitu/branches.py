@@ -182,6 +182,14 @@ class MergeBranchPopup(Popup):
         box.pack_end(en)
         en.show()
 
+        # conflicts entry (filled when the merge simulation is done)
+        en = Entry(self, editable=False,
+                   text='<info>Checking conflicts...</info>',
+                   size_hint_expand=EXPAND_BOTH, size_hint_fill=FILL_BOTH)
+        box.pack_end(en)
+        en.show()
+        self.conflicts_entry = en
+
         # fast forward ?
         rdg = Radio(self, state_value=0, text='Fast Forward when possible',
                     size_hint_align=(0.0, 0.5))
@@ -221,6 +229,27 @@ class MergeBranchPopup(Popup):
         #
         self.show()
 
+        # simulate the merge (without touching the working tree)
+        app.repo.request_merge_conflicts(self._conflicts_done_cb,
+                                         'HEAD', self.branch)
+
+    def _conflicts_done_cb(self, success, conflicts, err_msg=None):
+        if self.is_deleted():
+            return
+        if not success:
+            self.conflicts_entry.text = \
+                '<warning>Warning:</warning> Cannot check for conflicts.'
+        elif conflicts:
+            self.conflicts_entry.text = \
+                '<warning>Warning:</warning> {} {} will conflict:<br>{}'.format(
+                len(conflicts), 'file' if len(conflicts) == 1 else 'files',
+                '<br>'.join(utf8_to_markup(path) for path in conflicts[:10]))
+            if len(conflicts) > 10:
+                self.conflicts_entry.entry_append('<br>...')
+        else:
+            self.conflicts_entry.text = \
+                '<success>No conflicts, the merge will be clean.</success>'
+
     def _merge_clicked_cb(self, btn):
         if self.ff_rdg.value == 0:
             ff = 'ff'
@@ -150,7 +150,10 @@ class DiscardDialog(Popup):
             return
 
         # discard selection or everything if li is empty
-        self.app.repo.discard(self._discard_done_cb, li)
+        if li:
+            self.app.repo.discard_paths(self._discard_done_cb, li)
+        else:
+            self.app.repo.discard(self._discard_done_cb)
 
     def _discard_done_cb(self, success, err_msg=None):
         self.delete()
@@ -256,9 +259,11 @@ class CommitDialog(DialogWindow):
         # load the diff
         if revert_commit:
             app.repo.request_diff(self.diff_done_cb, revert=True,
-                                  ref1=revert_commit.sha)
+                                  ref1=revert_commit.sha,
+                                  parent=revert_commit.first_parent)
         elif cherrypick_commit:
-            app.repo.request_diff(self.diff_done_cb, ref1=cherrypick_commit.sha)
+            app.repo.request_diff(self.diff_done_cb, ref1=cherrypick_commit.sha,
+                                  parent=cherrypick_commit.first_parent)
         else:
             app.repo.request_diff(self.diff_done_cb, only_staged=True)
 
@@ -34,7 +34,13 @@ from efl.elementary.genlist import Genlist, GenlistItemClass, \
 from egitu.gui import DiffedEntry
 from egitu.branches import MergeBranchPopup
 from egitu.utils import ComboBox, ErrorPopup, CommitTooltip, SafeIcon, \
-    EXPAND_BOTH, FILL_BOTH, EXPAND_HORIZ, FILL_HORIZ
+    LRUCache, EXPAND_BOTH, FILL_BOTH, EXPAND_HORIZ, FILL_HORIZ
+
+
+# max number of diff lines to keep in memory (for all the files)
+DIFF_CACHE_MAX_LINES = 50000
+# max number of lines to show for a single file diff
+DIFF_MAX_LINES = 5000
 
 
 class CommitsList(Genlist):
@@ -68,10 +74,34 @@ class CommitsList(Genlist):
         return CommitTooltip(tooltip, commit, show_full_msg=True)
 
 
+class ChangedFilesList(Genlist):
+    def __init__(self, parent, **kargs):
+        Genlist.__init__(self, parent, homogeneous=True, mode=ELM_LIST_COMPRESS,
+                         size_hint_expand=EXPAND_BOTH, size_hint_fill=FILL_BOTH,
+                         **kargs)
+
+        self._itc = GenlistItemClass(item_style='default',
+                                     text_get_func=self._gl_text_get,
+                                     content_get_func=self._gl_content_get)
+
+    def append(self, change):
+        self.item_append(self._itc, change)
+
+    def _gl_text_get(self, gl, part, change):
+        mod, name, new_name = change
+        return '{} → {}'.format(name, new_name) if new_name else name
+
+    def _gl_content_get(self, gl, part, change):
+        if part == 'elm.swallow.icon':
+            return SafeIcon(gl, 'git-mod-' + change[0])
+
+
 class CompareDialog(DialogWindow):
     def __init__(self, parent, app, target=None):
         self.app = app
         self._selected_item = None
+        self._diff_key = None
+        self._diff_cache = LRUCache(DIFF_CACHE_MAX_LINES, weight_func=len)
 
         DialogWindow.__init__(self, parent, 'Egitu-compare', 'Compare tool',
                               size=(500,500), autodel=True)
@@ -136,9 +166,24 @@ class CompareDialog(DialogWindow):
         fr.show()
         self.commits_frame = fr
 
-        # diff
-        de = DiffedEntry(panes)
-        panes.part_content_set('right', de)
+        # changed files list + diff (in another vertical panes)
+        panes2 = Panes(panes, horizontal=True, content_left_size=0.3,
+                       size_hint_expand=EXPAND_BOTH, size_hint_fill=FILL_BOTH)
+        panes.part_content_set('right', panes2)
+        panes2.show()
+
+        li = ChangedFilesList(panes2, select_mode=ELM_OBJECT_SELECT_MODE_ALWAYS)
+        li.callback_selected_add(self._file_selected_cb)
+        li.show()
+        self.files_list = li
+
+        fr = Frame(panes2, content=li)
+        panes2.part_content_set('left', fr)
+        fr.show()
+        self.files_frame = fr
+
+        de = DiffedEntry(panes2)
+        panes2.part_content_set('right', de)
         de.show()
         self.diff_entry = de
 
@@ -174,6 +219,9 @@ class CompareDialog(DialogWindow):
 
     def compare(self):
         self.commits_list.clear()
+        self.files_list.clear()
+        self._selected_item = None
+        self._diff_key = None
         self.diff_entry.text = None
         self.app.repo.request_commits(self._commits_done_cb,
                                       self._commits_progress_cb,
@@ -217,27 +265,94 @@ class CompareDialog(DialogWindow):
             self.merge_label.text = '<info>Nothing to merge.</>'
         else:
             self.merge_btn.disabled = False
-            self.merge_label.text = '' # TODO check conflicts !!!
+            self.merge_label.text = '<info>Checking conflicts...</>'
+            self.app.repo.request_merge_conflicts(self._conflicts_done_cb,
+                                                  self.base_combo.text,
+                                                  self.compare_combo.text)
+
+    def _conflicts_done_cb(self, success, conflicts, err_msg=None):
+        if self.is_deleted():
+            return
+        if not success:
+            self.merge_label.text = '<warning>Cannot check conflicts.</>'
+            self.merge_label.tooltip_unset()
+        elif conflicts:
+            self.merge_label.text = '<warning>{} {} would conflict.</>'.format(
+                len(conflicts), 'file' if len(conflicts) == 1 else 'files')
+            self.merge_label.tooltip_text_set('<br>'.join(
+                utf8_to_markup(path) for path in conflicts))
+        else:
+            self.merge_label.text = '<success>No conflicts, can be merged.</>'
+            self.merge_label.tooltip_unset()
 
     def update_diff(self):
+        """ Populate the list of changed files, diffs are loaded on demand """
+        self.files_list.clear()
+        self.files_frame.text = 'Loading changed files...'
+        self._diff_key = None
         self.diff_entry.loading_set()
+
         sel_item = self.commits_list.selected_item
         if sel_item is not None:
             commit = sel_item.data
-            self.app.repo.request_diff(self._diff_done_cb, ref1=commit.sha)
-        elif self.commits_list.items_count < 50:
-            self.app.repo.request_diff(self._diff_done_cb, compare=True,
-                                       ref1=self.base_combo.text,
-                                       ref2=self.compare_combo.text)
+            self.app.repo.request_changes(self._changes_done_cb, commit1=commit)
         else:
-            self.diff_entry.text = \
-                '<warning>Warning: </warning>The diff is huge (%d commits).<br>' \
-                'I cannot show all the commits at the same time, ' \
-                'you can still show single commits.' % \
-                self.commits_list.items_count
+            self.app.repo.request_compare_changes(self._changes_done_cb,
+                                                  self.base_combo.text,
+                                                  self.compare_combo.text)
 
-    def _diff_done_cb(self, lines, success):
-        self.diff_entry.lines_set(lines)
+    def _changes_done_cb(self, success, changes):
+        if not success:
+            self.files_frame.text = 'Error reading changed files'
+            self.diff_entry.text = None
+            return
+
+        count = len(changes)
+        self.files_frame.text = '{} {} changed'.format(count,
+                                    'file' if count == 1 else 'files')
+        for change in changes:
+            self.files_list.append(change)
+
+        if self.files_list.first_item:
+            self.files_list.first_item.selected = True
+        else:
+            self.diff_entry.text = None
+
+    def _file_selected_cb(self, li, item):
+        mod, name, new_name = item.data
+        # renamed/copied files are diffed by both names, so that git can
+        # still pair them, and are known by the new one
+        path = [name, new_name] if new_name else name
+        sel_item = self.commits_list.selected_item
+        if sel_item is not None:
+            key = (sel_item.data.sha, None, new_name or name)
+        else:
+            key = (self.base_combo.text, self.compare_combo.text,
+                   new_name or name)
+        self._diff_key = key
+
+        # already in cache ?
+        lines = self._diff_cache.get(key)
+        if lines is not None:
+            self.diff_entry.lines_set(lines, max_lines=DIFF_MAX_LINES)
+            return
+
+        # or request the diff for this single file
+        self.diff_entry.loading_set()
+        done_cb = lambda lines, success: self._diff_done_cb(lines, success, key)
+        if sel_item is not None:
+            self.app.repo.request_diff(done_cb, ref1=key[0], path=path,
+                                       parent=sel_item.data.first_parent)
+        else:
+            self.app.repo.request_diff(done_cb, compare=True, path=path,
+                                       ref1=key[0], ref2=key[1])
+
+    def _diff_done_cb(self, lines, success, key):
+        if success:
+            self._diff_cache[key] = lines
+        # the user may have selected another file in the meantime
+        if key == self._diff_key:
+            self.diff_entry.lines_set(lines, max_lines=DIFF_MAX_LINES)
 
     def _list_selected_cb(self, li, item):
         if item == self._selected_item:
@@ -246,4 +361,3 @@ class CompareDialog(DialogWindow):
         else:
             self._selected_item = item
         self.update_diff()
-
@@ -23,12 +23,14 @@ from __future__ import absolute_import, print_function, unicode_literals
 import os
 import sys
 import time
+import bisect
 from datetime import datetime
 
 from efl.evas import Rectangle
 from efl.edje import Edje
 from efl.elementary.button import Button
-from efl.elementary.entry import Entry, utf8_to_markup, ELM_WRAP_NONE
+from efl.elementary.entry import Entry, utf8_to_markup, markup_to_utf8, \
+    ELM_WRAP_NONE
 from efl.elementary.box import Box
 from efl.elementary.table import Table
 from efl.elementary.layout import Layout
@@ -36,29 +38,54 @@ from efl.elementary.label import Label
 from efl.elementary.genlist import Genlist, GenlistItemClass, \
     ELM_LIST_COMPRESS, ELM_GENLIST_ITEM_GROUP
 
-from egitu.utils import options, theme_file_get, format_date, \
-    GravatarPict, CommitTooltip, ErrorPopup, \
+from egitu.utils import options, theme_file_get, theme_extension_load, \
+    format_date, GravatarPict, CommitTooltip, ErrorPopup, \
     EXPAND_BOTH, FILL_BOTH, EXPAND_HORIZ, FILL_HORIZ
-from egitu.stash import StashDialog
 from egitu.vcs import Commit
+from egitu.search import SearchIndex
 
 
 class DagGraph(Box):
     def __init__(self, parent, app):
+        self.app = app
         Box.__init__(self, parent)
 
-        # header
-        self.label_top = Label(self, ellipsis=True,
+        # header (label + search entry)
+        hbox = Box(self, horizontal=True,
+                   size_hint_expand=EXPAND_HORIZ, size_hint_fill=FILL_HORIZ)
+        self.pack_end(hbox)
+        hbox.show()
+
+        self.label_top = Label(hbox, ellipsis=True,
                                size_hint_expand=EXPAND_HORIZ,
                                size_hint_fill=FILL_HORIZ)
-        self.pack_end(self.label_top)
+        hbox.pack_end(self.label_top)
         self.label_top.show()
 
+        self.search_entry = Entry(hbox, single_line=True, scrollable=True,
+                                  size_hint_min=(200, 0))
+        self.search_entry.part_text_set('guide', 'Search commits')
+        self.search_entry.callback_changed_user_add(self._search_changed_cb)
+        hbox.pack_end(self.search_entry)
+        self.search_entry.show()
+
+        bt = Button(hbox, text='Path history')
+        bt.callback_clicked_add(lambda b: app.action_path_history())
+        hbox.pack_end(bt)
+        bt.show()
+
         # genlist
         self.genlist = DagGraphList(self, app)
         self.pack_end(self.genlist)
         self.genlist.show()
 
+        # search results (replace the genlist while searching)
+        self.search_list = SearchResultsList(self, app)
+        self.search_list.callback_selected_add(self._search_selected_cb)
+        self.pack_end(self.search_list)
+        self._search_index = None
+        self._search_used = False # the index is updated only once used
+
         # footer
         self.label = Label(self, ellipsis=True,
                            size_hint_expand=EXPAND_HORIZ,
@@ -72,8 +99,84 @@ class DagGraph(Box):
     def populate(self, *args, **kargs):
         self.genlist.populate(*args, **kargs)
 
+    def populate_from_snapshot(self, *args, **kargs):
+        self.genlist.populate_from_snapshot(*args, **kargs)
+
+    def goto(self, target, not_found_cb=None):
+        return self.genlist.goto(target, not_found_cb)
+
+    @property
+    def snapshot_commits(self):
+        return self.genlist.snapshot_commits
+
+    @property
+    def path(self):
+        return self.genlist.path
+
     def update(self):
         self.genlist.update()
+        # load the search index in background, it's ready on the first key
+        self._search_index_load()
+        # extend the search index (only if used) with the new commits
+        if self._search_used:
+            self._search_index_update()
+
+    def _search_index_load(self):
+        repo = self.app.repo
+        if repo is None:
+            return
+        if self._search_index is None or self._search_index.url != repo.url:
+            index = self._search_index = SearchIndex(repo.url)
+            index.load_async(lambda success: index is self._search_index and
+                             self._search_index_loaded_cb())
+            self._search_used = False
+
+    def _search_index_loaded_cb(self):
+        if self._search_used:
+            self._search_index_update()
+            if self.search_list.visible:
+                self._search_changed_cb(self.search_entry)
+
+    def _search_index_update(self):
+        self._search_index_load()
+        index = self._search_index
+        if index is not None and not index.loading:
+            index.update(self.app.repo, self._search_index_done_cb)
+
+    def _search_index_done_cb(self, success, count):
+        if success and count and self.search_list.visible:
+            self._search_changed_cb(self.search_entry)
+
+    def _search_changed_cb(self, en):
+        query = markup_to_utf8(en.text)
+        if not query.strip() or self.app.repo is None:
+            self.search_list.hide()
+            self.genlist.show()
+            return
+
+        if not self._search_used or \
+           self._search_index.url != self.app.repo.url:
+            self._search_index_update()
+            self._search_used = True
+
+        index = self._search_index
+        self.genlist.hide()
+        self.search_list.show()
+        if index.loading: # the results are shown when loaded
+            self.search_list.populate(index, [])
+            self.info_label_set('Loading the search index...')
+            return
+        self.search_list.populate(index, index.search(query))
+        if index.updating:
+            self.info_label_set('Indexing the history, %d commits so far...'
+                                % len(index))
+
+    def _search_selected_cb(self, gl, item):
+        sha = self._search_index.doc(item.data)[0]
+        self.search_entry.text = ''
+        self.search_list.hide()
+        self.genlist.show()
+        self.genlist.goto(sha)
 
     def header_label_set(self, text):
         self.label_top.text = '<align=left><big>' + text + '</big></align>'
@@ -82,6 +185,29 @@ class DagGraph(Box):
         self.label.text = '<align=left>' + text + '</align>'
 
 
+class SearchResultsList(Genlist):
+    """ The filtered list of commits found by the search entry """
+    def __init__(self, parent, app):
+        self.app = app
+        self._index = None
+        self._itc = GenlistItemClass(item_style='double_label',
+                                     text_get_func=self._gl_text_get)
+        Genlist.__init__(self, parent, homogeneous=True, mode=ELM_LIST_COMPRESS,
+                         size_hint_expand=EXPAND_BOTH, size_hint_fill=FILL_BOTH)
+
+    def populate(self, index, doc_ids):
+        self._index = index
+        self.clear()
+        for doc_id in doc_ids:
+            self.item_append(self._itc, doc_id)
+
+    def _gl_text_get(self, gl, part, doc_id):
+        sha, ts, author, title = self._index.doc(doc_id)
+        if part == 'elm.text.sub':
+            return '%s  %s  %s' % (sha[:7], author, format_date(ts))
+        return utf8_to_markup(title)
+
+
 class CommitDagData(object):
     def __init__(self, col, row):
         self.col = col
@@ -94,25 +220,16 @@ class CommitDagData(object):
         self.upwards_lines = dict() # 'child Commit': line_obj
 
 
-class DagGraphList(Genlist):
-    def __init__(self, parent, app, *args, **kargs):
-        self.app = app
-        self.themef = theme_file_get()
-        self.colors = [(0,100,0,100), (0,0,100,100), (100,0,0,100),
-                      (100,100,0,100), (0,100,100,100), (100,0,100,100)]
-
-        self._itc = GenlistItemClass(item_style='egitu_commit',
-                                     text_get_func=self._gl_text_get,
-                                     content_get_func=self._gl_content_get)
-        self._itcg = GenlistItemClass(item_style='egitu_group_index')
-
-        Genlist.__init__(self, parent, homogeneous=True, mode=ELM_LIST_COMPRESS,
-                         size_hint_expand=EXPAND_BOTH, size_hint_fill=FILL_BOTH)
-        self.callback_realized_add(self._gl_item_realized)
-        self.callback_unrealized_add(self._gl_item_unrealized)
-        self.callback_selected_add(self._gl_item_selected)
+class DagLanes(object):
+    """ Assign a column (lane) to each commit of the DAG
 
-        self._start_ref = None
+    Commits must be given in topological order (children first), as
+    git log does. This is pure layout logic, without any widget.
+    """
+    def __init__(self):
+        self._used_columns = set()       # contain the indexes of used columns
+        self._open_connections = dict()  # 'sha':[child1_col, child2_col, child3_col, ...]
+        self._open_childs = dict()       # 'sha':[child1, child2, child3, ...]
 
     def _find_a_free_column(self):
         # set is empty, add and return "1"
@@ -132,90 +249,241 @@ class DagGraphList(Genlist):
         self._used_columns.add(x)
         return x
 
+    def assign(self, commit):
+        """ Return the column for commit and the list of its childrens """
+
+        # 1. find the column to use
+        if commit.sha in self._open_connections:
+            childs_cols = self._open_connections.pop(commit.sha)
+            point_col = min(childs_cols)
+            # if child was a fork we can release the columns
+            if len(childs_cols) > 1:
+                for col in childs_cols:
+                    if col != point_col:
+                        self._used_columns.remove(col)
+            # no parents, release the column
+            if len(commit.parents) < 1:
+                self._used_columns.remove(point_col)
+        else:
+            # point need a new free column
+            point_col = self._find_a_free_column()
+
+        # 2. add an open_connection, one for each parent
+        for i, parent in enumerate(commit.parents):
+            parent_col = point_col if i == 0 else self._find_a_free_column()
+            if parent in self._open_connections:
+                self._open_connections[parent].append(parent_col)
+            else:
+                self._open_connections[parent] = [parent_col]
+
+            # also remember this commit for later childrens population
+            if parent in self._open_childs:
+                self._open_childs[parent].append(commit)
+            else:
+                self._open_childs[parent] = [commit]
+
+        # 3. all the (yet seen) childrens of this commit
+        return point_col, self._open_childs.pop(commit.sha, [])
+
+
+class DagGraphList(Genlist):
+    SNAPSHOT_COMMITS = 200 # number of commits to save in the repo snapshot
+
+    def __init__(self, parent, app, *args, **kargs):
+        self.app = app
+        self.themef = theme_file_get()
+        self.colors = [(0,100,0,100), (0,0,100,100), (100,0,0,100),
+                      (100,100,0,100), (0,100,100,100), (100,0,100,100)]
+
+        self._itc = GenlistItemClass(item_style='egitu_commit',
+                                     text_get_func=self._gl_text_get,
+                                     content_get_func=self._gl_content_get)
+        self._itcg = GenlistItemClass(item_style='egitu_group_index')
+
+        Genlist.__init__(self, parent, homogeneous=True, mode=ELM_LIST_COMPRESS,
+                         size_hint_expand=EXPAND_BOTH, size_hint_fill=FILL_BOTH)
+        self.callback_realized_add(self._gl_item_realized)
+        self.callback_unrealized_add(self._gl_item_unrealized)
+        self.callback_selected_add(self._gl_item_selected)
+        self.callback_edge_bottom_add(self._gl_edge_bottom)
+
+        self._start_ref = None
+        self._path = None
+        self._loading = False
+        self._jump_serial = 0
+        self._page_serial = 0
+        self._page_cmd = None
+        self._jump_resolving = False
+        self._showing_snapshot = False
+        self._clear_pending = False
+        self._snapshot_commits = []
+
+    @property
+    def snapshot_commits(self):
+        """ The first SNAPSHOT_COMMITS commits currently in the graph """
+        return self._snapshot_commits
+
     def _color_for_column(self, column):
         return self.colors[(column - 1) % len(self.colors)]
 
     def _commit_append(self, commit, col):
-        commit.dag_data = CommitDagData(col, self._current_row)
+        row = self._current_row
+        commit.dag_data = CommitDagData(col, row)
         self._current_row += 1
         self._COMMITS[commit.sha] = commit
-        return self.item_append(self._itc, commit, self._group_item)
+        item = self.item_append(self._itc, commit, self._group_item)
+        self._ROWS.append(item)
+
+        # jump indexes: ref -> row and (sorted) date -> row
+        for name in commit.heads + commit.remotes + commit.tags:
+            if name not in self._REFS:
+                self._REFS[name] = row
+        key = -time.mktime(commit.commit_date.timetuple()) # newest first
+        if not self._date_keys or key >= self._date_keys[-1]:
+            self._date_keys.append(key)
+            self._date_rows.append(row)
+        else: # commit older than its parent (clock skew, rebase, ...)
+            i = bisect.bisect_right(self._date_keys, key)
+            self._date_keys.insert(i, key)
+            self._date_rows.insert(i, row)
+
+        return item
 
     def update(self):
         selected_item = self.selected_item
         if selected_item:
-            self.populate(self._start_ref, selected_item.data.sha)
+            self.populate(self._start_ref, selected_item.data.sha,
+                          path=self._path)
         else:
-            self.populate(self._start_ref)
+            self.populate(self._start_ref, path=self._path)
 
-    def populate(self, start_ref=None, hilight_ref=None):
+    def populate(self, start_ref=None, hilight_ref=None, path=None):
         if self.app.repo is None:
             return
 
         # TODO check start_ref is a valid ref !!
 
+        self._populate_reset(start_ref, hilight_ref, path)
+        self._request_page()
+
+    @property
+    def path(self):
+        """ The file/folder the history is limited to (or None) """
+        return self._path
+
+    def _request_page(self, until=None):
+        """ Load the next number_of_commits_to_load commits
+
+        If until is a sha all the commits up to it are loaded instead, in
+        a single git log that is stopped as soon as the sha arrives.
+        """
+        self._loading = True
+        self._page_count = 0
+        self._page_skip = self._current_row
+        self._page_until = until
+        self._page_stopped = False
+        self._startup_time = time.time()
+        self._page_size = 0 if until else \
+            options.repo_get(self.app.repo.url, 'number_of_commits_to_load')
+        serial = self._page_serial
+        self._page_cmd = self.app.repo.request_commits(
+                                      lambda success, err_msg=None: \
+                                          serial == self._page_serial and \
+                                          self._populate_done_cb(success, err_msg),
+                                      lambda commit: \
+                                          serial == self._page_serial and \
+                                          self._populate_progress_cb(commit),
+                                      ref1=self._start_ref,
+                                      max_count=self._page_size,
+                                      skip=self._page_skip,
+                                      path=self._path)
+
+    def populate_from_snapshot(self, commits, start_ref=None):
+        """ Show the (maybe stale) commits saved in the repo snapshot
+
+        The items stay visible when populate() is called, until the first
+        fresh commit arrives, so the graph is never empty while reloading.
+        """
+        self._populate_reset(start_ref, None)
+        for commit in commits:
+            self._populate_progress_cb(commit)
+        self._last_date_span_store()
+        self._history_end = True # do not page the snapshot, populate() will
+        self._showing_snapshot = True
+        self.parent.info_label_set('Showing cached revisions, refreshing...')
+
+    def _populate_reset(self, start_ref, hilight_ref, path=None):
+        # the egitu_commit item style is in the theme extension
+        theme_extension_load()
+
+        # forget (and stop) the page still loading for the previous graph
+        self._page_serial += 1
+        if self._page_cmd is not None:
+            self._page_cmd.cancel()
+        self._loading = False
+
         self._start_ref = start_ref
+        self._path = path
         self._current_row = 0
         self._COMMITS = dict()           # 'sha': Commit instance
-        self._used_columns = set()       # contain the indexes of used columns
-        self._open_connections = dict()  # 'sha':[child1_col, child2_col, child3_col, ...]
-        self._open_childs = dict()       # 'sha':[child1, child2, child3, ...]
+        self._ROWS = list()              # row: GenlistItem
+        self._REFS = dict()              # 'ref name': row
+        self._date_keys = list()         # sorted -timestamp of the commits
+        self._date_rows = list()         # rows of _date_keys (same order)
+        self._lanes = DagLanes()         # columns assignment
         self._last_date_commit = None    # last commit that changed the date
-        self._hilight_ref = hilight_ref
+        self._jump_target = hilight_ref  # sha/ref/date to show when loaded
+        self._jump_not_found_cb = None   # called if _jump_target is not found
+        self._jump_sha = None            # the commit of _jump_target
+        self._jump_serial += 1           # to ignore stale resolutions
+        self._jump_resolving = False     # waiting for request_history_commit
+        self._history_end = False        # True when all commits are loaded
+        self._page_count = self._page_skip = self._page_size = 0
+        self._page_until = self._page_cmd = None
+        self._page_stopped = False
 
         self.COLW = 20 # columns width (fixed)
         self.ROWH = 0  # raws height (fetched from genlist on first realize)
 
+        self._snapshot_commits = []      # first commits, for the snapshot
+
         self.parent.info_label_set('Reading repository...')
-        self.clear()
+        if self._showing_snapshot:
+            # keep the stale items until the first fresh commit arrives
+            self._clear_pending = True
+        else:
+            self._clear_and_add_group()
 
         # update header label
         if self._start_ref is None:
             txt = 'Showing ALL revisions'
         else:
             txt = 'Showing revisions from <hilight>{}</>'.format(self._start_ref)
+        if self._path is not None:
+            txt += ' that touch <hilight>{}</>'.format(utf8_to_markup(path))
         self.parent.header_label_set(txt)
 
+    def _clear_and_add_group(self):
+        self._showing_snapshot = self._clear_pending = False
+        self.clear()
+
         # add the invisible group item
         self._group_item = self.item_append(self._itcg, None,
                                             flags=ELM_GENLIST_ITEM_GROUP)
 
-        self._startup_time = time.time()
-        self.app.repo.request_commits(self._populate_done_cb,
-                                      self._populate_progress_cb,
-                                      ref1=start_ref)
+    def _last_date_span_store(self):
+        if self._last_date_commit:
+            self._last_date_commit.dag_data.date_span = \
+                self._current_row - self._last_date_commit.dag_data.row
 
     def _populate_progress_cb(self, commit):
+        if self._clear_pending:
+            self._clear_and_add_group()
+        if len(self._snapshot_commits) < self.SNAPSHOT_COMMITS:
+            self._snapshot_commits.append(commit)
 
-        # 1. find the column to use
-        if commit.sha in self._open_connections:
-            childs_cols = self._open_connections.pop(commit.sha)
-            point_col = min(childs_cols)
-            # if child was a fork we can release the columns
-            if len(childs_cols) > 1:
-                for col in childs_cols:
-                    if col != point_col:
-                        self._used_columns.remove(col)
-            # no parents, release the column
-            if len(commit.parents) < 1:
-                self._used_columns.remove(point_col)
-        else:
-            # point need a new free column
-            point_col = self._find_a_free_column()
-
-        # 2. add an open_connection, one for each parent
-        for i, parent in enumerate(commit.parents):
-            parent_col = point_col if i == 0 else self._find_a_free_column()
-            if parent in self._open_connections:
-                self._open_connections[parent].append(parent_col)
-            else:
-                self._open_connections[parent] = [parent_col]
-
-            # also remember this commit for later childrends population
-            if parent in self._open_childs:
-                self._open_childs[parent].append(commit)
-            else:
-                self._open_childs[parent] = [commit]
+        # 1-2. find the column to use (and the already seen childrens)
+        point_col, childs = self._lanes.assign(commit)
 
         # 3. store date span information (if the day is changed)
         if self._last_date_commit is None:
@@ -228,36 +496,144 @@ class DagGraphList(Genlist):
                 self._last_date_commit = commit
 
         # 4. add the commit to the graph
-        # NOTE: this will create DagData and increment _current_row
-        item = self._commit_append(commit, point_col)
+        # NOTE: this will create DagData, increment _current_row and
+        #       update the jump indexes
+        self._commit_append(commit, point_col)
+        self._page_count += 1
 
         # 5. store all the childrens of this commit
-        if commit.sha in self._open_childs:
-            commit.dag_data.childs = self._open_childs.pop(commit.sha)
-
-        # 6. search a ref to hilight (if requested)
-        if self._hilight_ref:
-            if self._hilight_ref in commit.heads or \
-               self._hilight_ref in commit.tags or \
-               self._hilight_ref == commit.sha:
-                item.selected = True
-                item.show()
-                self._hilight_ref = None
+        commit.dag_data.childs = childs
+
+        # stop loading when the commit to jump to arrives
+        if commit.sha == self._page_until:
+            self._page_until = None
+            self._page_stopped = True
+            self._page_cmd.cancel()
 
     def _populate_done_cb(self, success, err_msg=None):
-        if not success:
+        self._loading = False
+        self._page_cmd = None
+        if not success and not self._page_stopped:
             ErrorPopup(self, msg=err_msg)
             self.parent.info_label_set('Error fetching revisions')
             return
 
+        # no commits at all, remove the stale items (if any)
+        if self._clear_pending:
+            self._clear_and_add_group()
+
+        # a short (or not stopped unlimited) page means the history is over
+        if not self._page_stopped and (self._page_size == 0 or
+                                       self._page_count < self._page_size):
+            self._history_end = True
+
         # store the last date information
-        if self._last_date_commit:
-            self._last_date_commit.dag_data.date_span = \
-                self._current_row - self._last_date_commit.dag_data.row
+        self._last_date_span_store()
+
+        # save the first page of the HEAD history for the next startup
+        if self._start_ref == 'HEAD' and self._path is None and \
+                self._page_skip == 0 and self._snapshot_commits:
+            self.app.repo.snapshot_save(self._snapshot_commits)
 
         # update the footer bar
-        self.parent.info_label_set('%d revisions loaded in %.2f seconds' % (
-                        self._current_row, time.time() - self._startup_time))
+        self.parent.info_label_set('%d revisions loaded in %.2f seconds%s' % (
+                        self._current_row, time.time() - self._startup_time,
+                        '' if self._history_end else ' (scroll to load more)'))
+
+        # show the requested sha/ref/date, paging forward if not yet loaded
+        if self._jump_sha is not None:
+            self._jump_continue()
+        elif self._jump_target is not None and not self._jump_resolving:
+            self.goto(self._jump_target, self._jump_not_found_cb)
+
+    def _gl_edge_bottom(self, gl):
+        if not self._loading and not self._history_end:
+            self._request_page()
+
+    def _row_for(self, target):
+        """ The row of a sha, ref name or date (None if not loaded yet) """
+        if isinstance(target, datetime):
+            # the first commit not newer than the given date
+            key = -time.mktime(target.timetuple())
+            i = bisect.bisect_left(self._date_keys, key)
+            if i < len(self._date_keys):
+                return self._date_rows[i]
+            return None
+
+        commit = self._COMMITS.get(target)
+        if commit is not None:
+            return commit.dag_data.row
+
+        for prefix in ('', 'refs/heads/', 'refs/remotes/', 'refs/tags/'):
+            if target.startswith(prefix) and target[len(prefix):] in self._REFS:
+                return self._REFS[target[len(prefix):]]
+
+        # an abbreviated sha (only on user request, not a hot path)
+        if len(target) >= 4 and all(c in '0123456789abcdef' for c in target):
+            for sha, commit in self._COMMITS.items():
+                if sha.startswith(target):
+                    return commit.dag_data.row
+
+        return None
+
+    def goto(self, target, not_found_cb=None):
+        """ Select the commit of a sha, ref name or datetime
+
+        If the target is not loaded yet git is asked for its commit (and if
+        it is in the shown history at all), then the history is loaded just
+        up to it. Return False if the target is known to be not found,
+        not_found_cb (if given) is called with the target in both cases.
+        """
+        self._jump_target = target
+        self._jump_not_found_cb = not_found_cb
+        self._jump_sha = None
+        self._jump_serial += 1
+        row = self._row_for(target)
+        if row is not None:
+            self._jump_select(row)
+            return True
+        if self._history_end:
+            self._jump_not_found()
+            return False
+
+        serial = self._jump_serial
+        self._jump_resolving = True
+        self.app.repo.request_history_commit(
+            lambda success, sha, err_msg=None: \
+                serial == self._jump_serial and \
+                self._jump_resolved_cb(success, sha, err_msg),
+            target, self._start_ref, self._path)
+        return True
+
+    def _jump_resolved_cb(self, success, sha, err_msg=None):
+        self._jump_resolving = False
+        if not success or sha is None:
+            self._jump_not_found()
+        else:
+            self._jump_sha = sha
+            self._jump_continue()
+
+    def _jump_continue(self):
+        row = self._row_for(self._jump_sha)
+        if row is not None:
+            self._jump_select(row)
+        elif self._history_end:
+            self._jump_not_found()
+        elif not self._loading:
+            self._request_page(until=self._jump_sha)
+        # else: _populate_done_cb will continue when the page is loaded
+
+    def _jump_select(self, row):
+        self._jump_target = self._jump_not_found_cb = self._jump_sha = None
+        item = self._ROWS[row]
+        item.selected = True
+        item.show()
+
+    def _jump_not_found(self):
+        target, not_found_cb = self._jump_target, self._jump_not_found_cb
+        self._jump_target = self._jump_not_found_cb = self._jump_sha = None
+        if callable(not_found_cb):
+            not_found_cb(target)
 
     def _gl_text_get(self, gl, part, commit):
         if options.show_author_in_dag and part == 'egitu.text.author':
@@ -20,6 +20,7 @@
 
 from __future__ import absolute_import, print_function, unicode_literals
 
+from efl.ecore import Timer
 from efl.elementary.entry import Entry, utf8_to_markup, \
     ELM_WRAP_NONE, ELM_WRAP_MIXED
 from efl.elementary.image import Image
@@ -33,7 +34,6 @@ from efl.elementary.genlist import Genlist, GenlistItemClass, \
 
 from egitu.utils import options, format_date, GravatarPict, DiffedEntry, \
     SafeIcon, EXPAND_BOTH, FILL_BOTH, EXPAND_HORIZ, FILL_HORIZ
-from egitu.commit import CommitDialog, DiscardDialog
 
 
 class DiffViewer(Table):
@@ -41,6 +41,8 @@ class DiffViewer(Table):
         self.app = app
         self.commit = None
         self.win = parent
+        self._stage_queue = dict() # 'path': True (stage) or False (unstage)
+        self._stage_timer = None
 
         Table.__init__(self, parent,  padding=(5,5))
         self.show()
@@ -81,6 +83,7 @@ class DiffViewer(Table):
                                  size_hint_weight=EXPAND_BOTH,
                                  size_hint_align=FILL_BOTH)
         self.diff_list.callback_selected_add(self._list_selected_cb)
+        self.diff_list.callback_clicked_double_add(self._list_double_clicked_cb)
         panes.part_content_set('left', self.diff_list)
 
         # diff entry
@@ -110,6 +113,22 @@ class DiffViewer(Table):
 
     def update_action_buttons(self, buttons):
         self.action_box.clear()
+        if 'history' in buttons:
+            bt = Button(self, text='File history')
+            bt.callback_clicked_add(lambda b: self._show_path_history())
+            self.action_box.pack_end(bt)
+            bt.show()
+        if 'blame' in buttons:
+            bt = Button(self, text='Blame')
+            bt.callback_clicked_add(lambda b: self._show_blame())
+            self.action_box.pack_end(bt)
+            bt.show()
+        if 'tree' in buttons:
+            bt = Button(self, text='Browse files')
+            bt.callback_clicked_add(lambda b: \
+                self.app.action_tree(self.commit.sha))
+            self.action_box.pack_end(bt)
+            bt.show()
         if 'checkout' in buttons:
             bt = Button(self, text='Checkout')
             bt.callback_clicked_add(lambda b: \
@@ -119,20 +138,19 @@ class DiffViewer(Table):
         if 'revert' in buttons:
             bt = Button(self, text='Revert')
             bt.callback_clicked_add(lambda b: \
-                CommitDialog(self.app, revert_commit=self.commit))
+                self.app.action_commit(revert_commit=self.commit))
             self.action_box.pack_end(bt)
             bt.show()
         if 'cherrypick' in buttons:
             bt = Button(self, text='Cherry-pick')
             bt.callback_clicked_add(lambda b: \
-                CommitDialog(self.app, cherrypick_commit=self.commit))
+                self.app.action_commit(cherrypick_commit=self.commit))
             self.action_box.pack_end(bt)
             bt.show()
         if 'commit' in buttons:
             bt = Button(self, text='Commit',
                         content=SafeIcon(self, 'git-commit'))
-            bt.callback_clicked_add(lambda b: \
-                CommitDialog(self.app))
+            bt.callback_clicked_add(lambda b: self.app.action_commit())
             self.action_box.pack_end(bt)
             bt.show()
         if 'stash' in buttons:
@@ -144,7 +162,7 @@ class DiffViewer(Table):
         if 'discard' in buttons:
             bt = Button(self, text='Discard',
                         content=SafeIcon(self, 'user-trash'))
-            bt.callback_clicked_add(lambda b: DiscardDialog(self.app))
+            bt.callback_clicked_add(lambda b: self.app.action_discard())
             self.action_box.pack_end(bt)
             bt.show()
 
@@ -166,7 +184,8 @@ class DiffViewer(Table):
         text = line1 + line2 + line3 + line4
         self.entry.text = text
 
-        self.update_action_buttons(['checkout', 'revert', 'cherrypick'])
+        self.update_action_buttons(['history', 'blame', 'tree', 'checkout',
+                                    'revert', 'cherrypick'])
         self.diff_entry.text = ''
         self.diff_list.clear()
         self.app.repo.request_changes(self._changes_done_cb, commit1=commit)
@@ -176,7 +195,8 @@ class DiffViewer(Table):
         self.entry.text = '<bigger><b>Local status</b></bigger>'
         self.diff_entry.text = ''
         self.picture.email_set(None)
-        self.update_action_buttons(['commit', 'stash', 'discard'])
+        self.update_action_buttons(['history', 'blame', 'commit', 'stash',
+                                    'discard'])
         self.diff_list.clear()
         for path in sorted(self.app.repo.status.changes):
             self.diff_list.item_append(self.itc, path)
@@ -186,13 +206,23 @@ class DiffViewer(Table):
             self._list_selected_cb(self.diff_list, self.diff_list.selected_item)
 
     def _stage_unstage_check_cb(self, check):
-        path = check.data['path']
-        if check.state is True:
-            self.app.repo.stage_file(self._stage_unstage_done_cb, path, path)
-        else:
-            self.app.repo.unstage_file(self._stage_unstage_done_cb, path, path)
+        # collect the clicks for a while, then stage/unstage all together
+        self._stage_queue[check.data['path']] = check.state
+        if self._stage_timer is None:
+            self._stage_timer = Timer(0.3, self._stage_timer_cb)
+
+    def _stage_timer_cb(self):
+        self._stage_timer = None
+        to_stage = [p for p, s in self._stage_queue.items() if s is True]
+        to_unstage = [p for p, s in self._stage_queue.items() if s is False]
+        self._stage_queue.clear()
+        if to_stage:
+            self.app.repo.stage_paths(self._stage_unstage_done_cb, to_stage)
+        if to_unstage:
+            self.app.repo.unstage_paths(self._stage_unstage_done_cb, to_unstage)
+        return False # one shot timer
 
-    def _stage_unstage_done_cb(self, success, path):
+    def _stage_unstage_done_cb(self, success, *args):
         self.app.action_update_header()
         self.diff_list.realized_items_update()
 
@@ -202,6 +232,27 @@ class DiffViewer(Table):
             self.diff_list.item_append(self.itc, item_data)
         self.diff_list.first_item.selected = True
 
+    def _item_path(self, item):
+        if isinstance(item.data, tuple): # in real commits
+            mod, staged, name, new = item.data
+        else: # in local changes (item_data is the path)
+            mod, staged, name, new = self.app.repo.status.changes[item.data]
+        return new or name
+
+    def _show_path_history(self):
+        item = self.diff_list.selected_item
+        if item is not None:
+            self.app.action_path_history(self._item_path(item))
+
+    def _show_blame(self):
+        item = self.diff_list.selected_item
+        if item is not None:
+            sha = self.commit.sha if self.commit else None
+            self.app.action_blame(self._item_path(item), sha)
+
+    def _list_double_clicked_cb(self, li, item):
+        self.app.action_path_history(self._item_path(item))
+
     def _list_selected_cb(self, li, item):
         if isinstance(item.data, tuple): # in real commits
             mod, staged, name, new = item.data
@@ -210,6 +261,8 @@ class DiffViewer(Table):
 
         self.app.repo.request_diff(self._diff_done_cb,
                                    ref1=self.commit.sha if self.commit else None,
+                                   parent=self.commit.first_parent if self.commit
+                                          else None,
                                    path=name)
         self.diff_entry.line_wrap = \
             ELM_WRAP_MIXED if options.diff_text_wrap else ELM_WRAP_NONE
@@ -22,31 +22,43 @@ from __future__ import absolute_import, print_function, unicode_literals
 
 import os
 import sys
+import time
+from datetime import datetime
 
-from efl import elementary as elm
-from efl.elementary.theme import theme_extension_add
-from efl.elementary.entry import utf8_to_markup
-from egitu.utils import options, config_path, theme_file_get, KeyBindings
-from egitu.gui import EgituWin, RepoSelector
+_import_start = time.time()
 
-from egitu.vcs import repo_factory
+from efl import elementary as elm
+from efl.ecore import IdleEnterer, Job
+from efl.elementary.entry import utf8_to_markup, markup_to_utf8
+from egitu.utils import options, config_path, cache_path, KeyBindings
+from egitu.gui import EgituWin, RepoSelector, ClonePopup
+
+from egitu.vcs import repo_factory, git_stats
+from egitu.profiling import profiler
+from egitu.workspace import Workspace
 from egitu.utils  import recent_history_push, app_instance_set, \
     AboutWin, ErrorPopup, RequestPopup, ConfirmPupup
-from egitu.branches import BranchesDialog, DeleteBranchPopup, MergeBranchPopup
-from egitu.tags import TagsDialog
-from egitu.remotes import RemotesDialog
-from egitu.pushpull import PullPopup, PushPopup
-from egitu.stash import StashSavePopup, StashDialog
-from egitu.compare import CompareDialog
-from egitu.gui import ClonePopup
+
+# NOTE: all the dialogs modules are imported lazily, on first use, to
+# speed up the startup time. Only the main window modules are imported here.
+
+_import_end = time.time()
 
 
 class EgituApp(object):
     def __init__(self, args):
         self.repo = None
+        self._loading_repo = None # the last repo asked to load (or refresh)
+        self._update_job = None
+        self._filters_asked = set() # repos already asked to write the filters
+        self._palette_indexes = dict() # url: PaletteIndex (built on first use)
         self.win = EgituWin(self)
         self.win.populate()
 
+        # all the workspace repos are loaded (in background) at startup
+        self.workspace = Workspace(self)
+        self.workspace.load()
+
         # setup keyboard shortcuts
         binds = KeyBindings(self.win, verbose=False)
         binds.bind_add('F1', self.action_about)
@@ -61,6 +73,9 @@ class EgituApp(object):
         binds.bind_add('Control+s', self.action_stash_save)
         binds.bind_add('Control+Shift+s', self.action_stash_show)
         binds.bind_add('Control+m', self.action_compare)
+        binds.bind_add('Control+g', self.action_goto)
+        binds.bind_add('Control+Shift+f', self.action_grep)
+        binds.bind_add('Control+k', self.action_palette)
 
         # try to load a repo, from command-line or cwd (else show the RepoSelector)
         if not self.try_to_load(os.path.abspath(args[0]) if args else os.getcwd()):
@@ -78,14 +93,40 @@ class EgituApp(object):
         RepoSelector(self)
 
     def try_to_load(self, path):
+        if path.rstrip(os.sep) in self.workspace:
+            self.action_workspace_switch(path.rstrip(os.sep))
+            return True
+
         repo = repo_factory(path)
         if repo:
+            self._deactivate_current()
+            # show the last session snapshot while the repo is loading
+            commits = repo.snapshot_load(path)
+            if commits is not None:
+                self._show_snapshot(repo, commits)
+            self._loading_repo = repo
             repo.load_from_url(path, self._load_done_cb, repo)
             return True
         else:
             return False
+
+    def _show_snapshot(self, repo, commits):
+        self.repo = repo
+        self.action_update_header()
+        self.action_clear_sidebar()
+        self.win.graph.populate_from_snapshot(commits, 'HEAD')
     
+    def _deactivate_current(self):
+        # the current workspace repo goes in background (keeping its DAG)
+        if self.repo is not None and self.repo.url in self.workspace:
+            self.repo.background = True
+            self.workspace.commits_set(self.repo.url,
+                                       self.win.graph.snapshot_commits)
+
     def _load_done_cb(self, success, repo):
+        if repo is not self._loading_repo: # user switched to another repo
+            return
+        self._loading_repo = None
         if success is True:
             # save to recent history
             recent_history_push(repo.url)
@@ -101,6 +142,27 @@ class EgituApp(object):
         else:
             RepoSelector(self)
 
+    # workspace actions
+    def action_workspace_switch(self, url):
+        repo = self.workspace.repo_get(url)
+        if repo is None or repo is self.repo:
+            return
+        self._deactivate_current()
+        repo.background = False
+        self._loading_repo = repo
+        self._show_snapshot(repo, self.workspace.commits_get(url) or [])
+        # revalidate (if a background refresh is running it will update all)
+        if not self.workspace.is_refreshing(url):
+            repo.refresh(self._load_done_cb, repo)
+
+    def action_workspace_add(self, *args):
+        if self.repo is not None:
+            self.workspace.add(self.repo)
+
+    def action_workspace_remove(self, *args):
+        if self.repo is not None:
+            self.workspace.remove(self.repo.url)
+
     def checkout_ref(self, ref):
         self.repo.checkout(self._checkout_done_cb, ref)
 
@@ -119,10 +181,20 @@ class EgituApp(object):
 
     # gui update utils
     def action_update_all(self, *args):
+        # many chained operations can request an update, do it just once
+        if self._update_job is None:
+            self._update_job = Job(self._update_all_job_cb)
+
+    def _update_all_job_cb(self):
+        self._update_job = None
         self.win.update_header()
         self.win.sidebar.update()
         self.win.graph.update()
-        
+        # keep the palette index in sync (only the changes are indexed)
+        index = self._palette_indexes.get(self.repo.url) if self.repo else None
+        if index is not None:
+            index.update(self.repo)
+
     def action_update_dag(self, *args):
         self.win.graph.update()
     
@@ -156,24 +228,120 @@ class EgituApp(object):
     def action_show_ref(self, ref):
         self.win.graph.populate(ref, hilight_ref=ref)
 
+    def action_path_history(self, path=None):
+        def _path_cb(path):
+            path = markup_to_utf8(path).strip().strip('/')
+            if path:
+                self.action_path_history(path)
+            else: # the root of the repo, that is the full history
+                self.win.graph.populate()
+
+        def _write_confirmed_cb():
+            self.win.graph.info_label_set('Writing the changed-path filters...')
+            self.repo.write_changed_path_filters(_write_done_cb)
+
+        def _write_done_cb(success, err_msg=None):
+            if not success:
+                ErrorPopup(self.win, msg=utf8_to_markup(err_msg))
+            elif self.win.graph.path is not None:
+                self.win.graph.update()
+
+        if self.repo is None:
+            return
+        if path is None:
+            RequestPopup(self.win, _path_cb, 'Path history',
+                         'Show the history of a file or a folder',
+                         'Path relative to the repository root')
+            return
+
+        self.win.graph.populate(path=path)
+
+        # offer (once per repo) to write the filters that speed up git log
+        if self.repo.url not in self._filters_asked and \
+           not self.repo.has_changed_path_filters():
+            self._filters_asked.add(self.repo.url)
+            ConfirmPupup(self.win, 'Speed up the path history?',
+                'This repository does not have the changed-path filters, '
+                'without them the history of a path can be slow on big '
+                'repositories.<br>Write them now? (git commit-graph write '
+                '--changed-paths)', _write_confirmed_cb)
+
+    def action_blame(self, path, sha=None):
+        from egitu.blame import BlameDialog
+        if self.repo is not None:
+            BlameDialog(self.win, self, path, sha)
+
+    def action_tree(self, sha):
+        from egitu.tree import TreeDialog
+        if self.repo is not None:
+            TreeDialog(self.win, self, sha)
+
+    def action_grep(self, *args, **kargs):
+        from egitu.grep import GrepDialog
+        if self.repo is not None:
+            GrepDialog(self.win, self, **kargs)
+
+    def action_palette(self, *args):
+        from egitu.palette import PaletteDialog, PaletteIndex
+        if self.repo is None:
+            return
+        index = self._palette_indexes.get(self.repo.url)
+        if index is None:
+            index = self._palette_indexes[self.repo.url] = PaletteIndex()
+            index.update(self.repo)
+        PaletteDialog(self.win, self, index)
+
+    def action_goto(self, *args):
+        def _confirmed_cb(text):
+            text = text.strip()
+            try:
+                target = datetime.strptime(text, '%Y-%m-%d')
+            except ValueError:
+                target = text
+            # not found can be known only after paging all the history
+            self.win.graph.goto(target, lambda t: \
+                ErrorPopup(self.win, 'Not found',
+                           'Cannot find <b>%s</b>' % utf8_to_markup(text)))
+
+        if self.repo is not None:
+            RequestPopup(self.win, _confirmed_cb, 'Go to',
+                         'Show a revision in the graph',
+                         'Type a sha, a branch, a tag or a date (YYYY-MM-DD)')
+
+    # commit actions
+    def action_commit(self, **kargs):
+        from egitu.commit import CommitDialog
+        if self.repo is not None:
+            CommitDialog(self, **kargs)
+
+    def action_discard(self, *args):
+        from egitu.commit import DiscardDialog
+        if self.repo is not None:
+            DiscardDialog(self)
+
     # branch actions
     def action_branches(self, *args):
+        from egitu.branches import BranchesDialog
         if self.repo is not None:
             BranchesDialog(self)
 
     def action_branch_delete(self, branch):
+        from egitu.branches import DeleteBranchPopup
         DeleteBranchPopup(self.win, self, branch)
 
     def action_branch_merge(self, branch):
+        from egitu.branches import MergeBranchPopup
         MergeBranchPopup(self.win, self, branch)
 
     # compare actions
     def action_compare(self, *args, **kargs):
+        from egitu.compare import CompareDialog
         if self.repo is not None:
             CompareDialog(self.win, self, **kargs)
 
     # tag actions
     def action_tags(self, *args):
+        from egitu.tags import TagsDialog
         if self.repo is not None:
             TagsDialog(self.win, self)
 
@@ -188,14 +356,17 @@ class EgituApp(object):
 
     # remote actions
     def action_remotes(self, *args):
+        from egitu.remotes import RemotesDialog
         if self.repo is not None:
             RemotesDialog(self)
     
     def action_pull(self, *args):
+        from egitu.pushpull import PullPopup
         if self.repo is not None:
             PullPopup(self.win, self)
     
     def action_push(self, *args):
+        from egitu.pushpull import PushPopup
         if self.repo is not None:
             PushPopup(self.win, self)
 
@@ -204,11 +375,13 @@ class EgituApp(object):
 
     # stash actions
     def action_stash_save(self, *args):
+        from egitu.stash import StashSavePopup
         # TODO: check if repo is clean
         if self.repo is not None:
             StashSavePopup(self.win, self)
 
     def action_stash_show(self, *args):
+        from egitu.stash import StashDialog
         if self.repo is not None:
             if self.repo.stash:
                 StashDialog(self.win, self)
@@ -216,6 +389,7 @@ class EgituApp(object):
                 ErrorPopup(self.win, 'The stash is empty', 'Nothing to show')
 
     def action_stash_show_item(self, stash_item):
+        from egitu.stash import StashDialog
         StashDialog(self.win, self, stash_item)
         
 
@@ -268,27 +442,88 @@ class EgituApp(object):
                          '<b>{0.desc}</b>'.format(stash_item))
 
 
+def parse_profile_args(args):
+    """ Extract the --profile* options from args, return the remaining args
+
+    Supported options:
+        --profile              enable callback timers and long frames log
+        --profile-frame=MS     log main loop iterations longer than MS
+        --profile-cprofile=S   also run cProfile for the first S seconds
+        --profile-output=FILE  where to save the cProfile pstats file
+    """
+    params = {}
+    remaining = []
+    for arg in args:
+        name, _, value = arg.partition('=')
+        if name == '--profile':
+            params.setdefault('long_frame', 0.050)
+        elif name == '--profile-frame':
+            params['long_frame'] = float(value) / 1000.0
+        elif name == '--profile-cprofile':
+            params['cprofile_secs'] = float(value)
+        elif name == '--profile-output':
+            params['cprofile_file'] = value
+        else:
+            remaining.append(arg)
+    if params:
+        params.setdefault('long_frame', 0.050)
+        params.setdefault('cprofile_file',
+                          os.path.join(cache_path, 'egitu.pstats'))
+    return params, remaining
+
+
 def main():
 
+    # command line options
+    profile_params, args = parse_profile_args(sys.argv[1:])
+
     # load config and create necessary folders
     options.load()
     if not os.path.exists(config_path):
         os.makedirs(config_path)
+    if profile_params and not os.path.exists(cache_path):
+        os.makedirs(cache_path)
 
-    # init elm
+    # init elm (the theme extension is loaded later, on first DAG populate)
+    t_init = time.time()
     elm.init()
-    theme_extension_add(theme_file_get())
+
+    # the profiler must wrap the callbacks before any widget is created
+    if profile_params:
+        profiler.start(**profile_params)
 
     # Egitu
-    app = EgituApp(sys.argv[1:])
+    t_win = time.time()
+    app = EgituApp(args)
     app_instance_set(app) # Ugly :/
 
+    # startup time, the first idle is reached after the first frame render
+    def _first_frame_cb():
+        t = time.time()
+        print('Startup time: %.0f ms (imports: %.0f ms, init: %.0f ms, '
+              'window: %.0f ms, first frame: %.0f ms)' % (
+              (t - _import_start) * 1000,
+              (_import_end - _import_start) * 1000,
+              (t_win - t_init) * 1000,
+              (t_frame - t_win) * 1000,
+              (t - t_frame) * 1000))
+        return False # just once
+    t_frame = time.time()
+    IdleEnterer(_first_frame_cb)
+
     # enter the mainloop
     elm.run()
 
-    # mainloop done, shutdown
-    elm.shutdown()
+    # mainloop done, flush the config (if changed) and shutdown
     options.save()
+    elm.shutdown()
+
+    # dump git commands statistics (if requested)
+    if os.environ.get('EGITU_GIT_STATS'):
+        git_stats.dump(os.environ.get('EGITU_GIT_STATS'))
+
+    # print the profile report (if --profile was given)
+    profiler.report()
 
     return 0
 
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2014-2015 Davide Andreoli <dave@gurumeditation.it>
+#
+# This file is part of Egitu.
+#
+# Egitu is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# Egitu is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Egitu.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+from efl.ecore import Timer, Job
+from efl.elementary.window import DialogWindow
+from efl.elementary.box import Box
+from efl.elementary.button import Button
+from efl.elementary.check import Check
+from efl.elementary.separator import Separator
+from efl.elementary.frame import Frame
+from efl.elementary.label import Label
+from efl.elementary.entry import Entry, utf8_to_markup, markup_to_utf8
+from efl.elementary.genlist import Genlist, GenlistItemClass, \
+    ELM_LIST_COMPRESS, ELM_GENLIST_ITEM_GROUP, ELM_OBJECT_SELECT_MODE_NONE
+
+from egitu.utils import options, \
+    EXPAND_BOTH, FILL_BOTH, EXPAND_HORIZ, FILL_HORIZ
+
+
+# stop the search after this many matches
+GREP_MAX_RESULTS = 10000
+# seconds to wait after the last keystroke before searching
+GREP_DELAY = 0.3
+
+
+class GrepResultsList(Genlist):
+    """ The matches grouped by file, items are added in batches
+
+    Group items data is the path, match items data is (path, num, line).
+    """
+    def __init__(self, parent, **kargs):
+        Genlist.__init__(self, parent, homogeneous=True, mode=ELM_LIST_COMPRESS,
+                         size_hint_expand=EXPAND_BOTH, size_hint_fill=FILL_BOTH,
+                         **kargs)
+        self._itc_file = GenlistItemClass(item_style='group_index',
+                                          text_get_func=self._file_text_get)
+        self._itc_match = GenlistItemClass(item_style='no_icon',
+                                           text_get_func=self._match_text_get)
+        self._groups = dict()  # path: [group item, num matches]
+        self._pending = []     # matches not yet in the list
+        self._flush_job = None
+
+    @property
+    def num_files(self):
+        return len(self._groups)
+
+    def reset(self):
+        if self._flush_job is not None:
+            self._flush_job.delete()
+            self._flush_job = None
+        del self._pending[:]
+        self._groups.clear()
+        self.clear()
+
+    def match_add(self, path, num, line):
+        self._pending.append((path, num, line))
+        # matches arrive many at a time, add them to the list in one go
+        if self._flush_job is None:
+            self._flush_job = Job(self.flush)
+
+    def flush(self):
+        self._flush_job = None
+        updated = set()
+        for match in self._pending:
+            path = match[0]
+            group = self._groups.get(path)
+            if group is None:
+                it = self.item_append(self._itc_file, path,
+                                      flags=ELM_GENLIST_ITEM_GROUP)
+                it.select_mode = ELM_OBJECT_SELECT_MODE_NONE
+                group = self._groups[path] = [it, 0]
+            group[1] += 1
+            updated.add(path)
+            self.item_append(self._itc_match, match, parent_item=group[0])
+        del self._pending[:]
+        for path in updated:
+            self._groups[path][0].update()
+
+    def _file_text_get(self, gl, part, path):
+        group = self._groups.get(path)
+        count = group[1] if group else 0
+        return '{} ({})'.format(utf8_to_markup(path), count)
+
+    def _match_text_get(self, gl, part, match):
+        path, num, line = match
+        return '<code><font={} font_size={}><name>{:>5}</name>  {}</font>' \
+               '</code>'.format(options.diff_font_face, options.diff_font_size,
+                                num, utf8_to_markup(line.expandtabs(4)))
+
+
+class GrepDialog(DialogWindow):
+    def __init__(self, parent, app, rev=None):
+        self.app = app
+        self._search = None  # the running search (to cancel it)
+        self._timer = None
+
+        DialogWindow.__init__(self, parent, 'Egitu-grep', 'Search in files',
+                              size=(700,500), autodel=True)
+        self.on_del_add(lambda o: self._cancel())
+
+        # main vertical box (inside a padding frame)
+        vbox = Box(self, padding=(0, 6), size_hint_expand=EXPAND_BOTH,
+                   size_hint_fill=FILL_BOTH)
+        fr = Frame(self, style='pad_medium', size_hint_expand=EXPAND_BOTH)
+        self.resize_object_add(fr)
+        fr.content = vbox
+        fr.show()
+        vbox.show()
+
+        # pattern, revision and options
+        hbox = Box(self, horizontal=True, padding=(6,0),
+                   size_hint_expand=EXPAND_HORIZ, size_hint_fill=FILL_HORIZ)
+        vbox.pack_end(hbox)
+        hbox.show()
+
+        en = Entry(self, single_line=True, scrollable=True,
+                   size_hint_expand=EXPAND_HORIZ, size_hint_fill=FILL_HORIZ)
+        en.part_text_set('guide', 'Regular expression to search')
+        en.callback_changed_user_add(lambda e: self.search_later())
+        hbox.pack_end(en)
+        en.show()
+        self.pattern_entry = en
+
+        en = Entry(self, single_line=True, scrollable=True, text=rev or '',
+                   size_hint_expand=EXPAND_HORIZ, size_hint_fill=FILL_HORIZ)
+        en.part_text_set('guide', 'Revision (empty for the working tree)')
+        en.callback_changed_user_add(lambda e: self.search_later())
+        hbox.pack_end(en)
+        en.show()
+        self.rev_entry = en
+
+        ck = Check(self, text='Ignore case')
+        ck.callback_changed_add(lambda c: self.search_later())
+        hbox.pack_end(ck)
+        ck.show()
+        self.case_check = ck
+
+        # results
+        li = GrepResultsList(self)
+        li.callback_clicked_double_add(self._match_double_clicked_cb)
+        vbox.pack_end(li)
+        li.show()
+        self.results_list = li
+
+        # status + buttons
+        hbox = Box(self, horizontal=True,
+                   size_hint_expand=EXPAND_HORIZ, size_hint_fill=FILL_HORIZ)
+        vbox.pack_end(hbox)
+        hbox.show()
+
+        lb = Label(self)
+        hbox.pack_end(lb)
+        lb.show()
+        self.status_label = lb
+
+        sep = Separator(self, size_hint_expand=EXPAND_HORIZ)
+        hbox.pack_end(sep)
+
+        bt = Button(self, text='Close')
+        bt.callback_clicked_add(lambda b: self.delete())
+        hbox.pack_end(bt)
+        bt.show()
+
+        #
+        self.show()
+        self.pattern_entry.focus = True
+
+    @property
+    def rev(self):
+        return markup_to_utf8(self.rev_entry.text).strip() or None
+
+    def _cancel(self):
+        if self._timer is not None:
+            self._timer.delete()
+            self._timer = None
+        if self._search is not None:
+            self._search.cancel()
+            self._search = None
+
+    def search_later(self):
+        """ Stop the current search and start a new one after a while """
+        self._cancel()
+        self._timer = Timer(GREP_DELAY, self._timer_cb)
+
+    def _timer_cb(self):
+        self._timer = None
+        self.search()
+        return False # one shot timer
+
+    def search(self):
+        self._cancel()
+        self.results_list.reset()
+        pattern = markup_to_utf8(self.pattern_entry.text)
+        if not pattern:
+            self.status_label.text = ''
+            return
+        self.status_label.text = 'Searching...'
+        self._search = self.app.repo.request_grep(
+            self._grep_done_cb, self.results_list.match_add, pattern,
+            rev=self.rev, ignore_case=self.case_check.state,
+            max_results=GREP_MAX_RESULTS)
+
+    def _grep_done_cb(self, success, num_matches, truncated, err_msg=None):
+        self._search = None
+        self.results_list.flush()
+        if not success:
+            self.status_label.text = '<failure>{}</failure>'.format(
+                utf8_to_markup(err_msg.splitlines()[0] if err_msg else ''))
+        elif truncated:
+            self.status_label.text = 'Only the first {} matches are ' \
+                                     'shown'.format(num_matches)
+        else:
+            self.status_label.text = '{} matches in {} files'.format(
+                num_matches, self.results_list.num_files)
+
+    def _match_double_clicked_cb(self, li, item):
+        if isinstance(item.data, tuple):
+            self.app.action_blame(item.data[0], self.rev)
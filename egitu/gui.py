@@ -23,6 +23,7 @@ from __future__ import absolute_import, print_function, unicode_literals
 import os
 
 from efl import elementary as elm
+from efl.ecore import Timer
 from efl.evas import Rectangle
 from efl.elementary.window import StandardWindow, DialogWindow
 from efl.elementary.box import Box
@@ -43,15 +44,16 @@ from efl.elementary.separator import Separator
 
 from egitu.utils import options, GravatarPict, ErrorPopup, ConfirmPupup, \
     FolderSelector, CommandOutputEntry, DiffedEntry, SafeIcon, format_date, \
-    recent_history_get, recent_history_push, \
+    recent_history_get, recent_history_push, cache_path, \
     EXPAND_BOTH, EXPAND_HORIZ, EXPAND_VERT, FILL_BOTH, FILL_HORIZ, FILL_VERT
 from egitu.dagview import DagGraph
 from egitu.diffview import DiffViewer
 from egitu.sidebar import Sidebar
-from egitu.remotes import RemotesDialog
-from egitu.branches import BranchesDialog
-from egitu.pushpull import PullPopup, PushPopup
-from egitu.vcs import git_clone
+from egitu.vcs import git_clone, git_stats, git_scheduler
+
+
+# max number of branches in the header selector (the others in the palette)
+BRANCH_SELECTOR_MAX = 30
 
 
 class RepoSelector(Popup):
@@ -275,6 +277,99 @@ class ClonePopup(Popup):
             self.output_entry.failure()
 
 
+class GitStatsDialog(DialogWindow):
+    """ Live statistics of all the executed git commands (for debug) """
+    def __init__(self, app):
+        self.app = app
+
+        DialogWindow.__init__(self, app.win, 'egitu-gitstats',
+                              'Git commands statistics',
+                              size=(650,300), autodel=True)
+
+        vbox = Box(self, padding=(0,6),
+                   size_hint_expand=EXPAND_BOTH, size_hint_fill=FILL_BOTH)
+        fr = Frame(self, style='pad_medium', size_hint_expand=EXPAND_BOTH)
+        self.resize_object_add(fr)
+        fr.content = vbox
+        fr.show()
+        vbox.show()
+
+        # stats entry
+        en = Entry(self, editable=False, scrollable=True,
+                   line_wrap=ELM_WRAP_NONE,
+                   size_hint_expand=EXPAND_BOTH, size_hint_fill=FILL_BOTH)
+        vbox.pack_end(en)
+        en.show()
+        self.entry = en
+
+        # buttons
+        hbox = Box(self, horizontal=True,
+                   size_hint_expand=EXPAND_HORIZ, size_hint_fill=FILL_BOTH)
+        vbox.pack_end(hbox)
+        hbox.show()
+
+        bt = Button(self, text='Reset')
+        bt.callback_clicked_add(self._reset_clicked_cb)
+        hbox.pack_end(bt)
+        bt.show()
+
+        bt = Button(self, text='Save to file')
+        bt.callback_clicked_add(self._save_clicked_cb)
+        hbox.pack_end(bt)
+        bt.show()
+
+        sep = Separator(self, size_hint_expand=EXPAND_HORIZ)
+        hbox.pack_end(sep)
+
+        bt = Button(self, text='Close')
+        bt.callback_clicked_add(lambda b: self.delete())
+        hbox.pack_end(bt)
+        bt.show()
+
+        # update once per second, while the dialog is open
+        self.timer = Timer(1.0, self.update)
+        self.on_del_add(lambda o: self.timer.delete())
+        self.update()
+        self.show()
+
+    def update(self):
+        text = '<code>{:<12} {:<9} {:>5} {:>8} {:>8} {:>8} {:>10} {:>8} {:>5}<br>'.format(
+               'kind', 'caller', 'count', 'total', 'avg', 'max',
+               'avg ttfb', 'KB', 'fail')
+        for d in git_stats.summary():
+            text += '{:<12} {:<9} {:>5} {:>8.3f} {:>8.3f} {:>8.3f} {:>10.3f} {:>8} {:>5}<br>'.format(
+                    d['kind'][:12], d['caller'][:9], d['count'], d['time'],
+                    d['avg_time'], d['max_time'], d['avg_ttfb'],
+                    d['bytes'] // 1024, d['failures'])
+
+        text += '<br>{:<12} {:>6} {:>7} {:>9} {:>9} {:>8}<br>'.format(
+                'priority', 'queued', 'running', 'submitted', 'max depth',
+                'avg wait')
+        for d in git_scheduler.stats():
+            text += '{:<12} {:>6} {:>7} {:>9} {:>9} {:>8.3f}<br>'.format(
+                    d['priority'], d['queued'], d['running'], d['submitted'],
+                    d['max_depth'], d['avg_wait'])
+        text += 'coalesced: {}<br>'.format(git_scheduler.coalesced)
+        self.entry.text = text + '</code>'
+        return True # keep the timer alive
+
+    def _reset_clicked_cb(self, bt):
+        git_stats.reset()
+        git_scheduler.reset_stats()
+        self.update()
+
+    def _save_clicked_cb(self, bt):
+        if not os.path.exists(cache_path):
+            os.makedirs(cache_path)
+        path = os.path.join(cache_path, 'git_stats.json')
+        try:
+            git_stats.dump(path)
+        except (IOError, OSError) as e:
+            ErrorPopup(self, 'Cannot save stats', str(e))
+        else:
+            bt.text = 'Saved in: ' + path
+
+
 class MainMenuButton(Button):
     def __init__(self, app):
         self.app = app
@@ -306,13 +401,31 @@ class MainMenuButton(Button):
                    self.app.action_tags).disabled = disabled
         m.item_add(None, 'Compare...', 'git-compare', 
                    self.app.action_compare).disabled = disabled
+        m.item_add(None, 'Search in files...', 'edit-find',
+                   self.app.action_grep).disabled = disabled
         m.item_add(None, 'Remotes...', 'git-remote', 
                    self.app.action_remotes).disabled = disabled
         m.item_add(None, 'Stashes...', 'git-stash', 
                    self.app.action_stash_show).disabled = disabled
 
-        # general options
+        # workspace
         m.item_separator_add()
+        it_ws = m.item_add(None, 'Workspace', 'folder')
+        current = self.app.repo.url if self.app.repo else None
+        for url in self.app.workspace.urls:
+            icon = 'user-bookmarks' if url == current else None
+            m.item_add(it_ws, url, icon,
+                       lambda m, i, u=url: self.app.action_workspace_switch(u))
+        if self.app.workspace.urls:
+            m.item_separator_add(it_ws)
+        if current in self.app.workspace:
+            m.item_add(it_ws, 'Remove current repository', 'list-remove',
+                       self.app.action_workspace_remove)
+        else:
+            m.item_add(it_ws, 'Add current repository', 'list-add',
+                       self.app.action_workspace_add).disabled = disabled
+
+        # general options
         it_gen = m.item_add(None, 'General', 'preference')
 
         it = m.item_add(it_gen, 'Use relative dates', None,
@@ -323,11 +436,17 @@ class MainMenuButton(Button):
                         self._item_check_opts_cb, 'review_git_commands')
         it.content = Check(self, state=options.review_git_commands)
 
+        m.item_add(it_gen, 'Git commands statistics...', None,
+                   lambda m,i: GitStatsDialog(self.app))
+
         it_gravatar = m.item_add(it_gen, 'Gravatar')
         for name in ('mm', 'identicon', 'monsterid', 'wavatar', 'retro'):
             icon = 'user-bookmarks' if name == options.gravatar_default else None
             m.item_add(it_gravatar, name, icon,  self._item_gravatar_cb)
         m.item_separator_add(it_gravatar)
+        it = m.item_add(it_gravatar, 'Offline (local identicons only)', None,
+                        self._item_check_opts_cb, 'gravatar_offline')
+        it.content = Check(self, state=options.gravatar_offline)
         m.item_add(it_gravatar, 'Clear icons cache', 'user-trash',
                    lambda m,i: GravatarPict.clear_icon_cache())
 
@@ -350,9 +469,15 @@ class MainMenuButton(Button):
                         self._item_check_opts_cb, 'show_stash_in_dag')
         it.content = Check(self, state=options.show_stash_in_dag)
 
+        # number of commits is stored per-repo (when a repo is loaded)
         it_numb = m.item_add(it_dag, 'Number of commits to load')
+        if self.app.repo is not None:
+            current = options.repo_get(self.app.repo.url,
+                                       'number_of_commits_to_load')
+        else:
+            current = options.number_of_commits_to_load
         for num in (100, 200, 500, 1000):
-            icon = 'user-bookmarks' if num == options.number_of_commits_to_load else None
+            icon = 'user-bookmarks' if num == current else None
             m.item_add(it_numb, str(num), icon, self._item_num_commits_cb)
 
         # diff options
@@ -405,7 +530,11 @@ class MainMenuButton(Button):
         self.app.action_update_diffview()
     
     def _item_num_commits_cb(self, menu, item):
-        options.number_of_commits_to_load = int(item.text)
+        if self.app.repo is not None:
+            options.repo_set(self.app.repo.url, 'number_of_commits_to_load',
+                             int(item.text))
+        else:
+            options.number_of_commits_to_load = int(item.text)
         self.app.action_update_dag()
 
 
@@ -579,9 +708,16 @@ class EgituWin(StandardWindow):
         else:
             self.branch_selector.clear()
             self.branch_selector.disabled = False
-            for branch in repo.branches:
+            # with many branches the hoversel is unusable, use the palette
+            branches = [b for b in repo.branches if b.is_current] + \
+                       [b for b in repo.branches if not b.is_current]
+            for branch in branches[:BRANCH_SELECTOR_MAX]:
                 ic = 'arrow-right' if branch.is_current else 'git-branch'
                 self.branch_selector.item_add(branch.name, ic, ELM_ICON_STANDARD)
+            if len(branches) > BRANCH_SELECTOR_MAX:
+                it = self.branch_selector.item_add(
+                    'More branches... (Ctrl+K)', 'edit-find', ELM_ICON_STANDARD)
+                it.data['palette'] = True
             if repo.status.head_detached:
                 if repo.status.head_to_tag:
                     ic = SafeIcon(self.branch_selector, 'git-tag')
@@ -621,7 +757,10 @@ class EgituWin(StandardWindow):
         self.pull_btn.disabled = self.push_btn.disabled = self.app.repo is None
 
     def branch_selected_cb(self, hoversel, item):
-        self.app.checkout_ref(item.text)
+        if item.data.get('palette'):
+            self.app.action_palette()
+        else:
+            self.app.checkout_ref(item.text)
 
     def _binds_cb_refresh(self, src, key, event):
         self.refresh()
@@ -636,14 +775,14 @@ class EgituWin(StandardWindow):
         return True
 
     def _binds_cb_branches(self, src, key, event):
-        BranchesDialog(self.app, self)
+        self.app.action_branches()
         return True
 
     def _binds_cb_push(self, src, key, event):
-        PushPopup(self, self.app)
+        self.app.action_push()
         return True
 
     def _binds_cb_pull(self, src, key, event):
-        PullPopup(self, self.app)
+        self.app.action_pull()
         return True
 
@@ -0,0 +1,517 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2014-2015 Davide Andreoli <dave@gurumeditation.it>
+#
+# This file is part of Egitu.
+#
+# Egitu is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# Egitu is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Egitu.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import re
+import bisect
+from array import array
+from collections import deque
+
+from efl.ecore import Idler
+from efl.elementary.window import DialogWindow
+from efl.elementary.box import Box
+from efl.elementary.frame import Frame
+from efl.elementary.label import Label
+from efl.elementary.entry import Entry, utf8_to_markup, markup_to_utf8
+from efl.elementary.genlist import Genlist, GenlistItemClass, \
+    ELM_LIST_COMPRESS, ELM_OBJECT_SELECT_MODE_ALWAYS
+
+from egitu.utils import SafeIcon, KeyBindings, \
+    EXPAND_BOTH, FILL_BOTH, EXPAND_HORIZ, FILL_HORIZ
+
+
+SPLIT_RE = re.compile(r'[/\s]+', re.UNICODE)
+
+# number of recent commits to put in the palette
+PALETTE_COMMITS = 1000
+# number of items to index at each idle loop iteration
+INDEX_STEP = 1000
+# number of results to show
+RESULTS_MAX = 50
+
+
+def _intersect(postings):
+    """ Lazily yield the ids that are in all the sorted arrays
+
+    The first array drive (pass the smallest first), the others are only
+    searched forward from the last position found.
+    """
+    first, others = postings[0], postings[1:]
+    pos = [0] * len(others)
+    for i in first:
+        for n, p in enumerate(others):
+            j = pos[n] = bisect.bisect_left(p, i, pos[n])
+            if j == len(p):
+                return
+            if p[j] != i:
+                break
+        else:
+            yield i
+
+def _trigrams(text):
+    return set(text[i:i+3] for i in range(len(text) - 2))
+
+def _subsequence_re(word):
+    """ Regex that match the chars of word in order, anything between """
+    chars = [re.escape(c) for c in word]
+    return re.compile(chars[0] + ''.join('[^%s\n]*%s' % (c, c)
+                                         for c in chars[1:]))
+
+
+class PaletteIndex(object):
+    """ Fuzzy finder index over refs, commits and files
+
+    Every item text is split in segments (on slashes and spaces), each
+    unique segment has the sorted array of the items that contain it. The
+    segments are indexed by trigram (to find the ones that contain a
+    word) and by their first three chars (to find the ones that start
+    with it).
+
+    A query matches the items that contain every word of the query, in
+    any order: "feat login" find "origin/feature/login-form". Only the
+    word with less items is searched in the index (at the start of a
+    segment, or inside it), the others just filter the items found.
+    Words too short for the trigrams (like "py") that do not start any
+    segment are only used as filters, or searched with a regex over all
+    the segments at once if the query has no other word. When there are
+    not enough substring matches the words are also searched (the same
+    way) as subsequences: "flgn" find "file_login.py".
+    Results are ranked by the quality of the segment match (exact, prefix,
+    substring, subsequence, this one by how spread the chars are) then by
+    kind and length. The segments are produced lazily and the search stop
+    as soon as there are enough good items, so a query cost a few ms even
+    with many thousands of items.
+
+    set_items() only apply the differences with the previous items of the
+    same kind, so the index can be updated after each refresh. New items
+    are not indexed immediately: call index_step() (in an idle loop) until
+    it return False, big repositories are indexed without blocking the UI.
+    """
+    KINDS = ('branch', 'remote', 'tag', 'commit', 'file') # in ranking order
+    COMPACT_MIN_DEAD = 1000
+
+    def __init__(self):
+        self.updating = False
+        self.changed_cb = None # called when new items become searchable
+        self._paths = None     # the last list of tracked paths indexed
+        self._idler = None
+        self._clear()
+
+    def _clear(self):
+        self._ids = dict((k, dict()) for k in self.KINDS) # kind: {text: id}
+        self._items = []      # item id: (kind, text, data) or None if removed
+        self._segs = []       # item id: tuple of segment ids (None if pending)
+        self._pending = deque() # ids of the items still to index
+        self._seg_ids = {}    # 'segment': segment id
+        self._seg_texts = []  # segment id: 'segment'
+        self._seg_items = []  # segment id: array of item ids (sorted)
+        self._trigrams = {}   # 'abc': array of segment ids (sorted)
+        self._prefixes = {}   # 'a', 'ab', 'abc': array of segment ids (sorted)
+        self._blob = ''       # all the segments, one per line (built on search)
+        self._blob_offsets = array(str('I')) # segment id: offset in _blob
+        self._dead = 0
+
+    def __len__(self):
+        return len(self._items) - self._dead
+
+    @property
+    def indexing(self):
+        """ True if some items are not yet searchable """
+        return len(self._pending) > 0
+
+    @property
+    def num_indexed(self):
+        return len(self._items) - len(self._pending)
+
+    def set_items(self, kind, items):
+        """ Set all the items of the given kind
+
+        items is a list of (text, data), texts must be unique in the kind.
+        Return True if something changed.
+        """
+        ids = self._ids[kind]
+        new = dict(items)
+        changed = False
+        for text in [t for t in ids if t not in new]:
+            self._items[ids.pop(text)] = None
+            self._dead += 1
+            changed = True
+        for text, data in items:
+            item_id = ids.get(text)
+            if item_id is None:
+                ids[text] = item_id = len(self._items)
+                self._items.append((kind, text, data))
+                self._segs.append(None)
+                self._pending.append(item_id)
+                changed = True
+            elif self._items[item_id][2] != data:
+                self._items[item_id] = (kind, text, data)
+
+        # removed items are only skipped, rebuild when they are too many
+        if self._dead > self.COMPACT_MIN_DEAD and self._dead > len(self):
+            self._compact()
+        return changed
+
+    def update(self, repo):
+        """ Refresh the items from repo, only the changes are indexed """
+        def _commits_done_cb(success, err_msg=None):
+            if success:
+                self.set_items('commit', commits)
+            repo.request_tracked_paths(_paths_done_cb)
+
+        def _paths_done_cb(success, paths, err_msg=None):
+            self.updating = False
+            # the same list is given back if the index did not change
+            if success and paths is not self._paths:
+                self._paths = paths
+                self.set_items('file', [(p, p) for p in paths])
+            self._index_start()
+
+        if self.updating:
+            return
+        self.updating = True
+        self.set_items('branch', [(b.name, b.name) for b in repo.branches])
+        self.set_items('remote', [(b, b) for b in repo.remote_branches])
+        self.set_items('tag', [(t.name, t.name) for t in repo.tags])
+        self._index_start()
+
+        commits = []
+        repo.request_commits(_commits_done_cb,
+            lambda c: commits.append(('{} {}'.format(c.sha[:7], c.title),
+                                      c.sha)),
+            ref1='HEAD', max_count=PALETTE_COMMITS)
+
+    def _index_start(self):
+        if self._pending and self._idler is None:
+            self._idler = Idler(self._idler_cb)
+
+    def _idler_cb(self):
+        more = self.index_step(INDEX_STEP)
+        if callable(self.changed_cb):
+            self.changed_cb()
+        if not more:
+            self._idler = None
+        return more # renew the idler while there are items to index
+
+    def index_step(self, count=5000):
+        """ Index some of the new items, return True if more are pending """
+        pending = self._pending
+        while pending and count > 0:
+            item_id = pending.popleft()
+            if self._items[item_id] is not None:
+                self._index_item(item_id)
+                count -= 1
+        return len(pending) > 0
+
+    def _index_item(self, item_id):
+        seg_ids = []
+        for seg in set(SPLIT_RE.split(self._items[item_id][1].lower())):
+            if not seg:
+                continue
+            seg_id = self._seg_ids.get(seg)
+            if seg_id is None:
+                seg_id = self._new_segment(seg)
+            self._seg_items[seg_id].append(item_id)
+            seg_ids.append(seg_id)
+        self._segs[item_id] = tuple(seg_ids)
+
+    def _new_segment(self, seg):
+        seg_id = self._seg_ids[seg] = len(self._seg_texts)
+        self._seg_texts.append(seg)
+        self._seg_items.append(array(str('I')))
+        keys = [(t, self._trigrams) for t in _trigrams(seg)] + \
+               [(seg[:n], self._prefixes) for n in (1, 2, 3) if len(seg) >= n]
+        for key, table in keys:
+            try:
+                table[key].append(seg_id)
+            except KeyError:
+                table[key] = array(str('I'), (seg_id,))
+        return seg_id
+
+    def _compact(self):
+        items = [i for i in self._items if i is not None]
+        self._clear()
+        for kind, text, data in items:
+            self._ids[kind][text] = len(self._items)
+            self._pending.append(len(self._items))
+            self._items.append((kind, text, data))
+            self._segs.append(None)
+
+    def _segments_exact_prefix(self, word):
+        """ Segments equal to word, and segments that start with word """
+        texts = self._seg_texts
+        exact = self._seg_ids.get(word)
+        candidates = self._prefixes.get(word[:3], ())
+        if len(word) <= 3: # all the candidates start with word
+            prefix = [i for i in candidates if i != exact]
+        else:
+            prefix = [i for i in candidates
+                      if i != exact and texts[i].startswith(word)]
+        return [] if exact is None else [exact], prefix
+
+    def _inside_estimate(self, word):
+        """ Max number of segments that contain word (0 if none) """
+        postings = [self._trigrams.get(tri, ()) for tri in _trigrams(word)]
+        return min(len(p) for p in postings) if postings else 0
+
+    def _segments_inside(self, word):
+        """ Segments that contain word (not at the start), lazily """
+        if len(word) < 3: # too short for the trigrams, only the prefixes
+            return
+        postings = []
+        for tri in _trigrams(word):
+            p = self._trigrams.get(tri)
+            if p is None:
+                return
+            postings.append(p)
+        postings.sort(key=len)
+        texts = self._seg_texts
+        for i in _intersect(postings):
+            if texts[i].find(word) > 0:
+                yield i
+
+    def _segments_matching(self, regex):
+        """ Segments where regex (that cannot match newlines) match, lazily """
+        # append the segments created since the last search to the blob
+        texts, offsets = self._seg_texts, self._blob_offsets
+        if len(offsets) < len(texts):
+            new = texts[len(offsets):]
+            offset = len(self._blob)
+            for seg in new:
+                offsets.append(offset)
+                offset += len(seg) + 1
+            self._blob += '\n'.join(new) + '\n'
+        last = None
+        for m in regex.finditer(self._blob):
+            seg_id = bisect.bisect_right(offsets, m.start()) - 1
+            if seg_id != last:
+                last = seg_id
+                yield seg_id
+
+    def search(self, query, limit=50):
+        """ The best items for query, as a list of (kind, text, data) """
+        words = set(w for w in SPLIT_RE.split(query.lower()) if w)
+        if not words:
+            return []
+
+        # the word with less items drive the search, the others only filter
+        # (most of the prefix segments are file names, with a single item)
+        matches = []
+        short = [] # not in the index, can only filter
+        missing = False # a word is in no segment, only subsequences match
+        for word in words:
+            exact, prefix = self._segments_exact_prefix(word)
+            num = len(prefix) + sum(len(self._seg_items[s]) for s in exact)
+            if num > 0:
+                matches.append((num, word, [exact, prefix]))
+            elif len(word) < 3:
+                short.append(word)
+            else: # the word can still be inside some segments
+                num = self._inside_estimate(word)
+                if num > 0:
+                    matches.append((num, word, [exact, prefix]))
+                else:
+                    missing = True
+        kind_rank = dict((k, n) for n, k in enumerate(self.KINDS))
+        enough = limit * 3
+
+        if matches:
+            matches.sort()
+            num, word, tiers = matches[0]
+            others = [m[1] for m in matches[1:]] + short
+            qualities = (0, 1, 2, 3)
+        else: # only short words, nothing to drive the search
+            word, tiers, others = None, [], short
+            qualities = (2, 3)
+        if missing: # no substring match is possible
+            qualities = (3,)
+
+        found = dict() # item id: (quality, spread, kind rank, length)
+        for quality in qualities:
+            if len(found) >= enough:
+                break
+            filters, subsequences = others, None
+            if quality < len(tiers):
+                candidates = (i for s in tiers[quality]
+                                for i in self._seg_items[s])
+            elif quality == 3:
+                # every word (the driving one too) must be a subsequence
+                subsequences = [_subsequence_re(w) for w in words]
+                driver = word or max(words, key=len)
+                regex = _subsequence_re(driver)
+                candidates = (i for s in self._segments_matching(regex)
+                                for i in self._seg_items[s])
+            elif len(word or '') >= 3:
+                # the substring tier is the slowest, only if really needed
+                candidates = (i for s in self._segments_inside(word)
+                                for i in self._seg_items[s])
+            else: # too short for the trigrams, search all the segments
+                driver = word or max(others, key=len)
+                filters = [w for w in others if w != driver]
+                regex = re.compile(re.escape(driver))
+                candidates = (i for s in self._segments_matching(regex)
+                                for i in self._seg_items[s])
+            for item_id in candidates:
+                item = self._items[item_id]
+                if item is None or item_id in found:
+                    continue
+                low = item[1].lower()
+                if subsequences is None:
+                    if not all(w in low for w in filters):
+                        continue
+                    spread = 0
+                else:
+                    spans = [r.search(low) for r in subsequences]
+                    if not all(spans):
+                        continue
+                    spread = sum(m.end() - m.start() for m in spans)
+                found[item_id] = (quality, spread, kind_rank[item[0]],
+                                  len(item[1]))
+                if len(found) >= enough:
+                    break
+
+        best = sorted(found, key=found.get)[:limit]
+        return [self._items[i] for i in best]
+
+
+class PaletteList(Genlist):
+    """ The results of the palette, item data is (kind, text, data) """
+    ICONS = {'branch': 'git-branch', 'remote': 'git-branch',
+             'tag': 'git-tag', 'commit': 'git-commit', 'file': 'git-mod-M'}
+
+    def __init__(self, parent, **kargs):
+        Genlist.__init__(self, parent, homogeneous=True, mode=ELM_LIST_COMPRESS,
+                         size_hint_expand=EXPAND_BOTH, size_hint_fill=FILL_BOTH,
+                         select_mode=ELM_OBJECT_SELECT_MODE_ALWAYS, **kargs)
+        self._itc = GenlistItemClass(item_style='default',
+                                     text_get_func=self._gl_text_get,
+                                     content_get_func=self._gl_content_get)
+
+    def populate(self, results):
+        self.clear()
+        for result in results:
+            self.item_append(self._itc, result)
+        if self.first_item:
+            self.first_item.selected = True
+
+    def _gl_text_get(self, gl, part, result):
+        kind, text, data = result
+        return '{} <i>({})</i>'.format(utf8_to_markup(text), kind)
+
+    def _gl_content_get(self, gl, part, result):
+        if part == 'elm.swallow.icon':
+            return SafeIcon(gl, self.ICONS[result[0]])
+
+
+class PaletteDialog(DialogWindow):
+    """ Ctrl+K: find and open a branch, a tag, a recent commit or a file """
+    def __init__(self, parent, app, index):
+        self.app = app
+        self.index = index
+
+        DialogWindow.__init__(self, parent, 'Egitu-palette', 'Go to anything',
+                              size=(500,400), autodel=True)
+        self.on_del_add(self._del_cb)
+
+        # main vertical box (inside a padding frame)
+        vbox = Box(self, padding=(0, 6), size_hint_expand=EXPAND_BOTH,
+                   size_hint_fill=FILL_BOTH)
+        fr = Frame(self, style='pad_medium', size_hint_expand=EXPAND_BOTH)
+        self.resize_object_add(fr)
+        fr.content = vbox
+        fr.show()
+        vbox.show()
+
+        en = Entry(self, single_line=True, scrollable=True,
+                   size_hint_expand=EXPAND_HORIZ, size_hint_fill=FILL_HORIZ)
+        en.part_text_set('guide', 'Branch, tag, commit or file name')
+        en.callback_changed_user_add(lambda e: self.search())
+        en.callback_activated_add(lambda e: self.activate())
+        vbox.pack_end(en)
+        en.show()
+        self.entry = en
+
+        li = PaletteList(self)
+        li.callback_clicked_double_add(lambda l, i: self.activate(i))
+        vbox.pack_end(li)
+        li.show()
+        self.results_list = li
+
+        lb = Label(self, size_hint_expand=EXPAND_HORIZ,
+                   size_hint_align=(0.0, 0.5))
+        vbox.pack_end(lb)
+        lb.show()
+        self.status_label = lb
+
+        binds = KeyBindings(self, verbose=False)
+        binds.bind_add('Escape', lambda *a: self.delete() or True)
+        binds.bind_add('Up', lambda *a: self._move_selection(-1))
+        binds.bind_add('Down', lambda *a: self._move_selection(1))
+
+        index.changed_cb = self._index_changed_cb
+        self._status_update()
+        self.show()
+        en.focus = True
+
+    def _del_cb(self, obj):
+        if self.index.changed_cb == self._index_changed_cb:
+            self.index.changed_cb = None
+
+    def _index_changed_cb(self):
+        # refresh the results while indexing, until the list is full
+        self._status_update()
+        if self.entry.text and self.results_list.items_count < RESULTS_MAX:
+            self.search()
+
+    def _status_update(self):
+        if self.index.indexing:
+            self.status_label.text = 'Indexing... ({} items searchable)'.format(
+                self.index.num_indexed)
+        else:
+            self.status_label.text = '{} items'.format(len(self.index))
+
+    def search(self):
+        query = markup_to_utf8(self.entry.text)
+        self.results_list.populate(self.index.search(query, RESULTS_MAX))
+
+    def _move_selection(self, step):
+        item = self.results_list.selected_item
+        if item is not None:
+            item = item.next if step > 0 else item.prev
+            if item is not None:
+                item.selected = True
+                item.show()
+        return True
+
+    def activate(self, item=None):
+        item = item or self.results_list.selected_item
+        if item is None:
+            return
+        kind, text, data = item.data
+        self.delete()
+        if kind == 'branch':
+            self.app.checkout_ref(data)
+        elif kind in ('remote', 'tag'):
+            self.app.action_show_ref(data)
+        elif kind == 'commit':
+            self.app.win.graph.goto(data)
+        elif kind == 'file':
+            self.app.action_path_history(data)
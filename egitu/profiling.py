@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2014-2015 Davide Andreoli <dave@gurumeditation.it>
+#
+# This file is part of Egitu.
+#
+# Egitu is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# Egitu is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Egitu.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import sys
+import time
+import functools
+
+from efl.ecore import IdleEnterer, IdleExiter, Timer
+
+
+# histogram buckets upper limits (in seconds), last bucket is "more than"
+BUCKETS = (0.001, 0.004, 0.016, 0.050, 0.100)
+BUCKETS_LABELS = ('<1ms', '<4ms', '<16ms', '<50ms', '<100ms', '>=100ms')
+
+
+class Profiler(object):
+    """ Low overhead profiler for the main loop and the hot callbacks
+
+    When started, the most critical functions (genlist callbacks, edje
+    creation, git output parsing, diff markup) are wrapped with timers
+    that build per-callback histograms. Main loop iterations that keep
+    the loop busy for more than long_frame seconds are logged.
+    Optionally the python cProfile can also be run for a bounded window
+    and the result saved to a pstats file.
+
+    Nothing is wrapped (so there is no overhead at all) if the profiler
+    is not started, this is done using the --profile command line option.
+    """
+    def __init__(self):
+        self.running = False
+        self.long_frame = 0.050
+        self.stats = dict()        # 'name': [count, total, max, [buckets]]
+        self.long_frames = []      # (timestamp, duration)
+        self._frame_start = None
+        self._cprofile = None
+        self._cprofile_file = None
+
+    def start(self, long_frame=0.050, cprofile_secs=0, cprofile_file=None):
+        self.running = True
+        self.long_frame = long_frame
+        self.instrument()
+
+        # measure the busy time of each main loop iteration
+        self._idle_exiter = IdleExiter(self._loop_wake_cb)
+        self._idle_enterer = IdleEnterer(self._loop_idle_cb)
+
+        # run cProfile for the given amount of seconds
+        if cprofile_secs > 0:
+            import cProfile
+            self._cprofile = cProfile.Profile()
+            self._cprofile_file = cprofile_file or 'egitu.pstats'
+            self._cprofile.enable()
+            Timer(cprofile_secs, self._cprofile_stop_cb)
+
+    def _loop_wake_cb(self):
+        self._frame_start = time.time()
+        return True
+
+    def _loop_idle_cb(self):
+        if self._frame_start is not None:
+            elapsed = time.time() - self._frame_start
+            if elapsed > self.long_frame:
+                self.long_frames.append((self._frame_start, elapsed))
+                print('PROFILE: long frame %.1f ms' % (elapsed * 1000),
+                      file=sys.stderr)
+            self._frame_start = None
+        return True
+
+    def _cprofile_stop_cb(self):
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(self._cprofile_file)
+            print('PROFILE: cProfile stats saved in: %s' % self._cprofile_file,
+                  file=sys.stderr)
+            self._cprofile = None
+        return False # one shot timer
+
+    def add(self, name, elapsed):
+        st = self.stats.get(name)
+        if st is None:
+            st = self.stats[name] = [0, 0.0, 0.0, [0] * len(BUCKETS_LABELS)]
+        st[0] += 1
+        st[1] += elapsed
+        if elapsed > st[2]:
+            st[2] = elapsed
+        for i, limit in enumerate(BUCKETS):
+            if elapsed < limit:
+                st[3][i] += 1
+                break
+        else:
+            st[3][-1] += 1
+
+    def wrap(self, cls, attr, name=None):
+        """ Replace cls.attr with a timed version of the same function """
+        func = getattr(cls, attr)
+        name = name or '%s.%s' % (cls.__name__, attr)
+
+        @functools.wraps(func)
+        def _timed(*args, **kargs):
+            t = time.time()
+            try:
+                return func(*args, **kargs)
+            finally:
+                self.add(name, time.time() - t)
+
+        setattr(cls, attr, _timed)
+
+    def instrument(self):
+        from egitu.dagview import DagGraphList
+        from egitu.vcs import GitBackend
+        from egitu.utils import DiffedEntry
+
+        for attr in ('_gl_content_get', '_gl_text_get', '_gl_item_realized',
+                     '_gl_item_unrealized', 'draw_connection',
+                     '_populate_progress_cb'):
+            self.wrap(DagGraphList, attr)
+        for attr in ('_parse_commit', '_parse_status'):
+            self.wrap(GitBackend, attr)
+        self.wrap(DiffedEntry, 'lines_set')
+
+    def report(self, out=sys.stderr):
+        if not self.running:
+            return
+        self._cprofile_stop_cb() # app closed before the end of the window
+        print('\n======== Profile report ==========================', file=out)
+        print('%-36s %7s %9s %8s %8s  %s' % ('callback', 'count', 'total ms',
+              'avg ms', 'max ms', '  '.join(BUCKETS_LABELS)), file=out)
+        for name, (count, total, maxt, buckets) in \
+                sorted(self.stats.items(), key=lambda x: -x[1][1]):
+            print('%-36s %7d %9.1f %8.3f %8.1f  %s' % (name, count,
+                  total * 1000, total * 1000 / count, maxt * 1000,
+                  '  '.join('%*d' % (len(l), b) for l, b in
+                            zip(BUCKETS_LABELS, buckets))), file=out)
+        print('Long frames (> %d ms): %d' % (self.long_frame * 1000,
+              len(self.long_frames)), file=out)
+        if self.long_frames:
+            print('Longest frame: %.1f ms' % \
+                  (max(d for t, d in self.long_frames) * 1000), file=out)
+        print('==================================================\n', file=out)
+
+
+profiler = Profiler()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2014-2015 Davide Andreoli <dave@gurumeditation.it>
+#
+# This file is part of Egitu.
+#
+# Egitu is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# Egitu is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Egitu.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import os
+import zlib
+from collections import OrderedDict
+
+
+def stat_key(path):
+    """ What we compare to know if a file or a folder has been changed """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    mtime = getattr(st, 'st_mtime_ns', None) or st.st_mtime
+    return (st.st_ino, mtime, st.st_size)
+
+def _read_text(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read().decode('utf-8', 'replace')
+    except (IOError, OSError):
+        return None
+
+
+class RefDatabase(object):
+    """ Read the refs of a git repository without spawning git
+
+    Loose refs (the files in .git/refs), .git/packed-refs and .git/HEAD
+    are parsed directly, symbolic refs are resolved and annotated tags are
+    peeled (using the packed-refs peel lines or reading the loose tag
+    object). The upstream of the local branches is read from .git/config.
+
+    The result is cached: git always update refs by renaming a lock file,
+    so the inode/mtime of packed-refs, HEAD, config and of the refs
+    folders are enough to know if something has changed. When nothing
+    changed update() only cost a few stat() calls.
+
+    Repositories using the reftable backend are not supported, check the
+    supported attribute and fall back to 'git for-each-ref'.
+    """
+    SYMREF_MAX_DEPTH = 5
+
+    def __init__(self, git_dir):
+        self.git_dir = git_dir
+        self.refs = OrderedDict() # 'refs/heads/master': sha (sorted by name)
+        self.symrefs = dict()     # 'refs/remotes/origin/HEAD': 'refs/...'
+        self.peeled = dict()      # 'refs/tags/v1.0': sha of the tagged commit
+        self.head_ref = None      # 'refs/heads/master' or None if detached
+        self.head_sha = None
+        self.upstreams = dict()   # 'refs/heads/master': 'refs/remotes/o/master'
+        self._signature = None
+        self._dirs = []           # all the folders inside .git/refs
+        self._tags_cache = dict() # tag object sha: peeled sha (immutable)
+
+    @property
+    def supported(self):
+        return os.path.isdir(os.path.join(self.git_dir, 'refs')) and \
+               not os.path.isdir(os.path.join(self.git_dir, 'reftable'))
+
+    def _path(self, *parts):
+        return os.path.join(self.git_dir, *parts)
+
+    def _files_signature(self):
+        files = ('HEAD', 'packed-refs', 'config')
+        return tuple(stat_key(self._path(f)) for f in files)
+
+    def _current_signature(self):
+        return self._files_signature() + tuple(stat_key(d) for d in self._dirs)
+
+    def update(self):
+        """ Reload the refs if needed, return True if something changed """
+        if self._signature is not None and \
+           self._signature == self._current_signature():
+            return False
+
+        # stat everything before reading it: a change made while reading
+        # must give a different signature at the next update, not be lost
+        signature = self._files_signature()
+
+        # a new scan also refresh the list of folders to watch
+        self._dirs = []
+        loose = dict()
+        dir_stats = []
+        self._scan_loose(self._path('refs'), 'refs', loose, dir_stats)
+        signature += tuple(dir_stats)
+
+        self.refs.clear()
+        self.symrefs.clear()
+        self.peeled.clear()
+        self.upstreams.clear()
+
+        # packed-refs first, loose refs override them
+        merged = self._read_packed_refs()
+        merged.update(loose)
+        self.symrefs.update((name, val[5:]) for name, val in merged.items()
+                            if val.startswith('ref: '))
+        for name in sorted(merged):
+            sha = self._resolve(name, merged)
+            if sha is not None:
+                self.refs[name] = sha
+
+        # HEAD
+        head = _read_text(self._path('HEAD')) or ''
+        head = head.strip()
+        if head.startswith('ref: '):
+            self.head_ref = head[5:]
+            self.head_sha = self.refs.get(self.head_ref)
+        else:
+            self.head_ref = None
+            self.head_sha = head or None
+
+        # peel the annotated tags not already peeled by packed-refs
+        for name, sha in self.refs.items():
+            if name.startswith('refs/tags/') and name not in self.peeled:
+                peeled = self._peel_loose_tag(sha)
+                if peeled is not None:
+                    self.peeled[name] = peeled
+
+        self._read_upstreams()
+        self._signature = signature
+        return True
+
+    def _scan_loose(self, folder, prefix, result, dir_stats):
+        self._dirs.append(folder)
+        dir_stats.append(stat_key(folder))
+        try:
+            names = os.listdir(folder)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(folder, name)
+            refname = prefix + '/' + name
+            if os.path.isdir(path):
+                self._scan_loose(path, refname, result, dir_stats)
+            elif not name.endswith('.lock'):
+                val = _read_text(path)
+                if val:
+                    result[refname] = val.strip()
+
+    def _read_packed_refs(self):
+        """ Parse packed-refs, also store the peeled tags found """
+        refs = dict()
+        text = _read_text(self._path('packed-refs'))
+        if not text:
+            return refs
+        last = None
+        for line in text.splitlines():
+            if not line or line[0] == '#':
+                continue
+            if line[0] == '^': # peel line for the previous (tag) ref
+                if last is not None:
+                    self.peeled[last] = line[1:].strip()
+                continue
+            sha, _, name = line.partition(' ')
+            refs[name] = sha
+            last = name
+        return refs
+
+    def _resolve(self, name, refs):
+        """ Follow symbolic refs, return the final sha or None """
+        for i in range(self.SYMREF_MAX_DEPTH):
+            val = refs.get(name)
+            if val is None:
+                return None
+            if not val.startswith('ref: '):
+                return val
+            name = val[5:]
+        return None
+
+    def _peel_loose_tag(self, sha):
+        """ Return the commit pointed by the tag object sha (if loose) """
+        if sha in self._tags_cache:
+            return self._tags_cache[sha]
+        peeled = None
+        target = sha
+        for i in range(self.SYMREF_MAX_DEPTH): # tags of tags
+            path = self._path('objects', target[:2], target[2:])
+            try:
+                with open(path, 'rb') as f:
+                    data = zlib.decompress(f.read())
+            except (IOError, OSError, zlib.error):
+                break # packed object, or not a tag at all
+            if not data.startswith(b'tag '):
+                break
+            body = data.split(b'\0', 1)[1]
+            if not body.startswith(b'object '):
+                break
+            target = body[7:47].decode('ascii')
+            peeled = target
+            if b'\ntype commit\n' in body[:100]:
+                break
+        self._tags_cache[sha] = peeled
+        return peeled
+
+    def _read_upstreams(self):
+        """ Fill self.upstreams from the [branch "xxx"] sections of config """
+        branches = dict() # 'name': {'remote': 'origin', 'merge': 'refs/...'}
+        current = None
+        for line in (_read_text(self._path('config')) or '').splitlines():
+            line = line.strip()
+            if not line or line[0] in '#;':
+                continue
+            if line[0] == '[':
+                section = line[1:line.find(']')].strip()
+                current = None
+                if section.lower().startswith('branch ') and '"' in section:
+                    name = section[section.find('"') + 1:section.rfind('"')]
+                    current = branches.setdefault(name, dict())
+            elif current is not None and '=' in line:
+                key, val = line.split('=', 1)
+                val = val.strip()
+                if len(val) > 1 and val[0] == val[-1] == '"':
+                    val = val[1:-1]
+                current[key.strip().lower()] = val
+
+        for name, conf in branches.items():
+            remote = conf.get('remote')
+            merge = conf.get('merge')
+            if not remote or not merge or not merge.startswith('refs/heads/'):
+                continue
+            if remote == '.':
+                upstream = merge
+            else:
+                upstream = 'refs/remotes/%s/%s' % (remote, merge[11:])
+            self.upstreams['refs/heads/' + name] = upstream
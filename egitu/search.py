@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2014-2015 Davide Andreoli <dave@gurumeditation.it>
+#
+# This file is part of Egitu.
+#
+# Egitu is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# Egitu is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Egitu.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import gc
+import os
+import re
+import time
+import bisect
+import marshal
+import hashlib
+from array import array
+
+from efl.ecore import Idler
+
+from egitu.utils import cache_path
+
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+INDEX_RE = re.compile(r'\w\w+', re.UNICODE) # single chars are not indexed
+HEX_CHARS = frozenset('0123456789abcdef')
+
+
+def tokenize(text):
+    """ The set of (lowercase) words of text, single chars are skipped """
+    return set(INDEX_RE.findall(text.lower()))
+
+def _array_to_bytes(a):
+    return a.tobytes() if hasattr(a, 'tobytes') else a.tostring()
+
+def _array_from_bytes(data):
+    a = array(str('I'))
+    if hasattr(a, 'frombytes'):
+        a.frombytes(data)
+    else:
+        a.fromstring(data)
+    return a
+
+def _range(group, lo, hi):
+    """ The doc ids of group (a list of sorted postings) in [lo, hi) """
+    slices = [p[bisect.bisect_left(p, lo):bisect.bisect_left(p, hi)]
+              for p in group]
+    return slices[0] if len(slices) == 1 else set().union(*slices)
+
+def _intersect_newest_first(groups, span=4096):
+    """ Yield the doc ids that are in every group, biggest first
+
+    A group is a list of sorted postings, a doc id is in the group if it
+    is in any of them. The doc ids are intersected by ranges, newest
+    first: the smallest group (pass it first) is cut to the range, then
+    intersected with the same range of the other groups in turn (with the
+    set operations, so the loops are in C). The range doubles at each
+    step, stop iterating as soon as there are enough results.
+    """
+    hi = max(p[-1] for p in groups[0] if p) + 1
+    while hi > 0:
+        lo = max(hi - span, 0)
+        found = set(_range(groups[0], lo, hi))
+        for group in groups[1:]:
+            if not found:
+                break
+            found.intersection_update(_range(group, lo, hi))
+        for doc_id in sorted(found, reverse=True):
+            yield doc_id
+        hi, span = lo, span * 2
+
+
+class SearchIndex(object):
+    """ Persistent full-text index of the commits of a repository
+
+    Each commit get a doc id (in the order they are indexed, so newer
+    commits have bigger ids). The inverted index maps every word of the
+    title, body and author to the sorted array of doc ids that contain
+    it; a second table keeps the doc ids sorted by sha, for sha prefix
+    lookups. Only the fields needed to show a result (sha, date, author
+    and title) are stored for each doc.
+
+    The index is saved (with marshal, it's fast to load) in the cache
+    folder and is extended with the commits not reachable from the refs
+    seen in the last update, so only the new commits are parsed. Use
+    load_async() to load it a bit at a time, without blocking the UI.
+    """
+    VERSION = 2
+    MAX_PREFIX_EXPANSION = 256 # words searched for the last (partial) word
+    CHUNK_DOCS = 5000 # docs in each record of the file (a step of load)
+
+    def __init__(self, url):
+        self.url = url
+        self.path = os.path.join(cache_path, 'search',
+                        hashlib.md5(url.encode('utf-8')).hexdigest() + '.idx')
+        self.updating = False
+        self.loading = False
+        self._idler = None
+        self._clear()
+
+    def _clear(self):
+        self.tips = []        # refs tips at the last update
+        self._shas = []       # doc_id: sha
+        self._docs = []       # doc_id: (timestamp, author, title)
+        self._postings = {}   # 'word': array of doc ids (sorted)
+        self._by_sha = array(str('I')) # doc ids sorted by sha
+        self._sorted_shas = []         # the shas of _by_sha (same order)
+        self._known = set()   # all the indexed shas
+        self._unsorted = []   # doc ids still to add to _by_sha
+        self._vocab = None    # sorted list of words (built on demand)
+        self._dirty = False
+
+    def __len__(self):
+        return len(self._shas)
+
+    def load(self):
+        """ Load the index from the cache, return False if not available """
+        for result in self._load_steps():
+            pass
+        return result
+
+    def load_async(self, done_cb):
+        """ Load the index from the cache in an idler, a step at a time
+
+        The index must not be used (nor updated) until done_cb is called.
+
+        done_cb signature: cb(success)
+        """
+        def _idler_cb():
+            result = next(steps)
+            if result is None:
+                return True # renew the idler, more steps to do
+            self._idler = None
+            self.loading = False
+            done_cb(result)
+            return False
+
+        steps = self._load_steps()
+        self.loading = True
+        self._idler = Idler(_idler_cb)
+
+    def _load_steps(self):
+        """ Load the index, yield None between the slow parts
+
+        The last value is True if loaded, False if not available.
+        """
+        shas, docs, postings = [], [], {}
+        try:
+            with open(self.path, 'rb') as f:
+                head = marshal.load(f)
+                if head.get('version') != self.VERSION:
+                    yield False
+                    return
+                # a record at a time, each one is a short step
+                for n in range(head['num_records']):
+                    record = marshal.load(f)
+                    if isinstance(record, dict):
+                        for w, p in record.items():
+                            postings[w] = _array_from_bytes(p)
+                    else:
+                        shas.extend(record[0])
+                        docs.extend(tuple(d) for d in record[1])
+                    yield None
+            by_sha = _array_from_bytes(head['by_sha'])
+        except (IOError, OSError, EOFError, ValueError, TypeError, KeyError):
+            yield False
+            return
+
+        sorted_shas, known = [], set()
+        for i in range(0, len(shas), self.CHUNK_DOCS):
+            sorted_shas.extend(shas[j] for j in by_sha[i:i + self.CHUNK_DOCS])
+            known.update(shas[i:i + self.CHUNK_DOCS])
+            yield None
+
+        self.tips = head['tips']
+        self._shas = shas
+        self._docs = docs
+        self._postings = postings
+        self._by_sha = by_sha
+        self._sorted_shas = sorted_shas
+        self._known = known
+        self._vocab = None
+        yield None
+        # collect now, or the first search will pay for all the new objects
+        gc.collect()
+        yield True
+
+    def _records(self):
+        """ The index in small pieces: (shas, docs) and {word: postings} """
+        for i in range(0, len(self._shas), self.CHUNK_DOCS):
+            yield (self._shas[i:i + self.CHUNK_DOCS],
+                   self._docs[i:i + self.CHUNK_DOCS])
+        record, count = {}, 0
+        for w, p in self._postings.items():
+            record[w] = _array_to_bytes(p)
+            count += len(p)
+            if count >= self.CHUNK_DOCS * 10:
+                yield record
+                record, count = {}, 0
+        if record:
+            yield record
+
+    def save(self):
+        if not self._dirty:
+            return
+        records = list(self._records())
+        head = {
+            'version': self.VERSION,
+            'tips': self.tips,
+            'by_sha': _array_to_bytes(self._by_sha),
+            'num_records': len(records),
+        }
+        # write+rename, a crash must not leave a broken index
+        try:
+            if not os.path.exists(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            with open(self.path + '.tmp', 'wb') as f:
+                marshal.dump(head, f)
+                for record in records:
+                    marshal.dump(record, f)
+            os.rename(self.path + '.tmp', self.path)
+            self._dirty = False
+        except (IOError, OSError, ValueError) as e:
+            print('Cannot save the search index: %s' % e)
+
+    def add_commit(self, commit):
+        if commit.sha in self._known:
+            return
+        doc_id = len(self._shas)
+        self._known.add(commit.sha)
+        self._shas.append(commit.sha)
+        self._docs.append((int(time.mktime(commit.commit_date.timetuple())),
+                           commit.author, commit.title))
+
+        words = tokenize(' '.join((commit.title, commit.message,
+                                   commit.author, commit.author_email)))
+        all_postings = self._postings
+        for word in words:
+            try:
+                all_postings[word].append(doc_id)
+            except KeyError:
+                all_postings[word] = array(str('I'), (doc_id,))
+                self._vocab = None
+
+        self._unsorted.append(doc_id)
+        self._dirty = True
+
+    def _sort_shas(self):
+        """ Add the new docs to the table of the doc ids sorted by sha """
+        if len(self._unsorted) < 1000:
+            for doc_id in self._unsorted:
+                i = bisect.bisect_left(self._sorted_shas, self._shas[doc_id])
+                self._sorted_shas.insert(i, self._shas[doc_id])
+                self._by_sha.insert(i, doc_id)
+        else: # a full sort is faster than many inserts
+            self._by_sha = array(str('I'), sorted(range(len(self._shas)),
+                                                  key=self._shas.__getitem__))
+            self._sorted_shas = [self._shas[i] for i in self._by_sha]
+        del self._unsorted[:]
+
+    def update(self, repo, done_cb):
+        """ Index the commits added since the last update, then save
+
+        done_cb signature: cb(success, num_new_commits)
+        """
+        def _done_cb(success, tips, err_msg=None):
+            self.updating = False
+            self._sort_shas()
+            if success:
+                self.tips = tips
+                self._dirty = True
+                self.save()
+            done_cb(success, len(self._shas) - count)
+
+        if self.updating:
+            return
+        self.updating = True
+        count = len(self._shas)
+        repo.request_new_commits(_done_cb, self.add_commit, self.tips)
+
+    def doc(self, doc_id):
+        """ (sha, timestamp, author, title) of the given doc """
+        ts, author, title = self._docs[doc_id]
+        return self._shas[doc_id], ts, author, title
+
+    def _sha_prefix(self, prefix, limit):
+        i = bisect.bisect_left(self._sorted_shas, prefix)
+        L = []
+        while i < len(self._sorted_shas) and len(L) < limit and \
+              self._sorted_shas[i].startswith(prefix):
+            L.append(self._by_sha[i])
+            i += 1
+        return L
+
+    def _prefix_postings(self, prefix):
+        """ The postings of all the words starting with prefix """
+        if self._vocab is None:
+            self._vocab = sorted(self._postings)
+        i = bisect.bisect_left(self._vocab, prefix)
+        j = bisect.bisect_left(self._vocab, prefix + '\uffff')
+        words = self._vocab[i:min(j, i + self.MAX_PREFIX_EXPANSION)]
+        return [self._postings[w] for w in words]
+
+    def search(self, query, limit=500):
+        """ Doc ids of the commits that contain all the words of query
+
+        The last word is matched as a prefix (search as you type) unless
+        the query ends with a space. A single hex word also match the sha
+        prefixes. Results are sorted by doc id, newest first.
+        """
+        words = TOKEN_RE.findall(query.lower())
+        if not words:
+            return []
+
+        results = []
+        if len(words) == 1 and len(words[0]) >= 4 and \
+           HEX_CHARS.issuperset(words[0]):
+            results = self._sha_prefix(words[0], limit)
+
+        partial = not query[-1].isspace()
+        groups = []
+        for n, word in enumerate(words):
+            if len(word) < 2:
+                continue # single chars are not indexed
+            if partial and n == len(words) - 1:
+                group = self._prefix_postings(word)
+            else:
+                postings = self._postings.get(word)
+                group = [postings] if postings else []
+            if not group:
+                return results
+            groups.append(group)
+        if not groups:
+            return results
+
+        # drive the intersection with the smallest group
+        groups.sort(key=lambda g: sum(len(p) for p in g))
+        found = set(results)
+        for doc_id in _intersect_newest_first(groups):
+            if len(results) >= limit:
+                break
+            if doc_id not in found:
+                results.append(doc_id)
+        return results
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2014-2015 Davide Andreoli <dave@gurumeditation.it>
+#
+# This file is part of Egitu.
+#
+# Egitu is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# Egitu is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Egitu.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+from efl.elementary.window import DialogWindow
+from efl.elementary.box import Box
+from efl.elementary.button import Button
+from efl.elementary.separator import Separator
+from efl.elementary.frame import Frame
+from efl.elementary.label import Label
+from efl.elementary.entry import Entry, ELM_WRAP_NONE, utf8_to_markup
+from efl.elementary.panes import Panes
+from efl.elementary.genlist import Genlist, GenlistItemClass, \
+    ELM_LIST_COMPRESS, ELM_GENLIST_ITEM_TREE, ELM_OBJECT_SELECT_MODE_ALWAYS
+
+from egitu.utils import ErrorPopup, SafeIcon, options, \
+    EXPAND_BOTH, FILL_BOTH, EXPAND_HORIZ, FILL_HORIZ
+
+
+# max number of bytes to read for the preview of a file
+PREVIEW_MAX_SIZE = 256 * 1024
+
+
+def _format_size(size):
+    for unit in ('bytes', 'KB', 'MB'):
+        if size < 1024:
+            return '{} {}'.format(size, unit) if unit == 'bytes' else \
+                   '{:.1f} {}'.format(size, unit)
+        size /= 1024.0
+    return '{:.1f} GB'.format(size)
+
+
+class TreeList(Genlist):
+    """ The tree of a commit, each folder is listed only when expanded
+
+    The item data is the tuple (path, TreeEntry).
+    """
+    def __init__(self, parent, app, **kargs):
+        self.app = app
+        Genlist.__init__(self, parent, homogeneous=True, mode=ELM_LIST_COMPRESS,
+                         size_hint_expand=EXPAND_BOTH, size_hint_fill=FILL_BOTH,
+                         select_mode=ELM_OBJECT_SELECT_MODE_ALWAYS, **kargs)
+        self._itc = GenlistItemClass(item_style='default',
+                                     text_get_func=self._gl_text_get,
+                                     content_get_func=self._gl_content_get)
+        self.callback_expand_request_add(self._expand_request_cb)
+        self.callback_contract_request_add(self._contract_request_cb)
+        self.callback_expanded_add(self._expanded_cb)
+        self.callback_contracted_add(self._contracted_cb)
+
+    def populate(self, tree_sha):
+        self.clear()
+        self.app.repo.request_tree(self._tree_done_cb, tree_sha)
+
+    def _tree_done_cb(self, success, entries, err_msg=None, parent=None):
+        if not success:
+            ErrorPopup(self.top_widget, msg=utf8_to_markup(err_msg))
+            return
+        prefix = parent.data[0] + '/' if parent else ''
+        # folders first, than files (both sorted by name)
+        for entry in sorted(entries, key=lambda e: (not e.is_tree, e.name)):
+            self.item_append(self._itc, (prefix + entry.name, entry),
+                             parent_item=parent,
+                             flags=ELM_GENLIST_ITEM_TREE if entry.is_tree else 0)
+
+    def _gl_text_get(self, gl, part, item_data):
+        return utf8_to_markup(item_data[1].name)
+
+    def _gl_content_get(self, gl, part, item_data):
+        path, entry = item_data
+        if part == 'elm.swallow.icon':
+            if entry.is_tree:
+                return SafeIcon(gl, 'folder')
+            elif entry.kind == 'commit':
+                return SafeIcon(gl, 'folder-remote')
+            return SafeIcon(gl, 'text-x-generic')
+        elif part == 'elm.swallow.end' and entry.size is not None:
+            return Label(gl, text=_format_size(entry.size))
+
+    def _expand_request_cb(self, gl, item):
+        item.expanded = True
+
+    def _contract_request_cb(self, gl, item):
+        item.expanded = False
+
+    def _expanded_cb(self, gl, item):
+        path, entry = item.data
+        # subtrees are cached by sha in the repo, also across commits
+        self.app.repo.request_tree(
+            lambda success, entries, err_msg=None: \
+                item.expanded and not item.subitems_count() and \
+                self._tree_done_cb(success, entries, err_msg, item),
+            entry.sha)
+
+    def _contracted_cb(self, gl, item):
+        item.subitems_clear()
+
+
+class TreeDialog(DialogWindow):
+    def __init__(self, parent, app, sha):
+        self.app = app
+        self.sha = sha
+        self._preview_sha = None
+
+        DialogWindow.__init__(self, parent, 'Egitu-tree', 'Browse files',
+                              size=(700,500), autodel=True)
+
+        # main vertical box (inside a padding frame)
+        vbox = Box(self, padding=(0, 6), size_hint_expand=EXPAND_BOTH,
+                   size_hint_fill=FILL_BOTH)
+        fr = Frame(self, style='pad_medium', size_hint_expand=EXPAND_BOTH)
+        self.resize_object_add(fr)
+        fr.content = vbox
+        fr.show()
+        vbox.show()
+
+        # header
+        lb = Label(self, text='Files at revision <name>{}</name>'.format(
+                                                                    sha[:7]),
+                   size_hint_expand=EXPAND_HORIZ, size_hint_align=(0.0, 0.5))
+        vbox.pack_end(lb)
+        lb.show()
+
+        # tree + preview in an horizontal panes
+        panes = Panes(self, content_left_size=0.3,
+                      size_hint_expand=EXPAND_BOTH, size_hint_fill=FILL_BOTH)
+        vbox.pack_end(panes)
+        panes.show()
+
+        li = TreeList(panes, app)
+        li.callback_selected_add(self._item_selected_cb)
+        li.show()
+        self.tree_list = li
+
+        fr = Frame(panes, content=li)
+        panes.part_content_set('left', fr)
+        fr.show()
+
+        en = Entry(panes, scrollable=True, editable=False,
+                   line_wrap=ELM_WRAP_NONE,
+                   size_hint_expand=EXPAND_BOTH, size_hint_fill=FILL_BOTH)
+        panes.part_content_set('right', en)
+        en.show()
+        self.preview_entry = en
+
+        # buttons
+        hbox = Box(self, horizontal=True,
+                   size_hint_expand=EXPAND_HORIZ, size_hint_fill=FILL_HORIZ)
+        vbox.pack_end(hbox)
+        hbox.show()
+
+        bt = Button(self, text='Blame', disabled=True)
+        bt.callback_clicked_add(lambda b: self._blame_selected())
+        hbox.pack_end(bt)
+        bt.show()
+        self.blame_btn = bt
+
+        sep = Separator(self, size_hint_expand=EXPAND_HORIZ)
+        hbox.pack_end(sep)
+
+        bt = Button(self, text='Close')
+        bt.callback_clicked_add(lambda b: self.delete())
+        hbox.pack_end(bt)
+        bt.show()
+
+        #
+        app.repo.request_commit_tree(self._commit_tree_done_cb, sha)
+        self.show()
+
+    def _commit_tree_done_cb(self, success, tree_sha, err_msg=None):
+        if success:
+            self.tree_list.populate(tree_sha)
+        else:
+            ErrorPopup(self, msg=utf8_to_markup(err_msg))
+
+    def _item_selected_cb(self, gl, item):
+        path, entry = item.data
+        self.blame_btn.disabled = entry.kind != 'blob'
+        if entry.kind != 'blob':
+            return
+        self._preview_sha = entry.sha
+        self.preview_entry.text = '<i>Loading...</i>'
+        self.app.repo.request_blob(
+            lambda success, text, truncated, err_msg=None: \
+                self._preview_done_cb(success, text, truncated, err_msg,
+                                      entry.sha),
+            self.sha, path, entry, PREVIEW_MAX_SIZE)
+
+    def _preview_done_cb(self, success, text, truncated, err_msg, sha):
+        if sha != self._preview_sha:
+            return # another file has been selected in the meantime
+        if not success:
+            self.preview_entry.text = '<failure>{}</failure>'.format(
+                                                    utf8_to_markup(err_msg))
+        elif text is None and truncated:
+            self.preview_entry.text = '<i>The file is bigger than %s, ' \
+                                      'no preview</i>' % \
+                                      _format_size(PREVIEW_MAX_SIZE)
+        elif text is None:
+            self.preview_entry.text = '<i>Binary file</i>'
+        else:
+            markup = utf8_to_markup(text.expandtabs(4))
+            if truncated:
+                markup += '<br><br><warning>Warning: </warning>The file is ' \
+                          'too big, only the first %s are shown.' % \
+                          _format_size(PREVIEW_MAX_SIZE)
+            self.preview_entry.text = \
+                '<code><font={} font_size={}>{}</font></code>'.format(
+                    options.diff_font_face, options.diff_font_size, markup)
+
+    def _blame_selected(self):
+        item = self.tree_list.selected_item
+        if item is not None:
+            self.app.action_blame(item.data[0], self.sha)
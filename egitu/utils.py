@@ -22,13 +22,18 @@ from __future__ import absolute_import, print_function, unicode_literals
 
 import os
 import hashlib
-import pickle
+import binascii
+import struct
+import zlib
+import json
 import glob
+import time
+from collections import OrderedDict, deque
 from datetime import datetime
 from xdg.BaseDirectory import xdg_config_home, xdg_cache_home
 
 from efl.evas import Rectangle, EVAS_HINT_EXPAND, EVAS_HINT_FILL
-from efl.ecore import FileDownload, Exe
+from efl.ecore import FileDownload, Exe, Timer
 from efl.elementary.photo import Photo
 from efl.elementary.popup import Popup
 from efl.elementary.button import Button
@@ -63,8 +68,9 @@ script_path = os.path.dirname(os.path.abspath(__file__))
 install_prefix = script_path[0:script_path.find('/python')]
 install_prefix = install_prefix[0:install_prefix.rfind('/')]
 config_path = os.path.join(xdg_config_home, 'egitu')
-config_file = os.path.join(config_path, 'config.pickle')
+config_file = os.path.join(config_path, 'config.conf')
 recent_file = os.path.join(config_path, 'recent.history')
+cache_path = os.path.join(xdg_cache_home, 'egitu')
 data_path = os.path.join(install_prefix, 'share', 'egitu')
 
 
@@ -157,38 +163,159 @@ along with this program. If not, see<br>
 """
 
 
+def _escape_url(url):
+    return url.replace('%', '%25').replace(' ', '%20').replace('\n', '%0A')
+
+def _unescape_url(url):
+    # every "%" start an escape, so the order does not matter (but the last)
+    return url.replace('%0A', '\n').replace('%20', ' ').replace('%25', '%')
+
+
 class Options(object):
-    """ Class to contain application settings """
+    """ Class to contain application settings
+
+    Settings are stored in a flat text file, one "key = json value" per
+    line, that is parsed only once at startup. The type of each option is
+    given by its default value, values of the wrong type are ignored.
+
+    Changes are not written immediately: the file is rewritten (in batch)
+    SAVE_DELAY seconds after the first change, and on save().
+
+    Per-repository overrides are stored as "key@/path/to/repo", with "%",
+    spaces and newlines of the path escaped as %25, %20 and %0A (so that
+    the key never contain " = "), use repo_get() and repo_set() to access
+    them. Only the options in DEFAULTS are loaded.
+    """
+    VERSION = 2
+    SAVE_DELAY = 3.0
+    DEFAULTS = OrderedDict((
+        ('theme_name', 'default'),
+        ('date_format', '%d %b %Y %H:%M'),
+        ('date_relative', True),
+        ('gravatar_default', 'identicon'), # or: mm, identicon, monsterid, wavatar, retro
+        ('gravatar_offline', False), # only use locally generated identicons
+        ('show_message_in_dag', True),
+        ('show_author_in_dag', True),
+        ('show_remotes_in_dag', True),
+        ('show_stash_in_dag', True),
+        ('number_of_commits_to_load', 100),
+        ('diff_font_face', 'Mono'),
+        ('diff_font_size', 10),
+        ('diff_text_wrap', False),
+        ('review_git_commands', False),
+        ('git_max_running', 6), # max number of git processes at the same time
+        ('workspace_repos', []),
+    ))
+
     def __init__(self):
-        self.theme_name = 'default'
-        self.date_format = '%d %b %Y %H:%M'
-        self.date_relative = True
-        self.gravatar_default = 'identicon' # or: mm, identicon, monsterid, wavatar, retro
-        self.show_message_in_dag = True
-        self.show_author_in_dag = True
-        self.show_remotes_in_dag = True
-        self.show_stash_in_dag = True
-        self.number_of_commits_to_load = 100
-        self.diff_font_face = 'Mono'
-        self.diff_font_size = 10
-        self.diff_text_wrap = False
-        self.review_git_commands = False
+        self.__dict__.update(self.DEFAULTS)
+        self.__dict__['_repo_values'] = dict() # key: (opt_name, repo_url)
+        self.__dict__['_save_timer'] = None
+        self.__dict__['_dirty'] = False
+
+    def __setattr__(self, key, value):
+        if key[0] != '_':
+            value = self._check_type(key, value)
+            if self.__dict__.get(key) != value:
+                self._changed()
+        self.__dict__[key] = value
+
+    def _check_type(self, key, value):
+        default = self.DEFAULTS.get(key)
+        if default is None or type(value) == type(default):
+            return value
+        if isinstance(default, int) and not isinstance(default, bool) and \
+           isinstance(value, (int, float)) and not isinstance(value, bool):
+            return int(value)
+        if isinstance(default, type('')) and isinstance(value, (str, type(''))):
+            return value # py2 str vs unicode
+        raise TypeError('Option %s must be of type %s (got %r)' % (
+                        key, type(default).__name__, value))
+
+    def _changed(self):
+        self.__dict__['_dirty'] = True
+        if self._save_timer is None:
+            self.__dict__['_save_timer'] = \
+                Timer(self.SAVE_DELAY, self._save_timer_cb)
+
+    def _save_timer_cb(self):
+        self.__dict__['_save_timer'] = None
+        self.save()
+        return False # one shot timer
+
+    def repo_get(self, url, key):
+        """ Get the value of the option key for the given repo url """
+        return self._repo_values.get((key, url), getattr(self, key))
+
+    def repo_set(self, url, key, value):
+        """ Override the option key only for the given repo url """
+        value = self._check_type(key, value)
+        if self._repo_values.get((key, url)) != value:
+            self._repo_values[(key, url)] = value
+            self._changed()
+
+    def repo_unset(self, url, key):
+        """ Remove the override, the global option will be used again """
+        if self._repo_values.pop((key, url), None) is not None:
+            self._changed()
 
     def load(self):
         try:
-            # load only attributes (not methods) from the instance saved to disk
-            saved = pickle.load(open(config_file, 'rb'))
-            for attr in dir(self):
-                if attr[0] != '_' and not callable(getattr(self, attr)):
-                    if hasattr(saved, attr):
-                        setattr(self, attr, getattr(saved, attr))
-        except:
-            pass
+            with open(config_file) as f:
+                lines = f.read().splitlines()
+        except (IOError, OSError):
+            return
+
+        version = 1 # the version line is the first one
+        for line in lines:
+            key, sep, val = line.partition(' = ')
+            if not sep or key.startswith('#'):
+                continue
+            name, _, url = key.partition('@')
+            if name != 'version' and name not in self.DEFAULTS:
+                print('Ignoring unknown config option: "%s"' % name)
+                continue
+            if url and version >= 2:
+                url = _unescape_url(url)
+            try:
+                val = json.loads(val)
+                if name == 'version':
+                    if val > self.VERSION: # config from the future
+                        print('Config version %s not supported' % val)
+                        break
+                    version = val
+                elif url:
+                    self._repo_values[(name, url)] = \
+                        self._check_type(name, val)
+                else:
+                    self.__dict__[name] = self._check_type(name, val)
+            except (ValueError, TypeError) as e:
+                print('Ignoring invalid config line: "%s" (%s)' % (line, e))
+
+        self.__dict__['_dirty'] = False
 
     def save(self):
-        # save this whole class instance to file
-        with open(config_file, 'wb') as f:
-            pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
+        if self._save_timer is not None:
+            self._save_timer.delete()
+            self.__dict__['_save_timer'] = None
+        if not self._dirty:
+            return
+
+        lines = ['# egitu config file', 'version = %d' % self.VERSION]
+        for key in sorted(k for k in self.__dict__ if k[0] != '_'):
+            lines.append('%s = %s' % (key, json.dumps(self.__dict__[key])))
+        for (key, url), val in sorted(self._repo_values.items()):
+            lines.append('%s@%s = %s' % (key, _escape_url(url),
+                                         json.dumps(val)))
+
+        # write+rename, a crash must not leave a broken config
+        try:
+            with open(config_file + '.tmp', 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+            os.rename(config_file + '.tmp', config_file)
+            self.__dict__['_dirty'] = False
+        except (IOError, OSError) as e:
+            print('Cannot save config: %s' % e)
 
 options = Options()
 
@@ -214,6 +341,19 @@ def file_put_contents(path, contents):
 def theme_file_get():
     return os.path.join(data_path, 'themes', options.theme_name + '.edj')
 
+_theme_extension_loaded = False
+def theme_extension_load():
+    """ Add the egitu theme as an elm theme extension (only once)
+
+    The extension is only needed by the DAG items, so it is loaded the
+    first time the DAG is populated instead of at startup.
+    """
+    global _theme_extension_loaded
+    if not _theme_extension_loaded:
+        from efl.elementary.theme import theme_extension_add
+        theme_extension_add(theme_file_get())
+        _theme_extension_loaded = True
+
 def theme_resource_get(fname):
     return os.path.join(data_path, 'themes', options.theme_name, fname)
 
@@ -262,6 +402,64 @@ def parseint(string):
     return int(''.join([x for x in string if x.isdigit()]))
 
 
+class LRUCache(object):
+    """ A simple Least Recently Used cache
+
+    The cache is limited by the total weight of the stored values, by
+    default every value weight 1 (so the limit is the number of items),
+    but a custom weight_func can be given, for example to limit the cache
+    by the number of lines stored:
+
+    cache = LRUCache(10000, weight_func=len)
+    cache['key'] = list_of_lines
+
+    """
+    def __init__(self, max_weight, weight_func=None):
+        self._data = OrderedDict()
+        self._weight = 0
+        self.max_weight = max_weight
+        self.weight_func = weight_func
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def __getitem__(self, key):
+        value = self._data.pop(key)
+        self._data[key] = value # move to the end (most recently used)
+        return value
+
+    def __setitem__(self, key, value):
+        if key in self._data:
+            self._weight -= self._weight_of(self._data.pop(key))
+        self._data[key] = value
+        self._weight += self._weight_of(value)
+
+        # evict the least recently used items (but never the new one)
+        while self._weight > self.max_weight and len(self._data) > 1:
+            old_key, old_value = self._data.popitem(last=False)
+            self._weight -= self._weight_of(old_value)
+
+    def _weight_of(self, value):
+        return self.weight_func(value) if self.weight_func else 1
+
+    def get(self, key, default=None):
+        return self[key] if key in self._data else default
+
+    def pop(self, key, default=None):
+        if key in self._data:
+            value = self._data.pop(key)
+            self._weight -= self._weight_of(value)
+            return value
+        return default
+
+    def clear(self):
+        self._data.clear()
+        self._weight = 0
+
+
 class SafeIcon(Icon):
     def __init__(self, parent, icon_name, **kargs):
         Icon.__init__(self, parent, **kargs)
@@ -304,56 +502,327 @@ class CommitTooltip(Table):
         en.show()
 
 
-class GravatarPict(Photo):
+def identicon_png(hash_key, size):
+    """ Render a github-like identicon for the given hash as png data
+
+    The image is a 5x5 grid, horizontally symmetric, with the foreground
+    color and the filled cells both taken from the hash, so the same
+    email always give the same picture. Written in pure python to not
+    require any imaging library.
+    """
+    digest = bytearray(binascii.unhexlify(hash_key))
+    fg = (digest[-3] & 0x7F) + 64, (digest[-2] & 0x7F) + 64, \
+         (digest[-1] & 0x7F) + 64
+    bg = (240, 240, 240)
+
+    # the 15 bits that define the first 3 columns (mirrored on the right)
+    cells = [[False] * 5 for _ in range(5)]
+    for i in range(15):
+        col, row = i // 5, i % 5
+        if (digest[i // 8] >> (i % 8)) & 1:
+            cells[row][col] = cells[row][4 - col] = True
+
+    cell = max(size // 6, 1)
+    pad = (size - cell * 5) // 2
+    raw = bytearray()
+    for y in range(size):
+        raw.append(0) # filter type: None
+        row = (y - pad) // cell if y >= pad else -1
+        for x in range(size):
+            col = (x - pad) // cell if x >= pad else -1
+            on = 0 <= row < 5 and 0 <= col < 5 and cells[row][col]
+            raw.extend(fg if on else bg)
+
+    def _chunk(tag, data):
+        crc = zlib.crc32(tag + data) & 0xFFFFFFFF
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', crc)
+
+    return b'\x89PNG\r\n\x1a\n' + \
+           _chunk(b'IHDR', struct.pack('>IIBBBBB', size, size, 8, 2, 0, 0, 0)) + \
+           _chunk(b'IDAT', zlib.compress(bytes(raw), 9)) + \
+           _chunk(b'IEND', b'')
+
+
+class GravatarService(object):
+    """ Download gravatar images in the background
+
+    Only max_jobs downloads run at the same time, others are queued.
+    Each image is downloaded only once, all the callbacks waiting for the
+    same email will be called when the download is done. Failed downloads
+    are remembered for negative_ttl seconds, and the cache folder is kept
+    below max_cache_size bytes removing the least recently used images.
+
+    The url_template can be changed to point to a local http server
+    (for testing) and must contain 3 placeholders: hash, size and default.
+
+    Identicons can also be rendered locally (see identicon()), these are
+    used while downloading, when the network is not available, and always
+    if options.gravatar_offline is set.
 
+    """
+    url_template = 'http://www.gravatar.com/avatar/%s?size=%d&d=%s'
     cache_folder = os.path.join(xdg_cache_home, 'gravatar')
+    max_jobs = 4
+    negative_ttl = 3600               # seconds
+    max_cache_size = 10 * 1024 * 1024 # bytes
+    evict_every = 50                  # downloads
+
+    def __init__(self):
+        self._queue = deque()   # hash_key of not-yet-started downloads
+        self._waiting = dict()  # 'hash_key': [cb, ...] (queued or running)
+        self._failed = dict()   # 'hash_key': expire timestamp
+        self._running = 0
+        self._downloads_count = 0
+        self._folder_checked = False
+        self._hashes = LRUCache(1000)  # 'email': 'hash_key'
+        self._images = LRUCache(500)   # ('hash_key', size): 'local_path'
+
+    def local_path(self, hash_key):
+        return os.path.join(self.cache_folder, hash_key + '.jpg')
+
+    def hash_for_email(self, email):
+        """ The (memoized) gravatar hash for the given email """
+        hash_key = self._hashes.get(email)
+        if hash_key is None:
+            hash_key = hashlib.md5(email.encode('utf-8').lower()).hexdigest()
+            self._hashes[email] = hash_key
+        return hash_key
+
+    def cached_image(self, hash_key, size):
+        """ The path of the image if available in cache, None otherwise
+
+        Known images are remembered in memory, so showing the same avatar
+        again (in tooltips for example) does not touch the filesystem and
+        always use the same file, that evas can serve from its own cache
+        of decoded images.
+        """
+        key = (hash_key, size)
+        path = self._images.get(key)
+        if path is None:
+            if hash_key in self._waiting: # not yet (or not fully) downloaded
+                return None
+            if not self._folder_checked:
+                if not os.path.exists(self.cache_folder):
+                    os.makedirs(self.cache_folder)
+                self._folder_checked = True
+            path = self.local_path(hash_key)
+            if not os.path.exists(path):
+                return None
+            self._images[key] = path
+        return path
+
+    def identicon(self, hash_key, size):
+        """ The path of the locally generated identicon (created if needed) """
+        key = (hash_key, size, 'identicon')
+        path = self._images.get(key)
+        if path is None:
+            self.cached_image(hash_key, size) # just to be sure the folder exists
+            path = os.path.join(self.cache_folder,
+                                '%s-%d.identicon.png' % (hash_key, size))
+            if not os.path.exists(path):
+                try:
+                    with open(path, 'wb') as f:
+                        f.write(identicon_png(hash_key, size))
+                except (IOError, OSError):
+                    return None
+            self._images[key] = path
+        return path
+
+    def request(self, hash_key, size, done_cb):
+        """ Request the image for hash_key, done_cb(hash_key, path) is
+            called only if the download succeed. Return False if the
+            image is known to be unavailable. """
+        expire = self._failed.get(hash_key)
+        if expire is not None:
+            if expire > time.time():
+                return False
+            del self._failed[hash_key]
+
+        if hash_key in self._waiting: # queued or running yet
+            self._waiting[hash_key].append(done_cb)
+            return True
+
+        self.cached_image(hash_key, size) # just to be sure the folder exists
+        self._waiting[hash_key] = [done_cb]
+        self._queue.append((hash_key, size))
+        self._process_queue()
+        return True
+
+    def clear(self):
+        self._failed.clear()
+        self._images.clear()
+        for f in glob.glob(os.path.join(self.cache_folder, '*.jpg')) + \
+                 glob.glob(os.path.join(self.cache_folder, '*.png')):
+            os.remove(f)
+
+    def _process_queue(self):
+        while self._queue and self._running < self.max_jobs:
+            hash_key, size = self._queue.popleft()
+            url = self.url_template % (hash_key, size, options.gravatar_default)
+            # download to a temp file, the image must appear only when done
+            tmp_path = self.local_path(hash_key) + '.part'
+            try:
+                if os.path.exists(tmp_path): # left by a previous crash
+                    os.remove(tmp_path)
+                FileDownload(url, tmp_path,
+                             self._download_done_cb, None, hash_key, size)
+            except Exception:
+                self._download_failed(hash_key)
+            else:
+                self._running += 1
+
+    def _download_done_cb(self, tmp_path, status, hash_key, size):
+        self._running -= 1
+        path = self.local_path(hash_key)
+        if status == 200:
+            try:
+                os.rename(tmp_path, path)
+            except OSError:
+                self._download_failed(hash_key)
+                self._process_queue()
+                return
+            self._images[(hash_key, size)] = path
+            for cb in self._waiting.pop(hash_key, []):
+                cb(hash_key, path)
+            self._downloads_count += 1
+            if self._downloads_count % self.evict_every == 0:
+                self.evict()
+        else:
+            if os.path.exists(tmp_path): # do not keep error pages around
+                os.remove(tmp_path)
+            self._download_failed(hash_key)
+        self._process_queue()
+
+    def _download_failed(self, hash_key):
+        self._waiting.pop(hash_key, None)
+        self._failed[hash_key] = time.time() + self.negative_ttl
+
+    def evict(self):
+        """ Remove least recently used images if the cache is too big """
+        files = []
+        total = 0
+        for f in glob.glob(os.path.join(self.cache_folder, '*.jpg')) + \
+                 glob.glob(os.path.join(self.cache_folder, '*.png')):
+            try:
+                st = os.stat(f)
+            except OSError:
+                continue
+            files.append((max(st.st_atime, st.st_mtime), st.st_size, f))
+            total += st.st_size
+
+        files.sort()
+        if total > self.max_cache_size:
+            self._images.clear()
+        while files and total > self.max_cache_size:
+            ts, size, f = files.pop(0)
+            try:
+                os.remove(f)
+                total -= size
+            except OSError:
+                pass
+
+gravatar_service = GravatarService()
+
+
+class GravatarPict(Photo):
+
     default_file = theme_resource_get('avatar.png')
-    jobs = []
 
     def __init__(self, parent, size=60):
         self.size_min = size
-
-        if not os.path.exists(self.cache_folder):
-            os.makedirs(self.cache_folder)
+        self._hash_key = None
+        self._showing_gravatar = False
 
         Photo.__init__(self, parent, style="shadow",
                        size_hint_min=(size,size))
 
     @staticmethod
     def clear_icon_cache():
-        filelist = glob.glob(os.path.join(GravatarPict.cache_folder, '*.jpg'))
-        for f in filelist:
-            os.remove(f)
+        gravatar_service.clear()
 
     def email_set(self, email):
         if not email:
+            self._hash_key = None
+            self._showing_gravatar = False
             self.file = self.default_file
             return
 
-        hash_key = hashlib.md5(email.encode('utf-8').lower()).hexdigest()
-        local_path = os.path.join(self.cache_folder, hash_key + '.jpg')
-
-        # downloading yet ?
-        if local_path in self.jobs:
-            self.file = self.default_file
-            return
+        hash_key = gravatar_service.hash_for_email(email)
+        if hash_key == self._hash_key and self._showing_gravatar:
+            return # showing this one yet
+        self._hash_key = hash_key
+        self._showing_gravatar = False
 
         # search in local cache
-        if os.path.exists(local_path):
+        local_path = gravatar_service.cached_image(hash_key, self.size_min)
+        if local_path is not None:
             self.file = local_path
+            self._showing_gravatar = True
             return
 
-        # or download from gravatar
-        gravatar_url = "http://www.gravatar.com/avatar/%s?size=%d&d=%s" % \
-                        (hash_key, self.size_min, options.gravatar_default)
-        FileDownload(gravatar_url, local_path, self._download_done_cb, None)
-        self.jobs.append(local_path)
-        self.file = self.default_file
+        # show a local identicon (or the default avatar) while downloading
+        local_path = None
+        if options.gravatar_offline or options.gravatar_default == 'identicon':
+            local_path = gravatar_service.identicon(hash_key, self.size_min)
+        self.file = local_path or self.default_file
+
+        # and request the real one to the (queued) downloader
+        if not options.gravatar_offline:
+            gravatar_service.request(hash_key, self.size_min,
+                                     self._download_done_cb)
 
-    def _download_done_cb(self, path, status):
-        self.jobs.remove(path)
-        if not self.is_deleted() and status == 200:
+    def _download_done_cb(self, hash_key, path):
+        # the widget can be deleted, or showing another email, in the meantime
+        if not self.is_deleted() and hash_key == self._hash_key:
             self.file = path
+            self._showing_gravatar = True
+
+
+def diff_to_markup(lines, max_lines=0):
+    """ Convert the lines of a unified diff to (highlighted) entry markup
+
+    If max_lines is given only the first max_lines lines are converted.
+    """
+    markup = ''
+    from_fname = to_fname = None
+
+    truncated = max_lines > 0 and len(lines) > max_lines
+    if truncated:
+        lines = lines[:max_lines]
+
+    for line in lines:
+        if from_fname and to_fname:
+            if from_fname == '/dev/null':
+                action = 'A'
+            elif to_fname == '/dev/null':
+                action = 'D'
+            else:
+                action = 'M'
+            markup += '<br><subtitle>' + action + ' ' + to_fname + '</subtitle><br>'
+            from_fname = to_fname = None
+
+        if line.startswith(('diff', 'index', 'new')):
+            pass
+        elif line.startswith('---'):
+            from_fname = line[4:]
+        elif line.startswith('+++'):
+            to_fname = line[4:]
+        elif line.startswith('@@'):
+            markup += '<hilight>'+utf8_to_markup(line)+'</hilight><br>'
+        elif line[0] == '+':
+            markup += '<line_added>'+utf8_to_markup(line)+'</line_added><br>'
+        elif line[0] == '-':
+            markup += '<line_removed>'+utf8_to_markup(line)+'</line_removed><br>'
+        else:
+            markup += utf8_to_markup(line)+'<br>'
+
+    if markup.startswith('<br>'): # remove the first "<br>"
+        markup = markup[4:]
+    if truncated:
+        markup += '<br><warning>Warning: </warning>The diff is too long, ' \
+                  'only the first %d lines are shown.' % max_lines
+    return u'<code><font={0} font_size={1}>{2}</font></code>'.format(
+             options.diff_font_face, options.diff_font_size, markup)
 
 
 class DiffedEntry(Entry):
@@ -368,40 +837,8 @@ class DiffedEntry(Entry):
     def loading_set(self):
         self.text = '<info>Loading diff, please wait...</info>'
 
-    def lines_set(self, lines):
-        markup = ''
-        from_fname = to_fname = None
-
-        for line in lines:
-            if from_fname and to_fname:
-                if from_fname == '/dev/null':
-                    action = 'A'
-                elif to_fname == '/dev/null':
-                    action = 'D'
-                else:
-                    action = 'M'
-                markup += '<br><subtitle>' + action + ' ' + to_fname + '</subtitle><br>'
-                from_fname = to_fname = None
-
-            if line.startswith(('diff', 'index', 'new')):
-                pass
-            elif line.startswith('---'):
-                from_fname = line[4:]
-            elif line.startswith('+++'):
-                to_fname = line[4:]
-            elif line.startswith('@@'):
-                markup += '<hilight>'+utf8_to_markup(line)+'</hilight><br>'
-            elif line[0] == '+':
-                markup += '<line_added>'+utf8_to_markup(line)+'</line_added><br>'
-            elif line[0] == '-':
-                markup += '<line_removed>'+utf8_to_markup(line)+'</line_removed><br>'
-            else:
-                markup += utf8_to_markup(line)+'<br>'
-
-        if markup.startswith('<br>'): # remove the first "<br>"
-            markup = markup[4:]
-        self.text = u'<code><font={0} font_size={1}>{2}</font></code>'.format(
-                      options.diff_font_face, options.diff_font_size, markup)
+    def lines_set(self, lines, max_lines=0):
+        self.text = diff_to_markup(lines, max_lines)
 
 
 class ErrorPopup(Popup):
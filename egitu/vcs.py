@@ -22,18 +22,38 @@ from __future__ import absolute_import, print_function, unicode_literals
 
 import os
 import time
+import json
+import hashlib
+from collections import deque
+from multiprocessing import cpu_count
 from datetime import datetime
+try:
+    from shlex import quote as shell_quote
+except ImportError: # python 2
+    from pipes import quote as shell_quote
 
 from efl.ecore import Exe, ECORE_EXE_PIPE_READ, ECORE_EXE_PIPE_ERROR, \
-    ECORE_EXE_PIPE_READ_LINE_BUFFERED, ECORE_EXE_PIPE_ERROR_LINE_BUFFERED
+    ECORE_EXE_PIPE_WRITE, ECORE_EXE_PIPE_READ_LINE_BUFFERED, \
+    ECORE_EXE_PIPE_ERROR_LINE_BUFFERED
 
-from egitu.utils import file_get_contents, file_put_contents
+from egitu.utils import file_get_contents, file_put_contents, cache_path
+from egitu.refdb import RefDatabase, stat_key
+
+
+# the sha of the tree without files, known to git even if not in the repo
+EMPTY_TREE_SHA = '4b825dc642cb6eb9a060e54bf8d69288fbee4904'
+
+HEX_CHARS = frozenset('0123456789abcdef')
 
 
 def LOG(text):
     print(text)
     # pass
 
+def _is_object_id(text):
+    """ True if text is a full object name, sha-1 or sha-256 """
+    return len(text) in (40, 64) and HEX_CHARS.issuperset(text)
+
 def repo_factory(url):
     url = os.path.abspath(url) # TODO is this right for real url ??
     LOG("Trying to load a repo from: %s" % url)
@@ -55,6 +75,7 @@ class Commit(object):
         self.message = ''
         self.commit_date = None
         self.parents = list()
+        self.parents_rewritten = False # True in the history of a path
         self.heads = list()
         self.remotes = list()
         self.tags = list()
@@ -77,6 +98,14 @@ class Commit(object):
     def sha_short(self):
         return self.sha[:7]
 
+    @property
+    def first_parent(self):
+        """ The sha to diff the commit against (the empty tree for a root
+        commit), None if not known because the parents are rewritten """
+        if self.parents_rewritten:
+            return None
+        return self.parents[0] if self.parents else EMPTY_TREE_SHA
+
 
 class Status(object):
     def __init__(self):
@@ -157,6 +186,49 @@ class StashItem(object):
     def __repr__(self):
         return '<StashItem %s>' % self.ref
 
+class TreeEntry(object):
+    def __init__(self, mode, kind, sha, size, name):
+        self.mode = mode  # '100644', '040000', ...
+        self.kind = kind  # 'blob', 'tree' or 'commit' (submodules)
+        self.sha = sha
+        self.size = size  # in bytes, None for trees and submodules
+        self.name = name
+
+    def __repr__(self):
+        return '<TreeEntry %s %s>' % (self.kind, self.name)
+
+    @property
+    def is_tree(self):
+        return self.kind == 'tree'
+
+class BlameCommit(object):
+    def __init__(self, sha):
+        self.sha = sha
+        self.author = ''
+        self.author_time = 0
+        self.summary = ''
+        self.previous = None # ('parent_sha', 'path in parent') or None
+        self.filename = None
+
+    def __repr__(self):
+        return '<BlameCommit %s>' % self.sha[:7]
+
+class Blame(object):
+    """ The (maybe still partial) blame of path at commit sha """
+    def __init__(self, sha, path):
+        self.sha = sha         # None for the working tree
+        self.path = path
+        self.entries = []      # (sha, orig_line, final_line, num_lines)
+        self.commits = dict()  # 'sha': BlameCommit
+        self.complete = False
+
+    def __repr__(self):
+        return '<Blame %s:%s>' % (self.sha[:7] if self.sha else '', self.path)
+
+    @property
+    def num_lines(self):
+        return sum(e[3] for e in self.entries)
+
 
 ### Base class for backends ###################################################
 class Repository(object):
@@ -209,6 +281,40 @@ class Repository(object):
         """
         raise NotImplementedError("refresh not implemented in backend")
 
+    def snapshot_save(self, commits):
+        """
+        Persist the current repo info (and some commits) in the cache.
+
+        The snapshot is used to show the repo (header, sidebar and the
+        first page of the DAG) as soon as possible on the next startup,
+        while the real data is fetched using load_from_url().
+
+        Args:
+            commits:
+                List of Commit instances to save with the snapshot.
+
+        Returns:
+            True or False.
+        """
+        raise NotImplementedError("snapshot_save() not implemented in backend")
+
+    def snapshot_load(self, url):
+        """
+        Restore the repo info from the snapshot saved in a previous session.
+
+        After this call all the repo properties are available (but they can
+        be stale), load_from_url() must still be called to get fresh data.
+
+        Args:
+            url:
+                Local path of the repo to restore.
+
+        Returns:
+            The list of Commit instances saved with the snapshot, or None
+            if a snapshot is not available for the given url.
+        """
+        raise NotImplementedError("snapshot_load() not implemented in backend")
+
     @property
     def url(self):
         """
@@ -329,8 +435,25 @@ class Repository(object):
         """
         raise NotImplementedError("stash not implemented in backend")
 
+    def refs_at(self, sha):
+        """
+        The refs that point to the given commit.
+
+        Args:
+            sha:
+                The full sha of the commit.
+
+        Returns:
+            A tuple of 3 lists: (heads, remotes, tags). Heads also contains
+            'HEAD' if the commit is the current one.
+
+        NOTE: The refs are cached, you need to call the refresh() function
+        to actually read the refs from the repo.
+        """
+        raise NotImplementedError("refs_at() not implemented in backend")
+
     def request_commits(self, done_cb, prog_cb, ref1=None, ref2=None,
-                        max_count=100, skip=0):
+                        max_count=100, skip=0, path=None):
         """
         Request a list of Commit objects.
 
@@ -349,11 +472,229 @@ class Repository(object):
                 Maximum number of commit to return.
             skip:
                 Start the listing from the N commit.
+            path:
+                Only the commits that touch the given file or folder. The
+                parents of the commits are rewritten to the previous
+                commit that touch the path, so the graph is still connected.
+
+        Returns:
+            An object with a cancel() method, to stop reading the commits
+            (done_cb is still called, with success False).
         """
         raise NotImplementedError("request_commits() not implemented in backend")
 
+    def request_history_commit(self, done_cb, target, ref=None, path=None):
+        """
+        Find the commit of target in the history listed by request_commits.
+
+        Args:
+            done_cb:
+                Function to call when the operation finish.
+                Signature: cb(success, sha, err_msg=None)
+                sha is None if the target is not in that history.
+            target:
+                A sha, a ref name, or a datetime (the first commit not
+                newer than the date).
+            ref:
+                The history of this reference (None for all the refs).
+            path:
+                Only the history of the given file or folder.
+        """
+        raise NotImplementedError("request_history_commit() not implemented in backend")
+
+    def request_file_lines(self, done_cb, path, sha=None):
+        """
+        Request the content of a file, as a list of lines.
+
+        Args:
+            done_cb:
+                Function to call when the operation finish.
+                Signature: cb(success, lines, err_msg=None)
+            path:
+                The file to read, relative to the repo root.
+            sha:
+                The commit to read the file from, or None for the file in
+                the working tree.
+        """
+        raise NotImplementedError("request_file_lines() not implemented in backend")
+
+    def request_blame(self, done_cb, prog_cb, path, sha=None):
+        """
+        Request the blame of a file, lines are attributed progressively.
+
+        Args:
+            done_cb:
+                Function to call when the operation finish.
+                Signature: cb(success, blame, err_msg=None)
+            prog_cb:
+                Function to call for each group of attributed lines.
+                Signature: cb(blame, (sha, orig_line, final_line, num_lines))
+            path:
+                The file to blame, relative to the repo root.
+            sha:
+                The commit to blame the file at, or None for the file in
+                the working tree.
+        """
+        raise NotImplementedError("request_blame() not implemented in backend")
+
+    def request_blame_parent(self, done_cb, prog_cb, blame):
+        """
+        Request the blame of the same file at the parent of blame.sha.
+
+        The lines that the commit did not change are taken from the given
+        (complete) blame, so only the changed regions are blamed again.
+
+        Args:
+            done_cb:
+                Function to call when the operation finish.
+                Signature: cb(success, blame, err_msg=None)
+            prog_cb:
+                Function to call for each group of attributed lines.
+                Signature: cb(blame, (sha, orig_line, final_line, num_lines))
+            blame:
+                The Blame instance of the child commit.
+        """
+        raise NotImplementedError("request_blame_parent() not implemented in backend")
+
+    def request_commit_tree(self, done_cb, sha):
+        """
+        Request the sha of the root tree of a commit.
+
+        Args:
+            done_cb:
+                Function to call when the operation finish.
+                Signature: cb(success, tree_sha, err_msg=None)
+            sha:
+                The commit to get the tree of.
+        """
+        raise NotImplementedError("request_commit_tree() not implemented in backend")
+
+    def request_tree(self, done_cb, tree_sha):
+        """
+        Request the content of a single tree (not recursive).
+
+        Trees are immutable, so they are cached by sha and shared by all
+        the commits that contain the same tree.
+
+        Args:
+            done_cb:
+                Function to call when the operation finish.
+                Signature: cb(success, entries, err_msg=None)
+                entries is a list of TreeEntry instances.
+            tree_sha:
+                The sha of the tree to list.
+        """
+        raise NotImplementedError("request_tree() not implemented in backend")
+
+    def request_blob(self, done_cb, sha, path, entry, max_size=None):
+        """
+        Request the content of a file blob, reading at most max_size bytes.
+
+        Args:
+            done_cb:
+                Function to call when the operation finish.
+                Signature: cb(success, text, truncated, err_msg=None)
+                text is None for binary files, and for files bigger than
+                max_size (with truncated set), as telling them apart from
+                the text files would need to read them all.
+            sha:
+                The commit that contain the file.
+            path:
+                The full path of the file in the commit.
+            entry:
+                The TreeEntry of the file (as given by request_tree).
+            max_size:
+                Stop reading (and set truncated) after this many bytes.
+        """
+        raise NotImplementedError("request_blob() not implemented in backend")
+
+    def request_grep(self, done_cb, prog_cb, pattern, rev=None,
+                     ignore_case=False, max_results=None):
+        """
+        Search the files of a revision (or of the working tree).
+
+        Matches are given to prog_cb while the search is running, the
+        search stop after max_results matches.
+
+        Args:
+            done_cb:
+                Function to call when the operation finish.
+                Signature: cb(success, num_matches, truncated, err_msg=None)
+            prog_cb:
+                Function to call for each match found.
+                Signature: cb(path, line_num, line)
+            pattern:
+                The regular expression to search.
+            rev:
+                The revision to search in, or None for the working tree.
+            ignore_case:
+                True for a case insensitive search.
+            max_results:
+                Stop (and set truncated) after this many matches.
+
+        Returns:
+            An object with a cancel() method, to stop the search.
+        """
+        raise NotImplementedError("request_grep() not implemented in backend")
+
+    def request_tracked_paths(self, done_cb):
+        """
+        Request the list of the files tracked in the index.
+
+        The same list instance is given back until the index changes.
+
+        Args:
+            done_cb:
+                Function to call when the operation finish.
+                Signature: cb(success, paths, err_msg=None)
+        """
+        raise NotImplementedError("request_tracked_paths() not implemented in backend")
+
+    def has_changed_path_filters(self):
+        """
+        Check if the repo has the changed-path filters used to speed up the
+        path limited history (request_commits with the path argument).
+
+        Returns:
+            True or False.
+        """
+        raise NotImplementedError("has_changed_path_filters() not implemented in backend")
+
+    def write_changed_path_filters(self, done_cb):
+        """
+        Write the changed-path filters for all the commits of the repo.
+
+        Args:
+            done_cb:
+                Function to call when the operation finish.
+                Signature: cb(success, err_msg=None)
+        """
+        raise NotImplementedError("write_changed_path_filters() not implemented in backend")
+
+    def request_new_commits(self, done_cb, prog_cb, known_tips):
+        """
+        Request the commits that are not reachable from known_tips.
+
+        Commits are given oldest first, this is used to incrementally
+        extend something that was built from a previous call.
+
+        Args:
+            done_cb:
+                Function to call when the operation finish. The tips list
+                must be given back as known_tips in the next call.
+                Signature: cb(success, tips, err_msg=None)
+            prog_cb:
+                Function to call for each commit.
+                Signature: cb(commit)
+            known_tips:
+                The tips list returned by the previous call (or empty to
+                request all the commits).
+        """
+        raise NotImplementedError("request_new_commits() not implemented in backend")
+
     def request_diff(self, done_cb, prog_cb=None, ref1=None, ref2=None,
-                     path=None, only_staged=False, revert=False, compare=False):
+                     path=None, only_staged=False, revert=False, compare=False,
+                     parent=None):
         """
         Request the full unified diff between 2 commit.
 
@@ -375,8 +716,13 @@ class Repository(object):
                 Any valid reference (commit sha, branch, tag, etc).
             ref2:
                 Another valid reference.
+            parent:
+                The parent of ref1 to diff against (ex: Commit.first_parent)
+                when only ref1 is given, if omitted 'ref1^' is used.
             path:
                 If given only the diff that occur in that file is reported.
+                Can also be a list of paths (ex: both the old and the new
+                name of a renamed file).
             only_staged:
                 If True than only the diff of staged changes is returned,
                 otherwise both staged and unstaged diff is reported.
@@ -426,6 +772,26 @@ class Repository(object):
         """
         raise NotImplementedError("request_changes() not implemented in backend")
 
+    def request_compare_changes(self, done_cb, ref1, ref2):
+        """
+        Request the changes between the common ancestor of 2 refs and ref2.
+
+        This is the list of files that the diff between all the commits in
+        ref2 but not in ref1 touch (in git terms: ref1...ref2), the single
+        file diffs can then be requested using request_diff(compare=True).
+        See request_changes() for the format of list_of_changes.
+
+        Args:
+            done_cb:
+                Function to call when the operation finish.
+                Signature: cb(success, list_of_changes)
+            ref1:
+                Any valid reference (commit sha, branch, tag, etc).
+            ref2:
+                Another valid reference.
+        """
+        raise NotImplementedError("request_compare_changes() not implemented in backend")
+
     @property
     def remotes(self):
         """
@@ -534,6 +900,51 @@ class Repository(object):
         """
         raise NotImplementedError("unstage_file() not implemented in backend")
 
+    def stage_paths(self, done_cb, paths, *args):
+        """
+        Add many files to the staging area, in a single operation.
+
+        Args:
+            done_cb:
+                Function to call when the operation finish.
+                Signature: cb(success, *args)
+            paths:
+                List of paths to put in the staged area.
+            args:
+                All the others arguments passed will be given back in
+                the done_cb callback function.
+        """
+        raise NotImplementedError("stage_paths() not implemented in backend")
+
+    def unstage_paths(self, done_cb, paths, *args):
+        """
+        Remove many files from the staging area, in a single operation.
+
+        Args:
+            done_cb:
+                Function to call when the operation finish.
+                Signature: cb(success, *args)
+            paths:
+                List of paths to remove from the staged area.
+            args:
+                All the others arguments passed will be given back in
+                the done_cb callback function.
+        """
+        raise NotImplementedError("unstage_paths() not implemented in backend")
+
+    def discard_paths(self, done_cb, paths):
+        """
+        Discard the not staged changes of many files, in a single operation.
+
+        Args:
+            done_cb:
+                Function to call when the operation finish.
+                signature: cb(success, err_msg=None)
+            paths:
+                List of paths to revert to the staged (or committed) state.
+        """
+        raise NotImplementedError("discard_paths() not implemented in backend")
+
     def commit(self, done_cb):
         """
         Perform a commit of the local changes (staged)
@@ -686,6 +1097,25 @@ class Repository(object):
         """
         raise NotImplementedError("branch_merge() not implemented in backend")
 
+    def request_merge_conflicts(self, done_cb, ref1, ref2):
+        """
+        Check if merging ref2 into ref1 would produce conflicts.
+
+        The merge is only simulated, neither the working tree nor the
+        index are touched. Results are cached per (sha1, sha2) pair, so
+        asking again for the same commits is really fast.
+
+        Args:
+            done_cb:
+                Function to call when the operation finish.
+                signature: cb(success, conflicting_paths, err_msg=None)
+            ref1:
+                The ref we are merging into (usually 'HEAD')
+            ref2:
+                The ref to merge
+        """
+        raise NotImplementedError("request_merge_conflicts() not implemented in backend")
+
     def tag_delete(self, done_cb, name):
         """
         Delete the given tag.
@@ -815,75 +1245,370 @@ class Repository(object):
         raise NotImplementedError("stash_pop() not implemented in backend")
 
 ### Git backend ###############################################################
-from egitu.utils import options, CmdReviewDialog
+from egitu.utils import options, CmdReviewDialog, LRUCache
 
 CMD_TO_REVIEW = ('commit', 'pull', 'push', 'revert', 'checkout', 'rm', 'add',
     'reset', 'commit', 'merge', 'branch', 'cherry-pick', 'clone', 'tag',
     'stash', 'remote add', 'remote remove', 'remote set-url')
 CMD_TO_EXCLUDE = ('branch -a', 'stash list', 'stash show')
 
-class GitCmd(Exe):
-    def __init__(self, local_path, cmd, done_cb=None, line_cb=None, *args):
+class GitStats(object):
+    """ Collect timing and I/O statistics for every git command executed
+
+    Each command is recorded with: the command kind (first word of the
+    command), the caller (refresh, commits, diff, ...), the wall time,
+    the time to the first byte of output, the number of bytes and lines
+    read and the exit code. Stats are also aggregated per (kind, caller).
+    """
+    def __init__(self, max_records=1000):
+        self.records = deque(maxlen=max_records)
+        self.aggregated = dict() # (kind, caller): {count, time, ttfb, ...}
+
+    def record(self, kind, caller, wall, ttfb, nbytes, nlines, exit_code):
+        self.records.append({'kind': kind, 'caller': caller,
+                             'time': wall, 'ttfb': ttfb,
+                             'bytes': nbytes, 'lines': nlines,
+                             'exit_code': exit_code, 'ts': time.time()})
+        agg = self.aggregated.get((kind, caller))
+        if agg is None:
+            agg = {'count': 0, 'time': 0.0, 'max_time': 0.0, 'ttfb': 0.0,
+                   'bytes': 0, 'lines': 0, 'failures': 0}
+            self.aggregated[(kind, caller)] = agg
+        agg['count'] += 1
+        agg['time'] += wall
+        agg['max_time'] = max(agg['max_time'], wall)
+        agg['ttfb'] += ttfb or 0.0
+        agg['bytes'] += nbytes
+        agg['lines'] += nlines
+        if exit_code != 0:
+            agg['failures'] += 1
+
+    def reset(self):
+        self.records.clear()
+        self.aggregated.clear()
+
+    def summary(self):
+        """ Aggregated stats as a list of dicts, slowest first """
+        L = []
+        for (kind, caller), agg in self.aggregated.items():
+            d = dict(agg, kind=kind, caller=caller)
+            d['avg_time'] = agg['time'] / agg['count']
+            d['avg_ttfb'] = agg['ttfb'] / agg['count']
+            L.append(d)
+        return sorted(L, key=lambda d: d['time'], reverse=True)
+
+    def dump(self, path):
+        """ Save summary and last records to path (in JSON format) """
+        with open(path, 'w') as f:
+            json.dump({'summary': self.summary(),
+                       'scheduler': git_scheduler.stats(),
+                       'records': list(self.records)}, f, indent=2)
+
+git_stats = GitStats()
+
+
+def git_cmdline(local_path, cmd):
+    """ Build the command line to execute git cmd in the local_path repo
+
+    cmd can be an argv list (or tuple) of arguments for git, or a string
+    that will be interpreted by the shell (only kept for compatibility).
+
+    Arguments of argv lists are quoted only when needed. If no argument
+    need quoting ecore_exe execute git directly (it only use a shell if
+    the command line contains shell metacharacters), otherwise the shell
+    is replaced by git using 'exec', so no extra process stay alive.
+    """
+    if isinstance(cmd, (list, tuple)):
+        argv = ['git']
+        if local_path:
+            argv += ['-C', local_path,
+                     '--git-dir=' + os.path.join(local_path, '.git'),
+                     '--work-tree=' + local_path]
+        cmdline = ' '.join(shell_quote(arg) for arg in argv + list(cmd))
+        if "'" in cmdline:
+            cmdline = 'exec ' + cmdline
+        return cmdline
+
+    if local_path:
+        git_dir = os.path.join(local_path, '.git')
+        return 'git -C "%s" --git-dir="%s" --work-tree="%s" %s' % \
+               (local_path, git_dir, local_path, cmd)
+    return 'git %s' % (cmd)
+
+def git_cmd_display(cmd):
+    """ Human (and shell) readable version of cmd (string or argv) """
+    if isinstance(cmd, (list, tuple)):
+        return ' '.join(shell_quote(arg) for arg in cmd)
+    return cmd
+
+
+class GitCmdStatsMixin(object):
+    """ Instrument the Exe subclasses, results are stored in git_stats """
+    def stats_start(self, cmd):
+        self._stats_kind = git_cmd_display(cmd).split(' ', 1)[0]
+        self._stats_start = time.time()
+        self._stats_ttfb = None
+        self._stats_bytes = self._stats_lines = 0
+
+    def stats_data(self, nbytes, nlines):
+        if self._stats_ttfb is None:
+            self._stats_ttfb = time.time() - self._stats_start
+        self._stats_bytes += nbytes
+        self._stats_lines += nlines
+
+    def stats_end(self, exit_code):
+        git_stats.record(self._stats_kind, self.caller or self._stats_kind,
+                         time.time() - self._stats_start, self._stats_ttfb,
+                         self._stats_bytes, self._stats_lines, exit_code)
+
+
+# git commands priorities (lower value run first)
+PRIO_INTERACTIVE = 0 # user actions, the DAG, the diffs...
+PRIO_REFRESH = 1     # refresh of the current repo
+PRIO_PREFETCH = 2    # background jobs (inactive workspace repos)
+PRIO_NAMES = ('interactive', 'refresh', 'prefetch')
+
+
+class GitScheduler(object):
+    """ Central scheduler for all the git processes
+
+    Every GitCmd and GitCmdRAW is submitted here with a priority: at most
+    max_running processes are spawned at the same time (max_prefetch for
+    the background jobs) and queued commands are started in priority
+    order. The last slot is only for interactive commands, so user actions
+    never wait for a refresh. Identical refresh/prefetch commands (same repo
+    and same command line) that are still waiting in the queue are
+    coalesced: only one process is spawned and its output is given to all
+    the requesters (at the highest of their priorities).
+    """
+    def __init__(self, max_running=None, max_prefetch=2):
+        self._max_running = max_running # None: options.git_max_running
+        self.max_prefetch = max_prefetch
+        self._queues = (deque(), deque(), deque()) # (GitCmd, cmd, time)
+        self._pending = dict() # (local_path, cmd, stdin): queued GitCmd
+        self._running = [0, 0, 0]
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.submitted = [0, 0, 0]
+        self.coalesced = 0
+        self.max_depth = [0, 0, 0]
+        self.wait_time = [0.0, 0.0, 0.0]
+
+    @property
+    def max_running(self):
+        return max(self._max_running or options.git_max_running, 1)
+
+    def submit(self, gitcmd, cmd, priority):
+        self.submitted[priority] += 1
+        if priority != PRIO_INTERACTIVE:
+            key = self._key(gitcmd, cmd)
+            leader = self._pending.get(key)
+            if leader is not None:
+                if priority < leader.priority:
+                    self._promote(leader, priority)
+                leader.followers.append(gitcmd)
+                self.coalesced += 1
+                return
+            self._pending[key] = gitcmd
+
+        queue = self._queues[priority]
+        queue.append((gitcmd, cmd, time.time()))
+        self.max_depth[priority] = max(self.max_depth[priority], len(queue))
+        self._process_queues()
+
+    def _promote(self, gitcmd, priority):
+        """ Move a queued GitCmd to the queue of a higher priority """
+        queue = self._queues[gitcmd.priority]
+        for item in queue:
+            if item[0] is gitcmd:
+                queue.remove(item)
+                self._queues[priority].append(item)
+                gitcmd.priority = priority
+                break
+
+    def release(self, priority):
+        self._running[priority] -= 1
+        self._process_queues()
+
+    def cancel(self, gitcmd):
+        """ Remove a GitCmd that is still waiting in the queues """
+        for queue in self._queues:
+            for item in queue:
+                if item[0] is gitcmd:
+                    queue.remove(item)
+                    key = self._key(gitcmd, item[1])
+                    if self._pending.get(key) is gitcmd:
+                        del self._pending[key]
+                    return True
+        return False
+
+    @staticmethod
+    def _key(gitcmd, cmd):
+        return (gitcmd.local_path, cmd, getattr(gitcmd, 'stdin', None))
+
+    def _can_start(self, priority):
+        running = sum(self._running)
+        if running >= self.max_running:
+            return False
+        if priority == PRIO_INTERACTIVE:
+            return True
+        if running >= max(self.max_running - 1, 1): # reserved slot
+            return False
+        if priority == PRIO_PREFETCH:
+            return self._running[PRIO_PREFETCH] < self.max_prefetch
+        return True
+
+    def _process_queues(self):
+        for priority, queue in enumerate(self._queues):
+            while queue and self._can_start(priority):
+                gitcmd, cmd, t = queue.popleft()
+                if self._pending.get(self._key(gitcmd, cmd)) is gitcmd:
+                    del self._pending[self._key(gitcmd, cmd)]
+                self.wait_time[priority] += time.time() - t
+                self._running[priority] += 1
+                try:
+                    gitcmd.start(cmd)
+                except Exception:
+                    self._running[priority] -= 1
+                    raise
+            # lower priorities must wait while higher ones are queued
+            if queue:
+                break
+
+    def stats(self):
+        """ Queue depth and counters for each priority, as a list of dicts """
+        L = []
+        for p, name in enumerate(PRIO_NAMES):
+            done = self.submitted[p] - len(self._queues[p])
+            L.append({'priority': name,
+                      'queued': len(self._queues[p]),
+                      'running': self._running[p],
+                      'submitted': self.submitted[p],
+                      'max_depth': self.max_depth[p],
+                      'avg_wait': self.wait_time[p] / done if done else 0.0})
+        return L
+
+git_scheduler = GitScheduler()
+
+
+class GitCmd(Exe, GitCmdStatsMixin):
+    def __init__(self, local_path, cmd, done_cb=None, line_cb=None, *args,
+                 **kargs):
         self.local_path = local_path
         self.done_cb = done_cb
         self.line_cb = line_cb
         self.args = args
+        self.caller = kargs.get('caller')
+        self.priority = kargs.get('priority', PRIO_INTERACTIVE)
+        self.stdin = kargs.get('stdin') # data to send to the git stdin
+        self.followers = [] # coalesced GitCmd that wait for our output
         self.lines = []
+        self.started = False
+        self.cancelled = False
+
+        if isinstance(cmd, list):
+            cmd = tuple(cmd) # hashable, for the scheduler
+        display = git_cmd_display(cmd)
+        if options.review_git_commands and display.startswith(CMD_TO_REVIEW) \
+           and not display.startswith(CMD_TO_EXCLUDE):
+            CmdReviewDialog(display, self.schedule)
+        else:
+            self.schedule(cmd)
+
+    def schedule(self, cmd):
+        git_scheduler.submit(self, cmd, self.priority)
 
-        if options.review_git_commands and \
-           cmd.startswith(CMD_TO_REVIEW) and not cmd.startswith(CMD_TO_EXCLUDE):
-            CmdReviewDialog(cmd, self.start)
+    def cancel(self):
+        """ Stop reading the output, and kill the process if running
+
+        A running command still call done_cb (with success False), a
+        command still in the scheduler queue is just dropped.
+        """
+        if self.cancelled:
+            return
+        self.cancelled = True
+        if self.followers:
+            return # others are waiting for the output
+        if self.started:
+            self.kill()
         else:
-            self.start(cmd)
+            git_scheduler.cancel(self)
 
     def start(self, cmd):
-        git_dir = os.path.join(self.local_path, '.git')
-        real_cmd = 'git --git-dir="%s" --work-tree="%s" %s' % \
-                   (git_dir, self.local_path, cmd)
-        
-        print("=== GIT " + cmd)
-        Exe.__init__(self, real_cmd, 
-                     ECORE_EXE_PIPE_READ | ECORE_EXE_PIPE_ERROR | 
-                     ECORE_EXE_PIPE_READ_LINE_BUFFERED |
-                     ECORE_EXE_PIPE_ERROR_LINE_BUFFERED)
+        real_cmd = git_cmdline(self.local_path, cmd)
+
+        print("=== GIT " + git_cmd_display(cmd))
+        self.started = True
+        self.stats_start(cmd)
+        flags = ECORE_EXE_PIPE_READ | ECORE_EXE_PIPE_ERROR | \
+                ECORE_EXE_PIPE_READ_LINE_BUFFERED | \
+                ECORE_EXE_PIPE_ERROR_LINE_BUFFERED
+        if self.stdin is not None:
+            flags |= ECORE_EXE_PIPE_WRITE
+        Exe.__init__(self, real_cmd, flags)
         self.on_data_event_add(self.event_data_cb)
         self.on_error_event_add(self.event_data_cb)
         self.on_del_event_add(self.event_del_cb)
+        if self.stdin is not None:
+            data = self.stdin
+            if not isinstance(data, bytes):
+                data = data.encode('utf-8')
+            self.send(data)
+            self.close_stdin()
 
     def event_data_cb(self, exe, event):
+        lines = event.lines
+        self.stats_data(event.size, len(lines))
+        self.lines_received(lines)
+        for follower in self.followers:
+            follower.lines_received(lines)
+
+    def lines_received(self, lines):
+        if self.cancelled:
+            return
         if callable(self.line_cb):
-            for line in event.lines:
+            for line in lines:
                 self.line_cb(line, *self.args)
         else:
-            self.lines += event.lines
+            self.lines += lines
 
     def event_del_cb(self, exe, event):
-        if callable(self.done_cb):
-            self.done_cb(self.lines, (event.exit_code == 0), *self.args)
+        self.stats_end(event.exit_code)
+        git_scheduler.release(self.priority)
+        for gitcmd in [self] + self.followers:
+            if callable(gitcmd.done_cb):
+                gitcmd.done_cb(gitcmd.lines, (event.exit_code == 0),
+                               *gitcmd.args)
 
 
-class GitCmdRAW(Exe):
-    def __init__(self, local_path, cmd, done_cb=None, line_cb=None, *args):
+class GitCmdRAW(Exe, GitCmdStatsMixin):
+    def __init__(self, local_path, cmd, done_cb=None, line_cb=None, *args,
+                 **kargs):
         self.local_path = local_path
         self.done_cb = done_cb
         self.line_cb = line_cb
         self.args = args
-
-        if options.review_git_commands and \
-           cmd.startswith(CMD_TO_REVIEW) and not cmd.startswith(CMD_TO_EXCLUDE):
-            CmdReviewDialog(cmd, self.start)
+        self.caller = kargs.get('caller')
+        self.priority = kargs.get('priority', PRIO_INTERACTIVE)
+
+        if isinstance(cmd, list):
+            cmd = tuple(cmd) # hashable, for the scheduler
+        display = git_cmd_display(cmd)
+        if options.review_git_commands and display.startswith(CMD_TO_REVIEW) \
+           and not display.startswith(CMD_TO_EXCLUDE):
+            CmdReviewDialog(display, self.schedule)
         else:
-            self.start(cmd)
+            self.schedule(cmd)
+
+    def schedule(self, cmd):
+        git_scheduler.submit(self, cmd, self.priority)
     
     def start(self, cmd):
-        if self.local_path:
-            git_dir = os.path.join(self.local_path, '.git')
-            real_cmd = 'git --git-dir="%s" --work-tree="%s" %s' % \
-                       (git_dir, self.local_path, cmd)
-        else:
-            real_cmd = 'git %s' % (cmd)
+        real_cmd = git_cmdline(self.local_path, cmd)
 
-        print("=== GIT " + cmd) # just for debug
+        print("=== GIT " + git_cmd_display(cmd)) # just for debug
+        self.stats_start(cmd)
 
         Exe.__init__(self, real_cmd,
                      ECORE_EXE_PIPE_READ | ECORE_EXE_PIPE_ERROR)
@@ -892,6 +1617,7 @@ class GitCmdRAW(Exe):
         self.on_del_event_add(self.event_del_cb)
         
     def event_data_cb(self, exe, event):
+        self.stats_data(event.size, event.data.count('\n'))
         p1 = p2 = 0
         for c in event.data:
             if c == '\n' or c == '\r':
@@ -902,6 +1628,8 @@ class GitCmdRAW(Exe):
             self.line_cb(event.data[p1:p2].strip(), None)
     
     def event_del_cb(self, exe, event):
+        self.stats_end(event.exit_code)
+        git_scheduler.release(self.priority)
         if callable(self.done_cb):
             self.done_cb((event.exit_code == 0), *self.args)
 
@@ -927,8 +1655,8 @@ def git_clone(done_cb, progress_cb, url, folder, shallow=False):
     def _cmd_done_cb(success):
         done_cb(success, folder)
 
-    cmd = 'clone -v --progress %s %s "%s"' % ('--depth 1' if shallow else '',
-                                              url, folder)
+    cmd = ['clone', '-v', '--progress'] + (['--depth', '1'] if shallow else []) + \
+          [url, folder]
     GitCmdRAW(None, cmd, _cmd_done_cb, progress_cb)
 
 
@@ -943,6 +1671,22 @@ class GitBackend(Repository):
         self._tags = []
         self._remotes = []
         self._stash = []
+        self._merge_conflicts_cache = LRUCache(200) # key: (sha1, sha2)
+        self._blame_cache = LRUCache(200000, # key: (sha, path)
+                                     weight_func=lambda b: b.num_lines or 1)
+        self._tree_cache = LRUCache(200000, weight_func=len) # key: tree sha
+        self._commit_trees = LRUCache(1000) # key: commit sha
+        self._tracked_paths = (None, None) # (index stat key, paths)
+        self._refdb = None
+        self._decorations = dict() # sha: (heads, remotes, tags)
+        self.background = False # True for inactive repos in the workspace
+        self._refresh_running_cbs = None # [(done_cb, args), ...]
+        self._refresh_pending_cbs = None # [(done_cb, args), ...]
+        self._refresh_dispatching = False
+
+    def _priority(self, priority):
+        """ Inactive workspace repos run all the commands as prefetch """
+        return PRIO_PREFETCH if self.background else priority
 
     def check_url(self, url):
         if url and os.path.isdir(os.path.join(url, '.git')):
@@ -955,16 +1699,30 @@ class GitBackend(Repository):
 
         self._url = url
         self._name = self._url.split(os.sep)[-1]
+        self._refdb = RefDatabase(os.path.join(self._url, '.git'))
         desc_file = os.path.join(self._url, '.git', 'description')
         self._description = file_get_contents(desc_file)
         if self._description.startswith('Unnamed repository'):
             self._description = ''
 
-        os.chdir(url) # to make git diff works :/
         self.refresh(done_cb, *args)
 
     def refresh(self, done_cb, *args):
-        """ Async implementation, all commands spawned at the same time """
+        """ Async implementation, all commands spawned at the same time
+
+        Requests are coalesced: while a refresh is running all the new
+        requests are collected and served by a single refresh started when
+        the current one finish (the running one can be stale for them).
+        """
+        if self._refresh_running_cbs is None and not self._refresh_dispatching:
+            self._refresh_running_cbs = [(done_cb, args)]
+            self._refresh_start()
+        elif self._refresh_pending_cbs is None:
+            self._refresh_pending_cbs = [(done_cb, args)]
+        else:
+            self._refresh_pending_cbs.append((done_cb, args))
+
+    def _refresh_start(self):
         print('\n======== Refreshing repo =========================')
         startup_time = time.time()
         
@@ -977,15 +1735,33 @@ class GitBackend(Repository):
             if self._op_count == 0:
                 print('======== Refresh done in %.3f seconds ===========\n' % \
                       (time.time() - startup_time))
-                done_cb(True, *args)
+                self._refresh_done()
 
         self._op_count = 6
-        self._fetch_status(_multi_done_cb, *args)
-        self._fetch_status_text(_multi_done_cb, *args)
-        self._fetch_branches_and_tags(_multi_done_cb, *args)
-        self._fetch_local_config(_multi_done_cb, *args)
-        self._fetch_head_tag(_multi_done_cb, *args)
-        self._fetch_stash(_multi_done_cb, *args)
+        self._fetch_status(_multi_done_cb)
+        self._fetch_status_text(_multi_done_cb)
+        self._fetch_branches_and_tags(_multi_done_cb)
+        self._fetch_local_config(_multi_done_cb)
+        self._fetch_head_tag(_multi_done_cb)
+        self._fetch_stash(_multi_done_cb)
+
+    def _refresh_done(self):
+        cbs, self._refresh_running_cbs = self._refresh_running_cbs, None
+
+        # refresh() called by the callbacks must not reset the status
+        # while the other callbacks are still to be called
+        self._refresh_dispatching = True
+        try:
+            for done_cb, args in cbs:
+                done_cb(True, *args)
+        finally:
+            self._refresh_dispatching = False
+
+        # start the coalesced refresh (if requested in the meantime)
+        if self._refresh_pending_cbs is not None:
+            self._refresh_running_cbs = self._refresh_pending_cbs
+            self._refresh_pending_cbs = None
+            self._refresh_start()
 
     """
     def refresh(self, done_cb, *args):
@@ -1011,62 +1787,71 @@ class GitBackend(Repository):
 
     def _fetch_status(self, done_cb, *args):
         def _cmd_done_cb(lines, success):
-            if len(lines) < 1 or not lines[0].startswith('## '):
+            if self._parse_status(lines) is False:
                 done_cb(False)
-                return
-
-            # parse the first line (branch info)
-            # ex: "## master"
-            # ex: "## master...origin/master"
-            # ex  "## master...origin/master [ahead 1]"
-            # ex: "## HEAD (nessun branch)"
-            line = lines.pop(0)[3:]
-            if line.startswith('HEAD'):
-                self._status.head_detached = True
-            elif '[ahead' in line:
-                self._status.ahead = int(line.split('[ahead')[1][:-1])
-            elif '[behind' in line:
-                self._status.behind = int(line.split('[behind')[1][:-1])
-
-            # parse the list of changed files
-            for line in lines:
-                fname = line[3:]
-                if line[0] == '?':   # untracked (added not staged)
-                    self._status.changes[fname] = ('?', False, fname, None)
-                elif line[0] == 'A': # added and staged
-                    self._status.changes[fname] = ('A', True, fname, None)
-                elif line[0] == 'D': # deleted and staged
-                    self._status.changes[fname] = ('D', True, fname, None)
-                elif line[1] == 'D': # deleted not staged
-                    self._status.changes[fname] = ('D', False, fname, None)
-                elif line[0] == 'M': # modified and staged
-                    self._status.changes[fname] = ('M', True, fname, None)
-                elif line[1] == 'M': # modified not staged
-                    self._status.changes[fname] = ('M', False, fname, None)
-                elif line[0] == 'U': # unmerged
-                    self._status.changes[fname] = ('U', False, fname, None)
-                elif line[0] == 'R': # renamed
-                    name, new_name = fname.split(' -> ')
-                    self._status.changes[name] = ('R', True, name, new_name)
-
-            # special statuses
-            self._status.is_merging = \
-                os.path.exists(os.path.join(self._url, '.git', 'MERGE_HEAD'))
-            self._status.is_cherry = \
-                os.path.exists(os.path.join(self._url, '.git', 'CHERRY_PICK_HEAD'))
-            self._status.is_reverting = \
-                os.path.exists(os.path.join(self._url, '.git', 'REVERT_HEAD'))
-            self._status.is_bisecting = \
-                os.path.exists(os.path.join(self._url, '.git', 'BISECT_LOG'))
+            else:
+                done_cb(success, *args)
+        GitCmd(self._url, ['status', '--porcelain', '-b', '-u'],
+               done_cb=_cmd_done_cb,
+               caller='refresh',
+               priority=self._priority(PRIO_REFRESH))
+
+    def _parse_status(self, lines):
+        """ Fill self._status from the output of 'status --porcelain -b' """
+        if len(lines) < 1 or not lines[0].startswith('## '):
+            return False
+
+        # parse the first line (branch info)
+        # ex: "## master"
+        # ex: "## master...origin/master"
+        # ex  "## master...origin/master [ahead 1]"
+        # ex: "## HEAD (nessun branch)"
+        line = lines[0][3:]
+        if line.startswith('HEAD'):
+            self._status.head_detached = True
+        elif '[ahead' in line:
+            self._status.ahead = int(line.split('[ahead')[1][:-1])
+        elif '[behind' in line:
+            self._status.behind = int(line.split('[behind')[1][:-1])
+
+        # parse the list of changed files
+        for line in lines[1:]:
+            fname = line[3:]
+            if line[0] == '?':   # untracked (added not staged)
+                self._status.changes[fname] = ('?', False, fname, None)
+            elif line[0] == 'A': # added and staged
+                self._status.changes[fname] = ('A', True, fname, None)
+            elif line[0] == 'D': # deleted and staged
+                self._status.changes[fname] = ('D', True, fname, None)
+            elif line[1] == 'D': # deleted not staged
+                self._status.changes[fname] = ('D', False, fname, None)
+            elif line[0] == 'M': # modified and staged
+                self._status.changes[fname] = ('M', True, fname, None)
+            elif line[1] == 'M': # modified not staged
+                self._status.changes[fname] = ('M', False, fname, None)
+            elif line[0] == 'U': # unmerged
+                self._status.changes[fname] = ('U', False, fname, None)
+            elif line[0] == 'R': # renamed
+                name, new_name = fname.split(' -> ')
+                self._status.changes[name] = ('R', True, name, new_name)
 
-            done_cb(success, *args)
-        GitCmd(self._url, 'status --porcelain -b -u', done_cb=_cmd_done_cb)
+        # special statuses
+        self._status.is_merging = \
+            os.path.exists(os.path.join(self._url, '.git', 'MERGE_HEAD'))
+        self._status.is_cherry = \
+            os.path.exists(os.path.join(self._url, '.git', 'CHERRY_PICK_HEAD'))
+        self._status.is_reverting = \
+            os.path.exists(os.path.join(self._url, '.git', 'REVERT_HEAD'))
+        self._status.is_bisecting = \
+            os.path.exists(os.path.join(self._url, '.git', 'BISECT_LOG'))
+        return True
 
     def _fetch_status_text(self, done_cb, *args):
         def _cmd_done_cb(lines, success):
             self._status.textual = '<br>'.join(lines)
             done_cb(success, *args)
-        GitCmd(self._url, 'status', done_cb=_cmd_done_cb)
+        GitCmd(self._url, ['status'], done_cb=_cmd_done_cb, caller='refresh',
+               priority=self._priority(PRIO_REFRESH))
 
     def _fetch_head_tag(self, done_cb, *args):
         def _cmd_done_cb(lines, success):
@@ -1074,49 +1859,109 @@ class GitBackend(Repository):
                 self._status.head_to_tag = lines[0]
             done_cb(success, *args)
 
-        cmd = 'describe --tags --exact-match HEAD'
-        GitCmd(self._url, cmd, done_cb=_cmd_done_cb)
+        cmd = ['describe', '--tags', '--exact-match', 'HEAD']
+        GitCmd(self._url, cmd, done_cb=_cmd_done_cb, caller='refresh',
+               priority=self._priority(PRIO_REFRESH))
+
+    def _add_ref(self, refname, is_head, upstream):
+        # tags
+        if refname.startswith('refs/tags/'):
+            self._tags.append(Tag(refname))
+        # local branches
+        elif refname.startswith('refs/heads/'):
+            bname = refname[11:] # remove 'refs/heads/'
+            b = Branch(refname, bname, is_current=is_head)
+            if upstream:
+                split = upstream.split('/')
+                b.remote = split[2]
+                b.remote_branch = '/'.join(split[3:])
+            if b.is_current:
+                self.status.current_branch = b
+            self._branches.append(b)
+        # remote branches
+        elif refname.startswith('refs/remotes'):
+            self._remote_branches.append(refname[13:]) # remove'refs/remotes/'
 
     def _fetch_branches_and_tags(self, done_cb, *args):
-        def _cmd_line_cb(line):
-            objtype, head, refname, upstream = line.split('|')
-            # tags
-            if refname.startswith('refs/tags/'):
-                self._tags.append(Tag(refname))
-            # local branches
-            elif refname.startswith('refs/heads/'):
-                bname = refname[11:] # remove 'refs/heads/'
-                b = Branch(refname, bname, is_current=(head == '*'))
-                if upstream:
-                    split = upstream.split('/')
-                    b.remote = split[2]
-                    b.remote_branch = '/'.join(split[3:])
-                if b.is_current:
-                    self.status.current_branch = b
-                self._branches.append(b)
-            # remote branches
-            elif refname.startswith('refs/remotes'):
-                self._remote_branches.append(refname[13:]) # remove'refs/remotes/'
-
-        def _cmd_done_cb(lines, success):
-            done_cb(success, *args)
-
         del self._branches[:]
         del self._remote_branches[:]
         del self._tags[:]
         del self._stash[:]
-        cmd = 'for-each-ref --format="%(objecttype)|%(HEAD)|%(refname)|%(upstream)"'
-        GitCmd(self._url, cmd, _cmd_done_cb, _cmd_line_cb)
+
+        # read the refs directly from the repo, without spawning git
+        if self._refdb is not None and self._refdb.supported:
+            refdb = self._refdb
+            refdb.update()
+            for refname in refdb.refs:
+                self._add_ref(refname, refname == refdb.head_ref,
+                              refdb.upstreams.get(refname))
+            self._decorations_build(
+                [(r, refdb.peeled.get(r, sha)) for r, sha in refdb.refs.items()],
+                refdb.head_sha)
+            done_cb(True, *args)
+            return
+
+        def _cmd_line_cb(line, refs):
+            sha, peeled, head, refname, upstream = line.split('|')
+            self._add_ref(refname, head == '*', upstream)
+            refs.append((refname, peeled or sha))
+            if head == '*':
+                head_sha[0] = sha
+
+        def _cmd_done_cb(lines, success, refs):
+            self._decorations_build(refs, head_sha[0])
+            done_cb(success, *args)
+
+        # when detached the HEAD file contains the sha
+        head_sha = [self._status.head_to_commit]
+        if head_sha[0] and head_sha[0].startswith('ref: '):
+            head_sha[0] = None
+
+        cmd = ['for-each-ref', '--format=%(objectname)|%(*objectname)|'
+                               '%(HEAD)|%(refname)|%(upstream)']
+        GitCmd(self._url, cmd, _cmd_done_cb, _cmd_line_cb, list(),
+               caller='refresh', priority=self._priority(PRIO_REFRESH))
+
+    def _decorations_build(self, refs, head_sha):
+        """ Build the sha: (heads, remotes, tags) reverse index of refs
+
+        refs is a list of (refname, sha) sorted by refname, for annotated
+        tags sha must be the one of the tagged commit.
+        """
+        index = dict()
+        if head_sha:
+            index[head_sha] = (['HEAD'], [], [])
+        for refname, sha in refs:
+            if refname.startswith('refs/heads/'):
+                i, name = 0, refname[11:]
+            elif refname.startswith('refs/remotes/'):
+                i, name = 1, refname[13:]
+            elif refname.startswith('refs/tags/'):
+                i, name = 2, refname[10:]
+            else:
+                continue
+            deco = index.get(sha)
+            if deco is None:
+                deco = index[sha] = ([], [], [])
+            deco[i].append(name)
+        self._decorations = index
+
+    def refs_at(self, sha):
+        deco = self._decorations.get(sha)
+        if deco is None:
+            return [], [], []
+        return list(deco[0]), list(deco[1]), list(deco[2])
 
     def _fetch_stash(self, done_cb, *args):
         def _cmd_line_cb(line):
-            self._stash.append(StashItem(*line.split('|')))# sha, ref, desc, ts
+            self._stash.append(StashItem(*line.split('\x1f')))# sha, ref, desc, ts
 
         def _cmd_done_cb(lines, success):
             done_cb(success, *args)
 
-        cmd = 'stash list --format="%H|%gd|%gs|%ct|%an|%ae"'
-        GitCmd(self._url, cmd, _cmd_done_cb, _cmd_line_cb)
+        cmd = ['stash', 'list', '--format=%H%x1f%gd%x1f%gs%x1f%ct%x1f%an%x1f%ae']
+        GitCmd(self._url, cmd, _cmd_done_cb, _cmd_line_cb, caller='refresh',
+               priority=self._priority(PRIO_REFRESH))
 
     def _fetch_local_config(self, done_cb, *args):
         def _cmd_done_cb(lines, success):
@@ -1134,8 +1979,116 @@ class GitBackend(Repository):
             done_cb(success, *args)
 
         del self._remotes[:]
-        cmd = 'config --local --get-regexp "remote."'
-        GitCmd(self._url, cmd, _cmd_done_cb)
+        cmd = ['config', '--local', '--get-regexp', 'remote.']
+        GitCmd(self._url, cmd, _cmd_done_cb, caller='refresh',
+               priority=self._priority(PRIO_REFRESH))
+
+    SNAPSHOT_VERSION = 1
+
+    def _snapshot_path(self, url):
+        key = hashlib.md5(url.encode('utf-8')).hexdigest()
+        return os.path.join(cache_path, 'snapshots', key + '.json')
+
+    def snapshot_save(self, commits):
+        st = self._status
+        data = {
+            'version': self.SNAPSHOT_VERSION,
+            'url': self._url,
+            'status': {
+                'ahead': st.ahead, 'behind': st.behind,
+                'textual': st.textual, 'changes': list(st.changes.values()),
+                'head_detached': st.head_detached,
+                'head_to_tag': st.head_to_tag,
+                'head_to_commit': st.head_to_commit,
+                'is_merging': st.is_merging, 'is_cherry': st.is_cherry,
+                'is_reverting': st.is_reverting,
+                'is_bisecting': st.is_bisecting,
+            },
+            'branches': [(b.ref, b.name, b.remote, b.remote_branch,
+                          b.is_current) for b in self._branches],
+            'remote_branches': self._remote_branches,
+            'tags': [t.ref for t in self._tags],
+            'remotes': [(r.name, r.url, r.fetch) for r in self._remotes],
+            'stash': [(i.sha, i.ref, i.desc, i.ts, i.aut, i.amail)
+                      for i in self._stash],
+            'commits': [(c.sha, c.parents, c.author, c.author_email,
+                         c.committer, c.committer_email,
+                         int(time.mktime(c.commit_date.timetuple())),
+                         c.title, c.message, c.heads, c.remotes, c.tags)
+                        for c in commits],
+        }
+        path = self._snapshot_path(self._url)
+        try:
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            # write+rename, a crash must not leave a broken snapshot
+            with open(path + '.tmp', 'w') as f:
+                json.dump(data, f)
+            os.rename(path + '.tmp', path)
+            return True
+        except (IOError, OSError, TypeError, ValueError) as e:
+            LOG('Cannot save snapshot: %s' % e)
+            return False
+
+    def snapshot_load(self, url):
+        if url.endswith(os.sep):
+            url = url[:-len(os.sep)]
+        try:
+            with open(self._snapshot_path(url)) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if data.get('version') != self.SNAPSHOT_VERSION or \
+           data.get('url') != url:
+            return None
+
+        try:
+            self._url = url
+            self._name = url.split(os.sep)[-1]
+            desc_file = os.path.join(url, '.git', 'description')
+            self._description = file_get_contents(desc_file) or ''
+            if self._description.startswith('Unnamed repository'):
+                self._description = ''
+
+            self._status = Status()
+            for key, val in data['status'].items():
+                if key == 'changes':
+                    for mod, staged, path, new_path in val:
+                        self._status.changes[path] = \
+                            (mod, staged, path, new_path)
+                else:
+                    setattr(self._status, key, val)
+
+            self._branches = []
+            for ref, name, remote, remote_branch, is_current in \
+                    data['branches']:
+                b = Branch(ref, name, remote, remote_branch, is_current)
+                if is_current:
+                    self._status.current_branch = b
+                self._branches.append(b)
+            self._remote_branches = data['remote_branches']
+            self._tags = [Tag(ref) for ref in data['tags']]
+            self._remotes = [Remote(*r) for r in data['remotes']]
+            self._stash = [StashItem(*s) for s in data['stash']]
+
+            commits = []
+            for (sha, parents, author, author_email, committer,
+                 committer_email, ts, title, message,
+                 heads, remotes, tags) in data['commits']:
+                c = Commit()
+                c.sha, c.parents = sha, parents
+                c.author, c.author_email = author, author_email
+                c.committer, c.committer_email = committer, committer_email
+                c.commit_date = datetime.fromtimestamp(ts)
+                c.title, c.message = title, message
+                c.heads, c.remotes, c.tags = heads, remotes, tags
+                commits.append(c)
+        except (KeyError, TypeError, ValueError) as e:
+            LOG('Invalid snapshot: %s' % e)
+            self.__init__()
+            return None
+
+        return commits
 
     @property
     def url(self):
@@ -1170,7 +2123,7 @@ class GitBackend(Repository):
             else:
                 done_cb(success, '\n'.join(lines))
 
-        cmd = "checkout %s" % (ref)
+        cmd = ['checkout', ref]
         GitCmd(self._url, cmd, _cmd_done_cb)
 
     @property
@@ -1190,7 +2143,7 @@ class GitBackend(Repository):
         return self._stash
 
     def request_commits(self, done_cb, prog_cb, ref1=None, ref2=None,
-                        max_count=0, skip=0):
+                        max_count=0, skip=0, path=None):
         def _cmd_done_cb(lines, success, lines_buf):
             if success:
                 done_cb(success)
@@ -1200,105 +2153,558 @@ class GitBackend(Repository):
         def _cmd_line_cb(line, lines_buf):
             lines_buf.append(line)
             if line and line[-1] == chr(0x03):
-                _parse_commit('\n'.join(lines_buf)[:-1])
+                commit = self._parse_commit('\n'.join(lines_buf)[:-1])
+                commit.parents_rewritten = path is not None
+                prog_cb(commit)
                 del lines_buf[:]
 
-        def _parse_commit(buf):
-            c = Commit()
-            (c.sha, c.parents, c.author, c.author_email, c.committer,
-             c.committer_email,c.commit_date, 
-             c.title, c.message, refs) = buf.split(chr(0x00))
-            if c.parents:
-                c.parents = c.parents.split(' ')
-            if c.commit_date:
-                c.commit_date = datetime.fromtimestamp(int(c.commit_date))
-            if refs:
-                refs = refs.strip().strip(')(').split(', ')
-                for ref in refs:
-                    if ref.startswith('tag: refs/tags/'):
-                        c.tags.append(ref[15:])
-                    elif ref.startswith('refs/tags/'):
-                        c.tags.append(ref[10:])
-                    elif ref == 'HEAD':
-                        c.heads.append(ref)
-                    elif ref.startswith(('refs/heads/')):
-                        c.heads.append(ref[11:])
-                    elif ref.startswith('refs/remotes/'):
-                        c.remotes.append(ref[13:])
-                    else:
-                        c.heads.append(ref) # TODO REMOVE ME
-                        LOG("UNKNOWN REF: %s" % ref)
-            prog_cb(c)
-
-        # fmt = 'format:{"sha":"%H", "parents":"%P", 
-        #                "author":"%an", "author_email":"%ae",
-        #                "committer":"%cn", "committer_email":"%ce", 
-        #                "commit_ts":%ct, "title":"%s",
-        #                "body": "%b", "refs":"%d"}'
-        # Use ascii char 00 as field separator and char 03 as commits separator
-        fmt = '%x00'.join(('%H','%P','%an','%ae','%cn','%ce','%ct','%s','%b','%d')) + '%x03'
-        cmd = "log --pretty='tformat:%s' --decorate=full" % (fmt)
+        cmd = ['log', '--pretty=tformat:' + self.LOG_FORMAT]
         if ref1 and ref2:
-            cmd += ' %s..%s' % (ref1, ref2)
+            cmd.append('%s..%s' % (ref1, ref2))
         elif ref1:
-            cmd += ' %s' % ref1
+            cmd.append(ref1)
+        else:
+            cmd.append('--all')
+
+        if max_count > 0: cmd += ['--max-count', str(max_count)]
+        if skip > 0: cmd += ['--skip', str(skip)]
+        if path is not None:
+            # --parents enable the parents rewriting (used by %P)
+            cmd += ['--parents', '--', path]
+        return GitCmd(self._url, cmd, _cmd_done_cb, _cmd_line_cb, list(),
+                      caller='commits',
+                      priority=self._priority(PRIO_INTERACTIVE))
+
+    def request_history_commit(self, done_cb, target, ref=None, path=None):
+        def _rev_list_done_cb(lines, success):
+            if success:
+                done_cb(True, lines[0] if lines else None)
+            else:
+                done_cb(False, None, '\n'.join(lines))
+
+        def _batch_check_done_cb(lines, success):
+            # "<sha> commit <size>", or "<target> missing"
+            shas = [l.split(' ')[0] for l in lines
+                    if l.split(' ')[1:2] == ['commit']]
+            if not shas:
+                done_cb(True, None)
+            elif ref is not None:
+                cmd = ['merge-base', '--is-ancestor', shas[0], ref]
+                GitCmd(self._url, cmd, _ancestor_done_cb, None, shas[0],
+                       caller='goto')
+            else: # all the refs (and HEAD, maybe detached) are shown
+                cmd = ['for-each-ref', '--count=1', '--contains', shas[0]]
+                GitCmd(self._url, cmd, _contains_done_cb, None, shas[0],
+                       caller='goto')
+
+        def _contains_done_cb(lines, success, sha):
+            if success and lines:
+                _ancestor_done_cb([], True, sha)
+            else:
+                cmd = ['merge-base', '--is-ancestor', sha, 'HEAD']
+                GitCmd(self._url, cmd, _ancestor_done_cb, None, sha,
+                       caller='goto')
+
+        def _ancestor_done_cb(lines, success, sha):
+            if not success: # exit code 1: not an ancestor
+                done_cb(True, None)
+            elif path is not None: # only listed if it touch the path
+                cmd = ['rev-list', '--no-walk', sha, '--', path]
+                GitCmd(self._url, cmd, _rev_list_done_cb, caller='goto')
+            else:
+                done_cb(True, sha)
+
+        if isinstance(target, datetime):
+            cmd = ['rev-list', '--max-count=1',
+                   '--before=%d' % time.mktime(target.timetuple()),
+                   ref or '--all']
+            if path is not None:
+                cmd += ['--', path]
+            GitCmd(self._url, cmd, _rev_list_done_cb, caller='goto')
         else:
-            cmd += ' --all'
-            
-        if max_count > 0: cmd += ' --max-count %d' % max_count
-        if skip > 0: cmd += ' --skip %d' % skip
-        GitCmd(self._url, cmd, _cmd_done_cb, _cmd_line_cb, list())
+            # on stdin, "^{commit}" does not need the shell
+            GitCmd(self._url, ['cat-file', '--batch-check'],
+                   _batch_check_done_cb, caller='goto',
+                   stdin=target + '^{commit}\n')
+
+    def request_file_lines(self, done_cb, path, sha=None):
+        def _cmd_done_cb(lines, success):
+            if success:
+                done_cb(success, lines)
+            else:
+                done_cb(success, None, '\n'.join(lines))
+
+        if sha is None:
+            text = file_get_contents(os.path.join(self._url, path))
+            if text is None:
+                done_cb(False, None, 'Cannot read file: %s' % path)
+            else:
+                done_cb(True, text.splitlines())
+            return
+        GitCmd(self._url, ['show', '%s:%s' % (sha, path)], _cmd_done_cb,
+               caller='blame')
+
+    def _blame_line_cb(self, line, blame, state, prog_cb):
+        # state: [current entry or None, BlameCommit, [error lines]]
+        if not line:
+            return
+        if state[0] is None:
+            try:
+                sha, orig, final, num = line.split(' ')
+                state[0] = (sha, int(orig), int(final), int(num))
+            except ValueError:
+                state[2].append(line) # stderr is in the same stream
+                return
+            state[1] = blame.commits.get(sha)
+            if state[1] is None:
+                state[1] = blame.commits[sha] = BlameCommit(sha)
+            return
+
+        key, _, val = line.partition(' ')
+        commit = state[1]
+        if key == 'filename':
+            commit.filename = val
+            blame.entries.append(state[0])
+            prog_cb(blame, state[0])
+            state[0] = None
+        elif key == 'author':
+            commit.author = val
+        elif key == 'author-time':
+            commit.author_time = int(val)
+        elif key == 'summary':
+            commit.summary = val
+        elif key == 'previous':
+            psha, _, ppath = val.partition(' ')
+            commit.previous = (psha, ppath)
+
+    def _blame_run(self, done_cb, prog_cb, blame, ranges=None):
+        def _cmd_done_cb(lines, success, blame, state, prog_cb):
+            if success:
+                blame.complete = True
+                blame.entries.sort(key=lambda e: e[2])
+                if blame.sha is not None:
+                    self._blame_cache[(blame.sha, blame.path)] = blame
+                done_cb(True, blame)
+            else:
+                done_cb(False, blame, '\n'.join(state[2]))
+
+        cmd = ['blame', '--incremental', '--porcelain']
+        for start, count in ranges or []:
+            cmd += ['-L', '%d,+%d' % (start, count)]
+        if blame.sha is not None:
+            cmd.append(blame.sha)
+        cmd += ['--', blame.path]
+        GitCmd(self._url, cmd, _cmd_done_cb, self._blame_line_cb,
+               blame, [None, None, []], prog_cb, caller='blame')
+
+    def _blame_replay(self, done_cb, prog_cb, blame):
+        for entry in blame.entries:
+            prog_cb(blame, entry)
+        done_cb(True, blame)
+
+    def request_blame(self, done_cb, prog_cb, path, sha=None):
+        key = (sha, path)
+        if sha is not None and key in self._blame_cache:
+            self._blame_replay(done_cb, prog_cb, self._blame_cache[key])
+        else:
+            self._blame_run(done_cb, prog_cb, Blame(sha, path))
+
+    def request_blame_parent(self, done_cb, prog_cb, blame):
+        def _parents_done_cb(lines, success):
+            parents = lines[0].split() if success and lines else []
+            # the "parent" of the working tree is HEAD
+            parents = parents[:1] if blame.sha is None else parents[1:]
+            if not parents:
+                done_cb(False, None, 'The commit has no parent')
+            elif (parents[0], blame.path) in self._blame_cache:
+                self._blame_replay(done_cb, prog_cb,
+                                   self._blame_cache[(parents[0], blame.path)])
+            elif len(parents) > 1 or not blame.complete or blame.sha is None:
+                # merges can take lines from any parent, blame everything
+                self.request_blame(done_cb, prog_cb, blame.path, parents[0])
+            else:
+                cmd = ['diff', '-U0', '--no-color', '--no-ext-diff',
+                       parents[0], blame.sha, '--', blame.path]
+                GitCmd(self._url, cmd, _diff_done_cb, None, parents[0],
+                       caller='blame')
+
+        def _diff_done_cb(lines, success, parent):
+            if not success:
+                self.request_blame(done_cb, prog_cb, blame.path, parent)
+                return
+            if any(l.startswith('new file') for l in lines):
+                # not in the parent, blame the file the lines come from
+                commit = blame.commits.get(blame.sha)
+                if commit is not None and commit.previous is not None:
+                    sha, path = commit.previous
+                    self.request_blame(done_cb, prog_cb, path, sha)
+                else: # no line changed by the commit, a pure rename ?
+                    cmd = ['diff', '--name-status', '-M', '--diff-filter=R',
+                           parent, blame.sha]
+                    GitCmd(self._url, cmd, _renames_done_cb, None, parent,
+                           caller='blame')
+                return
+
+            # hunks as (parent_start, parent_count, child_start, child_count)
+            hunks = []
+            for line in lines:
+                if line.startswith('@@ '):
+                    old, new = line.split(' ')[1:3]
+                    ps, _, pn = old[1:].partition(',')
+                    cs, _, cn = new[1:].partition(',')
+                    hunks.append((int(ps), int(pn or 1), int(cs), int(cn or 1)))
+
+            new_blame = Blame(parent, blame.path)
+            new_blame.entries = self._blame_shift(blame, hunks)
+            for sha, orig, final, num in new_blame.entries:
+                new_blame.commits[sha] = blame.commits[sha]
+                prog_cb(new_blame, (sha, orig, final, num))
+
+            # blame again only the lines removed/changed by the commit
+            missing = [(ps, pn) for ps, pn, cs, cn in hunks if pn > 0]
+            if missing:
+                self._blame_run(done_cb, prog_cb, new_blame, missing)
+            else:
+                new_blame.complete = True
+                self._blame_cache[(parent, blame.path)] = new_blame
+                done_cb(True, new_blame)
+
+        def _renames_done_cb(lines, success, parent):
+            for change in self._parse_name_status(lines if success else []):
+                if change[2] == blame.path:
+                    self.request_blame(done_cb, prog_cb, change[1], parent)
+                    return
+            done_cb(False, None, 'The file was added in this commit')
+
+        cmd = ['rev-list', '--parents', '-n', '1', blame.sha or 'HEAD']
+        GitCmd(self._url, cmd, _parents_done_cb, caller='blame')
+
+    @staticmethod
+    def _blame_shift(blame, hunks):
+        """ Move the entries of blame not changed by hunks to the parent """
+        # segments of unchanged lines: (child_start, parent_start, count)
+        segments = []
+        cur_c = cur_p = 1
+        for ps, pn, cs, cn in hunks:
+            c_start = cs if cn > 0 else cs + 1
+            p_start = ps if pn > 0 else ps + 1
+            if c_start > cur_c:
+                segments.append((cur_c, cur_p, c_start - cur_c))
+            cur_c, cur_p = c_start + cn, p_start + pn
+        total = blame.num_lines
+        if total >= cur_c:
+            segments.append((cur_c, cur_p, total - cur_c + 1))
+
+        # both the lists are sorted by the child line, walk them together
+        entries = []
+        i = 0
+        for sha, orig, final, num in blame.entries:
+            if sha == blame.sha:
+                continue # lines added by the commit itself
+            end = final + num
+            while i < len(segments) and \
+                  segments[i][0] + segments[i][2] <= final:
+                i += 1
+            j = i
+            while j < len(segments) and segments[j][0] < end:
+                c_start, p_start, count = segments[j]
+                start = max(final, c_start)
+                stop = min(end, c_start + count)
+                if stop > start:
+                    entries.append((sha, orig + start - final,
+                                    p_start + start - c_start, stop - start))
+                j += 1
+        return entries
+
+    def request_commit_tree(self, done_cb, sha):
+        def _cmd_done_cb(lines, success):
+            if success and lines and lines[0].startswith('tree '):
+                self._commit_trees[sha] = lines[0][5:].strip()
+                done_cb(True, self._commit_trees[sha])
+            else:
+                done_cb(False, None, '\n'.join(lines))
+
+        if sha in self._commit_trees:
+            done_cb(True, self._commit_trees[sha])
+        else:
+            # the first line of the commit object is "tree <sha>"
+            GitCmd(self._url, ['cat-file', 'commit', sha],
+                   _cmd_done_cb, caller='tree')
+
+    def request_tree(self, done_cb, tree_sha):
+        def _cmd_done_cb(lines, success):
+            if not success:
+                done_cb(False, None, '\n'.join(lines))
+                return
+            # the records are NUL terminated, names can contain newlines
+            entries = []
+            for record in '\n'.join(lines).split('\0'):
+                meta, _, name = record.partition('\t')
+                if not name:
+                    continue
+                mode, kind, sha, size = meta.split()
+                size = int(size) if size.isdigit() else None
+                entries.append(TreeEntry(mode, kind, sha, size, name))
+            self._tree_cache[tree_sha] = entries
+            done_cb(True, entries)
+
+        if tree_sha in self._tree_cache:
+            done_cb(True, self._tree_cache[tree_sha])
+        else:
+            GitCmd(self._url, ['ls-tree', '-z', '--long', tree_sha],
+                   _cmd_done_cb, caller='tree')
+
+    def request_blob(self, done_cb, sha, path, entry, max_size=None):
+        # the lines of the output must be valid utf-8 to reach the callbacks,
+        # so binary files must be detected before reading them, but the
+        # probe read (and count the lines of) the whole blob: not for big ones
+        if max_size is not None and (entry.size or 0) > max_size:
+            done_cb(True, None, True)
+            return
+
+        # state: [GitCmd, received bytes, lines, stopped]
+        def _line_cb(line, state):
+            if state[3]:
+                return
+            state[1] += len(line) + 1
+            state[2].append(line)
+            if max_size is not None and state[1] >= max_size:
+                state[3] = True
+                state[0].cancel() # stop reading, we have enough
+
+        def _cmd_done_cb(lines, success, state):
+            if success or state[3]:
+                done_cb(True, '\n'.join(state[2]), state[3])
+            else:
+                done_cb(False, None, False, '\n'.join(state[2]))
+
+        def _numstat_done_cb(lines, success):
+            if not success:
+                done_cb(False, None, False, '\n'.join(lines))
+            elif lines and lines[0].startswith('-\t-\t'):
+                done_cb(True, None, False) # binary
+            else:
+                state = [None, 0, [], False]
+                state[0] = GitCmd(self._url, ['cat-file', 'blob', entry.sha],
+                                  _cmd_done_cb, _line_cb, state, caller='tree')
+
+        # git report "-\t-" instead of the number of lines for binary files
+        GitCmd(self._url, ['diff', '--numstat', '--no-renames', EMPTY_TREE_SHA,
+                           sha, '--', ':(literal)' + path],
+               _numstat_done_cb, caller='tree')
+
+    def request_grep(self, done_cb, prog_cb, pattern, rev=None,
+                     ignore_case=False, max_results=None):
+        # state: [GitCmd, num matches, error lines, truncated]
+        def _line_cb(line, state):
+            if state[3]:
+                return
+            # with -z: "[rev:]path\0line_num\0line"
+            try:
+                path, num, text = line.split('\0', 2)
+                num = int(num)
+            except ValueError:
+                state[2].append(line)
+                return
+            if prefix and path.startswith(prefix):
+                path = path[len(prefix):]
+            state[1] += 1
+            prog_cb(path, num, text)
+            if max_results is not None and state[1] >= max_results:
+                state[3] = True
+                state[0].cancel() # the rest of the matches are not needed
+
+        def _cmd_done_cb(lines, success, state):
+            if state[0].cancelled and not state[3]:
+                return # cancelled by the caller
+            # exit code 1 means "no matches"
+            if success or state[3] or not state[2]:
+                done_cb(True, state[1], state[3])
+            else:
+                done_cb(False, state[1], False, '\n'.join(state[2]))
+
+        cmd = ['grep', '--threads=%d' % max(1, cpu_count()), '-z', '-n', '-I',
+               '--no-color']
+        if ignore_case:
+            cmd.append('-i')
+        cmd += ['-e', pattern]
+        prefix = None
+        if rev:
+            cmd.append(rev)
+            prefix = rev + ':'
+        state = [None, 0, [], False]
+        state[0] = GitCmd(self._url, cmd, _cmd_done_cb, _line_cb, state,
+                          caller='grep')
+        return state[0]
+
+    def request_tracked_paths(self, done_cb):
+        def _cmd_done_cb(lines, success, key):
+            if success:
+                paths = [p for p in '\n'.join(lines).split('\0') if p]
+                self._tracked_paths = (key, paths)
+                done_cb(True, paths)
+            else:
+                done_cb(False, None, '\n'.join(lines))
+
+        # the list can only change when git rewrite the index
+        key = stat_key(os.path.join(self._url, '.git', 'index'))
+        if key is not None and key == self._tracked_paths[0]:
+            done_cb(True, self._tracked_paths[1])
+        else:
+            GitCmd(self._url, ['ls-files', '-z'], _cmd_done_cb, None, key,
+                   caller='palette', priority=self._priority(PRIO_REFRESH))
+
+    def _commit_graph_files(self):
+        info = os.path.join(self._url, '.git', 'objects', 'info')
+        chain = os.path.join(info, 'commit-graphs', 'commit-graph-chain')
+        if os.path.exists(chain):
+            hashes = (file_get_contents(chain) or '').split()
+            return [os.path.join(info, 'commit-graphs', 'graph-%s.graph' % h)
+                    for h in hashes]
+        return [os.path.join(info, 'commit-graph')]
+
+    def has_changed_path_filters(self):
+        # the commit-graph header is followed by the table of chunks,
+        # the filters are stored in the BIDX and BDAT chunks
+        for path in self._commit_graph_files():
+            try:
+                with open(path, 'rb') as f:
+                    header = f.read(8)
+                    if len(header) != 8 or header[:4] != b'CGPH':
+                        return False
+                    num_chunks = bytearray(header)[6]
+                    table = f.read(12 * num_chunks)
+            except (IOError, OSError):
+                return False
+            ids = [table[i:i+4] for i in range(0, len(table), 12)]
+            if b'BIDX' not in ids or b'BDAT' not in ids:
+                return False
+        return True
+
+    def write_changed_path_filters(self, done_cb):
+        def _cmd_done_cb(lines, success):
+            if success:
+                done_cb(success)
+            else:
+                done_cb(success, '\n'.join(lines))
+
+        cmd = ['commit-graph', 'write', '--reachable', '--changed-paths']
+        GitCmd(self._url, cmd, _cmd_done_cb, caller='commit-graph',
+               priority=self._priority(PRIO_REFRESH))
+
+    def request_new_commits(self, done_cb, prog_cb, known_tips):
+        def _cmd_done_cb(lines, success, lines_buf):
+            if success:
+                done_cb(success, tips)
+            else:
+                done_cb(success, None, '\n'.join(lines_buf))
+
+        def _cmd_line_cb(line, lines_buf):
+            lines_buf.append(line)
+            if line and line[-1] == chr(0x03):
+                prog_cb(self._parse_commit('\n'.join(lines_buf)[:-1]))
+                del lines_buf[:]
+
+        # the tips are the commits pointed by the refs at the last refresh
+        tips = sorted(self._decorations)
+        revs = tips + ['^' + sha for sha in known_tips]
+        cmd = ['log', '--reverse', '--ignore-missing', '--stdin',
+               '--pretty=tformat:' + self.LOG_FORMAT]
+        GitCmd(self._url, cmd, _cmd_done_cb, _cmd_line_cb, list(),
+               caller='search', stdin='\n'.join(revs) + '\n',
+               priority=PRIO_PREFETCH)
+
+    # fmt = 'format:{"sha":"%H", "parents":"%P", 
+    #                "author":"%an", "author_email":"%ae",
+    #                "committer":"%cn", "committer_email":"%ce", 
+    #                "commit_ts":%ct, "title":"%s",
+    #                "body": "%b"}'
+    # Use ascii char 00 as field separator and char 03 as commits separator
+    # Refs are not requested (%d), they are taken from self._decorations
+    LOG_FORMAT = '%x00'.join(('%H','%P','%an','%ae','%cn','%ce','%ct',
+                              '%s','%b')) + '%x03'
+
+    def _parse_commit(self, buf):
+        """ Create a Commit from a single record of LOG_FORMAT """
+        c = Commit()
+        (c.sha, c.parents, c.author, c.author_email, c.committer,
+         c.committer_email,c.commit_date, 
+         c.title, c.message) = buf.split(chr(0x00))
+        if c.parents:
+            c.parents = c.parents.split(' ')
+        if c.commit_date:
+            c.commit_date = datetime.fromtimestamp(int(c.commit_date))
+        if c.sha in self._decorations:
+            c.heads, c.remotes, c.tags = self.refs_at(c.sha)
+        return c
 
     def request_diff(self, done_cb, prog_cb=None, ref1=None, ref2=None,
-                     path=None, only_staged=False, revert=False, compare=False):
-        cmd = 'diff --no-prefix'
+                     path=None, only_staged=False, revert=False, compare=False,
+                     parent=None):
+        cmd = ['diff', '--no-prefix']
         if only_staged:
-            cmd += ' --staged'
+            cmd.append('--staged')
         if ref2 and ref1:
             if compare:
-                cmd += ' %s...%s' % (ref1, ref2)
+                cmd.append('%s...%s' % (ref1, ref2))
             else:
-                cmd += ' %s..%s' % (ref1, ref2)
-        elif revert and ref1:
-            cmd += ' %s..%s^' % (ref1, ref1)
+                cmd.append('%s..%s' % (ref1, ref2))
         elif ref1:
-            cmd += ' %s^..%s' % (ref1, ref1)
+            # an explicit parent sha does not need the shell to be quoted
+            parent = parent or ref1 + '^'
+            cmd += [ref1, parent] if revert else [parent, ref1]
         else:
-            cmd += ' HEAD'
-        if path is not None:
-            cmd += " -- '%s'" % path
-        GitCmd(self._url, cmd, done_cb, prog_cb)
+            cmd.append('HEAD')
+        if isinstance(path, (list, tuple)):
+            cmd += ['--'] + list(path)
+        elif path is not None:
+            cmd += ['--', path]
+        GitCmd(self._url, cmd, done_cb, prog_cb, caller='diff')
+
+    def _parse_name_status(self, lines):
+        L = []
+        for line in lines:
+            if not line:
+                continue
+            split = line.split('\t')
+            if line[0] in ('R', 'C'): # ex: "R100\told\tnew"
+                L.append((line[0], split[1], split[2]))
+            else:
+                L.append((split[0], split[1], None))
+        # A: addition of a file
+        # C: copy of a file into a new one
+        # D: deletion of a file
+        # M: modification of the contents or mode of a file
+        # R: renaming of a file
+        # T: change in the type of the file
+        # U: file is unmerged (you must complete the merge before it can be committed)
+        # X: "unknown" change type (most probably a bug, please report it)
+
+        # TODO handle unmerged ??
+        return L
 
     def request_changes(self, done_cb, commit1=None, commit2=None):
         def _cmd_done_cb(lines, success):
-            L = []
-            for line in lines:
-                split = line.split('\t')
-                if line[0] == 'R':
-                    L.append(('R', split[1], split[2]))
-                else:
-                    L.append((split[0], split[1], None))
-            # A: addition of a file
-            # C: copy of a file into a new one
-            # D: deletion of a file
-            # M: modification of the contents or mode of a file
-            # R: renaming of a file
-            # T: change in the type of the file
-            # U: file is unmerged (you must complete the merge before it can be committed)
-            # X: "unknown" change type (most probably a bug, please report it)
+            done_cb(success, self._parse_name_status(lines))
 
-            # TODO handle unmerged ??
-
-            done_cb(success, L)
-
-        cmd = 'diff --name-status --find-renames'
+        cmd = ['diff', '--name-status', '--find-renames']
         if commit2 and commit2.sha and commit1 and commit1.sha:
-            cmd += ' %s %s' % (commit1.sha, commit2.sha)
+            cmd += [commit1.sha, commit2.sha]
         elif commit1 is not None and commit1.sha:
-            cmd += ' %s^ %s' % (commit1.sha, commit1.sha)
+            cmd += [commit1.first_parent or commit1.sha + '^', commit1.sha]
         else:
-            cmd += ' HEAD'
-        GitCmd(self._url, cmd, _cmd_done_cb)
+            cmd.append('HEAD')
+        GitCmd(self._url, cmd, _cmd_done_cb, caller='changes')
+
+    def request_compare_changes(self, done_cb, ref1, ref2):
+        def _cmd_done_cb(lines, success):
+            if success:
+                done_cb(success, self._parse_name_status(lines))
+            else:
+                done_cb(success, [])
+
+        cmd = ['diff', '--name-status', '--find-renames', '%s...%s' % (ref1, ref2)]
+        GitCmd(self._url, cmd, _cmd_done_cb, caller='changes')
 
     @property
     def remotes(self):
@@ -1316,44 +2722,79 @@ class GitBackend(Repository):
             else:
                 done_cb(success, None, '\n'.join(lines))
 
-        cmd = 'remote show %s' % remote_name
+        cmd = ['remote', 'show', remote_name]
         GitCmd(self._url, cmd, _cmd_done_cb)
 
     def remote_add(self, done_cb, name, url):
         def _cmd_done_cb(lines, success):
             self._fetch_local_config(done_cb)
 
-        cmd = 'remote add %s %s' % (name, url)
+        cmd = ['remote', 'add', name, url]
         GitCmd(self._url, cmd, _cmd_done_cb)
 
     def remote_del(self, done_cb, name):
         def _cmd_done_cb(lines, success):
             self._fetch_local_config(done_cb)
 
-        cmd = 'remote remove %s' % (name)
+        cmd = ['remote', 'remove', name]
         GitCmd(self._url, cmd, _cmd_done_cb)
 
     def remote_url_set(self, done_cb, name, new_url):
         def _cmd_done_cb(lines, success):
             self._fetch_local_config(done_cb)
 
-        cmd = 'remote set-url %s %s' % (name, new_url)
+        cmd = ['remote', 'set-url', name, new_url]
         GitCmd(self._url, cmd, _cmd_done_cb)
 
     def stage_file(self, done_cb, path, *args):
+        self.stage_paths(done_cb, [path], *args)
+
+    def unstage_file(self, done_cb, path, *args):
+        self.unstage_paths(done_cb, [path], *args)
+
+    def stage_paths(self, done_cb, paths, *args):
         def _cmd_done_cb(lines, success):
             self.refresh(done_cb, *args)
 
-        _mod, _staged, _path, _new = self._status.changes[path]
-        cmd = '%s "%s"' % ('rm' if _mod == 'D' else 'add', path)
-        GitCmd(self._url, cmd, _cmd_done_cb)
+        if not paths: # 'add --all' without paths would add everything
+            done_cb(True, *args)
+            return
+        # --all to also stage the removal of deleted files
+        cmd = ['add', '--all', '--pathspec-from-file=-', '--pathspec-file-nul']
+        GitCmd(self._url, cmd, _cmd_done_cb, stdin=self._nul_paths(paths))
 
-    def unstage_file(self, done_cb, path, *args):
+    def unstage_paths(self, done_cb, paths, *args):
         def _cmd_done_cb(lines, success):
             self.refresh(done_cb, *args)
 
-        cmd = 'reset HEAD "%s"' % path
-        GitCmd(self._url, cmd, _cmd_done_cb)
+        if not paths: # 'reset' without paths would unstage everything
+            done_cb(True, *args)
+            return
+        cmd = ['reset', '-q', 'HEAD', '--pathspec-from-file=-',
+               '--pathspec-file-nul']
+        GitCmd(self._url, cmd, _cmd_done_cb, stdin=self._nul_paths(paths))
+
+    def discard_paths(self, done_cb, paths):
+        def _cmd_done_cb(lines, success):
+            if success:
+                self.refresh(done_cb)
+            else:
+                done_cb(success, '\n'.join(lines))
+
+        if not paths:
+            done_cb(True)
+            return
+        cmd = ['checkout', '--pathspec-from-file=-', '--pathspec-file-nul']
+        GitCmd(self._url, cmd, _cmd_done_cb, stdin=self._nul_paths(paths))
+
+    @staticmethod
+    def _nul_paths(paths):
+        """ Paths for --pathspec-from-file=- --pathspec-file-nul
+
+        The paths are literal, else names with glob chars (like "a[1].txt")
+        would also match other files (like "a1.txt").
+        """
+        return ''.join(':(literal)' + p + '\0' for p in paths)
 
     def commit(self, done_cb, msg):
         def _cmd_done_cb(lines, success):
@@ -1362,7 +2803,7 @@ class GitBackend(Repository):
             else:
                 done_cb(success, '\n'.join(lines))
 
-        cmd = 'commit -m "{}"'.format(msg.replace('"', '\\"'))
+        cmd = ['commit', '-m', msg]
         GitCmd(self._url, cmd, _cmd_done_cb)
 
     def revert(self, done_cb, commit, auto_commit=False, commit_msg=None):
@@ -1374,7 +2815,7 @@ class GitBackend(Repository):
             else:
                 done_cb(success, '\n'.join(lines))
 
-        cmd = 'revert --no-edit --no-commit %s' % commit.sha
+        cmd = ['revert', '--no-edit', '--no-commit', commit.sha]
         GitCmd(self._url, cmd, _cmd_done_cb)
 
     def cherrypick(self, done_cb, commit, auto_commit=False, commit_msg=None):
@@ -1386,7 +2827,7 @@ class GitBackend(Repository):
             else:
                 done_cb(success, '\n'.join(lines))
 
-        cmd = 'cherry-pick --no-commit %s' % commit.sha
+        cmd = ['cherry-pick', '--no-commit', commit.sha]
         GitCmd(self._url, cmd, _cmd_done_cb)
 
     def discard(self, done_cb, files=[]):
@@ -1396,18 +2837,17 @@ class GitBackend(Repository):
             else:
                 done_cb(success, '\n'.join(lines))
         if files:
-            cmd = 'checkout %s' % (' '.join(files))
+            self.discard_paths(done_cb, files)
         else:
-            cmd = 'reset --hard HEAD'
-        GitCmd(self._url, cmd, _cmd_done_cb)
+            GitCmd(self._url, ['reset', '--hard', 'HEAD'], _cmd_done_cb)
 
     def pull(self, done_cb, progress_cb, remote, rbranch, lbranch):
-        cmd = 'pull -v --progress %s %s:%s' % (remote, rbranch, lbranch)
+        cmd = ['pull', '-v', '--progress', remote, '%s:%s' % (rbranch, lbranch)]
         GitCmdRAW(self._url, cmd, done_cb, progress_cb)
 
     def push(self, done_cb, progress_cb, remote, rbranch, lbranch, dry=False):
-        cmd = 'push -v --progress %s %s %s:%s ' % ('--dry-run' if dry else '',
-                                                   remote, lbranch, rbranch)
+        cmd = ['push', '-v', '--progress'] + (['--dry-run'] if dry else []) + \
+              [remote, '%s:%s' % (lbranch, rbranch)]
         GitCmdRAW(self._url, cmd, done_cb, progress_cb)
 
     def branch_create(self, done_cb, name, revision, track=False):
@@ -1418,7 +2858,7 @@ class GitBackend(Repository):
                 done_cb(success, '\n'.join(lines))
 
         track = '--track' if track else '--no-track'
-        cmd = 'branch %s %s %s' % (track, name, revision)
+        cmd = ['branch', track, name, revision]
         GitCmd(self._url, cmd, _cmd_done_cb)
 
     def branch_delete(self, done_cb, name, force=False):
@@ -1428,7 +2868,7 @@ class GitBackend(Repository):
             else:
                 done_cb(success, '\n'.join(lines))
 
-        cmd = 'branch %s %s' % ('-D' if force else '-d', name)
+        cmd = ['branch', '-D' if force else '-d', name]
         GitCmd(self._url, cmd, _cmd_done_cb)
 
     def branch_merge(self, done_cb, name, fast_forward):
@@ -1438,9 +2878,68 @@ class GitBackend(Repository):
             else:
                 done_cb(success, '\n'.join(lines))
 
-        cmd = 'merge --no-commit --%s %s' % (fast_forward, name)
+        cmd = ['merge', '--no-commit', '--' + fast_forward, name]
         GitCmd(self._url, cmd, _cmd_done_cb)
 
+    def request_merge_conflicts(self, done_cb, ref1, ref2):
+        def _batch_check_done_cb(lines, success):
+            # "<sha> commit <size>" for each ref, "<ref> missing" if invalid
+            shas = [l.split(' ')[0] for l in lines
+                    if l.split(' ')[1:2] == ['commit']]
+            if not success or len(shas) != 2:
+                done_cb(False, [], '\n'.join(lines))
+                return
+            key = (shas[0], shas[1])
+            if key in self._merge_conflicts_cache:
+                done_cb(True, self._merge_conflicts_cache[key])
+                return
+            cmd = ['merge-tree', '--write-tree', '--name-only', '--no-messages',
+                   key[0], key[1]]
+            GitCmd(self._url, cmd, _merge_tree_done_cb, None, key)
+
+        def _merge_tree_done_cb(lines, success, key):
+            # first line is the resulting tree, followed by conflicted paths
+            # (exit code is 1 when conflicts are found, so ignore success)
+            if lines and _is_object_id(lines[0]):
+                conflicts = sorted(set(l for l in lines[1:] if l))
+                self._merge_conflicts_cache[key] = conflicts
+                done_cb(True, conflicts)
+            else:
+                # git < 2.38, fallback to the old trivial merge-tree
+                cmd = ['merge-base', key[0], key[1]]
+                GitCmd(self._url, cmd, _merge_base_done_cb, None, key)
+
+        def _merge_base_done_cb(lines, success, key):
+            if not success or not lines:
+                done_cb(False, [], '\n'.join(lines))
+                return
+            cmd = ['merge-tree', lines[0], key[0], key[1]]
+            GitCmd(self._url, cmd, _legacy_merge_tree_done_cb, None, key)
+
+        def _legacy_merge_tree_done_cb(lines, success, key):
+            # search "changed in both" sections that contain conflict markers
+            conflicts = set()
+            path = None
+            for line in lines:
+                if line and not line[0].isspace() and not line[0] in '+-@ ':
+                    path = None # a new section start
+                    if line == 'changed in both':
+                        path = ''
+                elif path == '' and line.startswith(('  our ', '  their ')):
+                    path = line.split(None, 3)[3]
+                elif path and line.startswith('+<<<<<<< '):
+                    conflicts.add(path)
+            if success:
+                conflicts = sorted(conflicts)
+                self._merge_conflicts_cache[key] = conflicts
+                done_cb(True, conflicts)
+            else:
+                done_cb(False, [], '\n'.join(lines))
+
+        # the refs are given on stdin: "^{commit}" do not need the shell
+        GitCmd(self._url, ['cat-file', '--batch-check'], _batch_check_done_cb,
+               stdin='%s^{commit}\n%s^{commit}\n' % (ref1, ref2))
+
     def tag_delete(self, done_cb, name):
         def _cmd_done_cb(lines, success):
             if success:
@@ -1448,7 +2947,7 @@ class GitBackend(Repository):
             else:
                 done_cb(success, '\n'.join(lines))
 
-        GitCmd(self._url, 'tag --delete "%s"' % name, _cmd_done_cb)
+        GitCmd(self._url, ['tag', '--delete', name], _cmd_done_cb)
 
     def tag_create(self, done_cb, name, annotated=True, msg=None):
         def _cmd_done_cb(lines, success):
@@ -1458,9 +2957,9 @@ class GitBackend(Repository):
                 done_cb(success, '\n'.join(lines))
 
         if annotated:
-            cmd = 'tag -a "%s" -m "%s"' % (name, msg)
+            cmd = ['tag', '-a', name, '-m', msg or '']
         else:
-            cmd = 'tag "%s"' % (name)
+            cmd = ['tag', name]
         GitCmd(self._url, cmd, _cmd_done_cb)
 
     def _common_done_cb(self, lines, success, user_cb):
@@ -1470,30 +2969,33 @@ class GitBackend(Repository):
             user_cb(success, '\n'.join(lines))
 
     def stash_save(self, done_cb, msg=None, include_untracked=False):
-        cmd = 'stash save %s %s' % (
-              '--include-untracked' if include_untracked else '', msg or '')
+        cmd = ['stash', 'save']
+        if include_untracked:
+            cmd.append('--include-untracked')
+        if msg:
+            cmd.append(msg)
         GitCmd(self._url, cmd, self._common_done_cb, None, done_cb)
 
     def stash_clear(self, done_cb):
-        GitCmd(self._url, 'stash clear', self._common_done_cb, None, done_cb)
+        GitCmd(self._url, ['stash', 'clear'], self._common_done_cb, None, done_cb)
 
     def stash_request_diff(self, done_cb, stash_item):
-        cmd = 'stash show -p "%s"' % stash_item.ref
+        cmd = ['stash', 'show', '-p', stash_item.ref]
         GitCmd(self._url, cmd, done_cb)
 
     def stash_drop(self, done_cb, stash_item):
-        cmd = 'stash drop "%s"' % stash_item.ref
+        cmd = ['stash', 'drop', stash_item.ref]
         GitCmd(self._url, cmd, self._common_done_cb, None, done_cb)
 
     def stash_apply(self, done_cb, stash_item):
-        cmd = 'stash apply "%s"' % stash_item.ref
+        cmd = ['stash', 'apply', stash_item.ref]
         GitCmd(self._url, cmd, self._common_done_cb, None, done_cb)
 
     def stash_pop(self, done_cb, stash_item):
-        cmd = 'stash pop "%s"' % stash_item.ref
+        cmd = ['stash', 'pop', stash_item.ref]
         GitCmd(self._url, cmd, self._common_done_cb, None, done_cb)
 
     def stash_branch(self, done_cb, stash_item, branch_name):
-        cmd = 'stash branch %s "%s"' % (branch_name, stash_item.ref)
+        cmd = ['stash', 'branch', branch_name, stash_item.ref]
         GitCmd(self._url, cmd, self._common_done_cb, None, done_cb)
 
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2014-2015 Davide Andreoli <dave@gurumeditation.it>
+#
+# This file is part of Egitu.
+#
+# Egitu is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# Egitu is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Egitu.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+from collections import OrderedDict
+
+from efl.ecore import Timer
+
+from egitu.utils import options
+from egitu.vcs import repo_factory
+
+
+class Workspace(object):
+    """ Keep many repositories loaded at the same time
+
+    The list of repos is stored in options.workspace_repos. All the repos
+    stay loaded, the inactive ones are refreshed in background (with the
+    prefetch priority, so only a few git processes run at the same time)
+    together with the first page of their history. Switching to a repo
+    of the workspace show the cached data immediately.
+    """
+    REFRESH_INTERVAL = 300 # seconds between background refreshes
+    COMMITS_TO_CACHE = 200
+
+    def __init__(self, app):
+        self.app = app
+        self._repos = OrderedDict() # url: Repository instance
+        self._commits = dict()      # url: [Commit, ...] (first DAG page)
+        self._refreshing = set()    # urls with a background job running
+        self._timer = None
+
+    def load(self):
+        """ Load all the repos of the workspace (in background) """
+        for url in options.workspace_repos:
+            repo = repo_factory(url)
+            if repo is None:
+                continue
+            self._repos[url] = repo
+            commits = repo.snapshot_load(url)
+            if commits is not None:
+                self._commits[url] = commits
+            repo.background = True
+            self._refreshing.add(url)
+            repo.load_from_url(url, self._bg_refresh_done_cb_for(repo))
+
+        if self._timer is None:
+            self._timer = Timer(self.REFRESH_INTERVAL, self._timer_cb)
+
+    @property
+    def urls(self):
+        return list(self._repos.keys())
+
+    def __contains__(self, url):
+        return url in self._repos
+
+    def repo_get(self, url):
+        return self._repos.get(url)
+
+    def commits_get(self, url):
+        return self._commits.get(url)
+
+    def commits_set(self, url, commits):
+        self._commits[url] = list(commits)
+
+    def is_refreshing(self, url):
+        return url in self._refreshing
+
+    def add(self, repo):
+        """ Add an already loaded repo to the workspace """
+        if repo.url not in self._repos:
+            self._repos[repo.url] = repo
+            options.workspace_repos = self.urls
+
+    def remove(self, url):
+        if self._repos.pop(url, None) is not None:
+            self._commits.pop(url, None)
+            options.workspace_repos = self.urls
+
+    def _timer_cb(self):
+        for url, repo in self._repos.items():
+            if repo.background and url not in self._refreshing:
+                self._refreshing.add(url)
+                repo.refresh(self._bg_refresh_done_cb_for(repo))
+        return True # renew the timer
+
+    def _bg_refresh_done_cb_for(self, repo):
+        return lambda success, *args: self._bg_refresh_done_cb(success, repo)
+
+    def _bg_refresh_done_cb(self, success, repo):
+        if success and repo.background:
+            # also prefetch the first page of the history
+            commits = []
+            repo.request_commits(
+                lambda success, err_msg=None: \
+                    self._bg_commits_done_cb(success, repo, commits),
+                commits.append, ref1='HEAD',
+                max_count=self.COMMITS_TO_CACHE)
+        else:
+            self._bg_job_done(repo)
+
+    def _bg_commits_done_cb(self, success, repo, commits):
+        if success:
+            self._commits[repo.url] = commits
+            repo.snapshot_save(commits)
+        self._bg_job_done(repo)
+
+    def _bg_job_done(self, repo):
+        self._refreshing.discard(repo.url)
+        # the user switched to this repo while it was refreshing
+        if not repo.background and repo is self.app.repo:
+            self.app.action_update_all()